@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from airtime_utils import *
+
+class SimulatedClock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+# Backlogged senders: traffic class and payload size in bytes
+SENDERS = [
+    ("text", TRAFFIC_TEXT, 120),
+    ("control", TRAFFIC_CONTROL, 200),
+    ("bulk", TRAFFIC_BULK, 2000)
+]
+
+def jain_index(values):
+    if not values or not any(values):
+        return 0.0
+    return sum(values)**2/(len(values)*sum(v*v for v in values))
+
+def run(seconds, step, bitrate, duty_cycle, emergency_at=None, voice=None):
+    clock = SimulatedClock()
+    scheduler = AirtimeScheduler(duty_cycle=duty_cycle, bitrate=bitrate, clock=clock)
+    tickets = {name: scheduler.request(traffic_class, size) for name, traffic_class, size in SENDERS}
+    emergency = None
+    emergency_latency = None
+
+    while clock.now < seconds:
+        clock.now += step
+        if voice and voice[0] <= clock.now < voice[1]:
+            if TRAFFIC_VOICE not in scheduler.reserved:
+                scheduler.reserve(TRAFFIC_VOICE, 0.5)
+        elif TRAFFIC_VOICE in scheduler.reserved:
+            scheduler.release(TRAFFIC_VOICE)
+
+        if emergency_at != None and emergency == None and clock.now >= emergency_at:
+            emergency = scheduler.request(TRAFFIC_EMERGENCY, 33)
+        if emergency != None and emergency_latency == None and scheduler.poll(emergency):
+            emergency_latency = clock.now-emergency_at
+
+        for name, traffic_class, size in SENDERS:
+            if scheduler.poll(tickets[name]):
+                tickets[name] = scheduler.request(traffic_class, size)
+
+    return scheduler, emergency_latency
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate backlogged senders sharing one airtime budget")
+    parser.add_argument("--seconds", type=float, default=3600, help="Simulated time (default: 3600)")
+    parser.add_argument("--bitrate", type=int, default=1200, help="Interface bitrate in bps (default: 1200)")
+    parser.add_argument("--duty-cycle", type=float, default=0.1, help="Duty cycle limit (default: 0.1)")
+    parser.add_argument("--step", type=float, default=0.05, help="Simulation step in seconds (default: 0.05)")
+    args = parser.parse_args()
+
+    scheduler, latency = run(args.seconds, args.step, args.bitrate, args.duty_cycle, emergency_at=args.seconds/2)
+    status = scheduler.status()
+    total = sum(status["used"].values())
+    weights = sum(TRAFFIC_WEIGHTS[traffic_class] for _, traffic_class, _ in SENDERS)
+
+    print(f"[INFO] {args.seconds:.0f} s at {args.bitrate} bps, duty cycle limit {args.duty_cycle*100:g}%")
+    print(f"[INFO] Airtime used        : {total:8.1f} s ({100*total/args.seconds:.2f}% of wall time, incl. the {scheduler.capacity:g} s starting burst)")
+    print(f"[INFO] {'class':<10} {'sent':>6} {'share':>8} {'target':>8}")
+    shares = []
+    for name, traffic_class, _ in SENDERS:
+        share = status["used"][traffic_class]/total
+        target = TRAFFIC_WEIGHTS[traffic_class]/weights
+        shares.append(share/target)
+        print(f"[INFO] {name:<10} {status['granted'][traffic_class]:>6} {share*100:>7.1f}% {target*100:>7.1f}%")
+    print(f"[INFO] Weighted fairness   : {jain_index(shares):.4f} (Jain's index, 1.0 is perfect)")
+    print(f"[INFO] Emergency latency   : {latency:.2f} s with all classes backlogged")
+
+    half = args.seconds/2
+    scheduler, _ = run(args.seconds, args.step, args.bitrate, args.duty_cycle, voice=(half, args.seconds))
+    used = sum(scheduler.status()["used"].values())
+    print(f"[INFO] With a call reserving half the budget for the second half: {100*used/args.seconds:.2f}% used by other traffic")
+
+if __name__ == "__main__":
+    main()
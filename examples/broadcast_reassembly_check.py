@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Memory bound check for the broadcast reassembler. Fragments of partial
+# bulletins are fed the way a flood of junk frames or one huge bulletin
+# would arrive, and after every fragment the buffered bytes must stay at or
+# under the limit:
+#   - many bulletins that each only ever get their first fragments
+#   - growing bulletins that were all opened before the buffer filled up
+#   - one bulletin larger than the whole buffer on its own
+# A real bulletin sent in between must still come through.
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from broadcast_utils import *
+
+MDU = 383
+
+def frame(msg_id, index, count, chunk):
+    return FRAME_HEADER.pack(BROADCAST_FRAME_MAGIC, 0, msg_id, index, count) + chunk
+
+def feed_all(reassembler, packets):
+    # Returns the largest pending_bytes seen and the bulletins completed
+    peak, texts = 0, []
+    for packet in packets:
+        text = reassembler.feed(packet)
+        if text != None:
+            texts.append(text)
+        peak = max(peak, reassembler.stats()["pending_bytes"])
+    return peak, texts
+
+def junk_flood(rng, bulletins, chunk):
+    return [frame(rng.getrandbits(32), rng.randrange(255), 255, rng.randbytes(chunk)) for _ in range(bulletins)]
+
+def growing(rng, bulletins, rounds, chunk):
+    # Every bulletin is opened first, then all of them grow together
+    ids = [rng.getrandbits(32) for _ in range(bulletins)]
+    return [frame(msg_id, index, 255, rng.randbytes(chunk)) for index in range(rounds) for msg_id in ids]
+
+def oversized(rng, limit, chunk):
+    count = min(MAX_FRAGMENTS, limit//chunk+8)
+    msg_id = rng.getrandbits(32)
+    packets = [frame(msg_id, index, count, rng.randbytes(chunk)) for index in range(count)]
+    # Repeats after the drop must not open the bulletin again
+    return packets + packets[:4]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that broadcast reassembly never buffers more than its byte limit")
+    parser.add_argument("--limit", type=int, default=64*1024, help="Reassembly byte limit (default: 65536)")
+    parser.add_argument("--seed", type=int, default=2025, help="Seed for the fragments")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    chunk = MDU-FRAME_HEADER.size
+    text = "Water point at the school is open again. "*40
+    bulletin = fragment_broadcast(text, mdu=MDU)
+    passed = True
+
+    cases = [
+        ("Junk flood", junk_flood(rng, 4000, chunk)),
+        ("Growing bulletins", growing(rng, BroadcastReassembler.MAX_PENDING, 40, chunk)),
+        ("Oversized bulletin", oversized(rng, args.limit, chunk)),
+    ]
+    for label, packets in cases:
+        reassembler = BroadcastReassembler(max_pending_bytes=args.limit)
+        middle = len(packets)//2
+        peak, texts = feed_all(reassembler, packets[:middle]+bulletin+packets[middle:])
+        stats = reassembler.stats()
+        ok = peak <= args.limit and texts == [text]
+        passed &= ok
+        print(f"[{'PASS' if ok else 'FAIL'}] {label}: peak {peak} of {args.limit} bytes, "
+              f"{stats['evicted']} evicted, {stats['oversized']} oversized, real bulletin {'delivered' if texts == [text] else 'LOST'}")
+
+    reassembler = BroadcastReassembler(max_pending_bytes=args.limit)
+    peak, _ = feed_all(reassembler, oversized(rng, args.limit, chunk))
+    ok = peak <= args.limit and reassembler.stats()["pending_bytes"] == 0 and reassembler.stats()["oversized"] == 1
+    passed &= ok
+    print(f"[{'PASS' if ok else 'FAIL'}] A bulletin larger than the buffer is dropped once and its repeats ignored")
+
+    print(f"[{'PASS' if passed else 'FAIL'}] {'The byte limit held after every fragment' if passed else 'A check failed'}")
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from database_utils import DB, SQL_MSG_RECV
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql", "lrecomm.sql")
+
+def make_db(path):
+    with sqlite3.connect(path) as conn:
+        with open(SCHEMA_PATH) as f:
+            conn.executescript(f.read())
+
+def bench_connect_per_insert(path, count):
+    # What database_utils used to do: open, insert, commit, close for every row
+    started = time.time()
+    for i in range(count):
+        with sqlite3.connect(path) as conn:
+            c = conn.cursor()
+            c.execute("""
+                INSERT INTO msg_recv (senderHash, content)
+                VALUES (?, ?)
+            """, ("ab"*16, f"message {i}"))
+            conn.commit()
+        conn.close()
+    return count/(time.time()-started)
+
+def bench_db_object(path, count, threads):
+    db = DB(path)
+    per_thread = count//threads
+
+    def job():
+        for i in range(per_thread):
+            db.execute(SQL_MSG_RECV, ("ab"*16, f"message {i}"))
+
+    started = time.time()
+    workers = [threading.Thread(target=job) for _ in range(threads)]
+    for w in workers: w.start()
+    for w in workers: w.join()
+    elapsed = time.time()-started
+    db.close()
+    return per_thread*threads/elapsed
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare inserts/sec of connect-per-insert against the pooled DB object"
+    )
+    parser.add_argument("--count", type=int, default=2000, help="Rows to insert per run (default: 2000)")
+    parser.add_argument("--threads", type=int, default=3, help="Writer threads for the DB object run (default: 3)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before_path = os.path.join(tmp, "before.db")
+        after_path = os.path.join(tmp, "after.db")
+        make_db(before_path)
+        make_db(after_path)
+
+        before = bench_connect_per_insert(before_path, args.count)
+        after = bench_db_object(after_path, args.count, args.threads)
+
+    print(f"[INFO] connect per insert : {before:10.1f} inserts/sec")
+    print(f"[INFO] DB object (WAL)    : {after:10.1f} inserts/sec ({args.threads} threads)")
+    print(f"[INFO] speedup            : {after/before:10.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from RNS.vendor import umsgpack
+from envelope_utils import LEGACY_TITLES, MSG_TYPE_TEXT, MSG_TYPE_VOICEMAIL, MSG_TYPE_FILE
+from globals import FIELD_TYPE, DISPLAY_NAME
+
+FIELD_FILE_ATTACHMENTS = 0x05
+FIELD_AUDIO = 7
+
+def lxmf_payload(title, content, fields):
+    # LXMF packs [timestamp, title, content, fields] with msgpack; the
+    # signature and hashes around it are the same size either way
+    return umsgpack.packb([time.time(), title.encode("utf-8"), content.encode("utf-8"), fields])
+
+def legacy(msg_type, content, fields):
+    return lxmf_payload(LEGACY_TITLES[msg_type], content, fields)
+
+def typed(msg_type, content, fields):
+    fields = dict(fields)
+    fields[FIELD_TYPE] = msg_type
+    return lxmf_payload("", content, fields)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare on-air LXMF payload size of title and typed dispatch")
+    parser.add_argument("--text", default="Need water at the shelter, 3 people injured", help="Sample text message")
+    args = parser.parse_args()
+
+    audio = [0x10, b"\x00"*1200]
+    attachment = [["report.txt", b"\x00"*2048]]
+    cases = [
+        ("text", MSG_TYPE_TEXT, args.text, args.text, {}),
+        ("voicemail", MSG_TYPE_VOICEMAIL, f"Voicemail from {DISPLAY_NAME}", "", {FIELD_AUDIO: audio}),
+        ("file", MSG_TYPE_FILE, f"{DISPLAY_NAME}_report.txt", "", {FIELD_FILE_ATTACHMENTS: attachment})
+    ]
+
+    print(f"[INFO] {'kind':<10} {'legacy':>8} {'typed':>8} {'saved':>8}")
+    for name, msg_type, legacy_content, typed_content, fields in cases:
+        before = len(legacy(msg_type, legacy_content, fields))
+        after = len(typed(msg_type, typed_content, fields))
+        print(f"[INFO] {name:<10} {before:>8} {after:>8} {before-after:>8} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Bytes on air and CPU time of file attachment compression over a mixed
+# corpus: text, CSV, logs and JSON next to photos, archives and random
+# binaries. Each file is run through the adaptive choice, and through each
+# codec forced, so the cost of compressing what will not shrink shows up.
+# The same choice applies to LXMF attachments and streamed transfers; a
+# streamed file costs one more offer round trip when it goes compressed,
+# which is not counted here. --dir benchmarks a directory of real files
+# instead.
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from codec_utils import *
+
+KB = 1024
+# Packed FIELD_FILE_CODEC entry on compressed attachments
+CODEC_FIELD_BYTES = 4
+CODEC_NAMES = {FILE_CODEC_NONE: "none", FILE_CODEC_ZSTD: "zstd", FILE_CODEC_LZMA: "lzma"}
+
+def make_corpus(rng, size):
+    streets = ["Main St", "Oak Ave", "River Rd", "Hill St", "Church Ln", "School Rd"]
+    needs = ["water", "food", "blankets", "insulin", "diapers", "fuel", "batteries"]
+    corpus = {}
+
+    rows = ["shelter,address,capacity,occupied,needs,contact"]
+    while sum(len(r)+1 for r in rows) < size:
+        rows.append(f"Shelter {len(rows)},{rng.randint(1, 999)} {rng.choice(streets)},{rng.randint(20, 400)},"
+                    f"{rng.randint(0, 400)},{rng.choice(needs)},+1555{rng.randint(0, 999999):06d}")
+    corpus["shelters.csv"] = "\n".join(rows).encode()
+
+    lines = []
+    while sum(len(l)+1 for l in lines) < size:
+        lines.append(f"2026-10-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d} "
+                     f"rnsd[{rng.randint(100, 999)}]: Link to <{rng.getrandbits(64):016x}> "
+                     f"{rng.choice(['established', 'closed', 'timed out', 'stale'])}, rtt {rng.random():.3f}s")
+    corpus["rnsd.log"] = "\n".join(lines).encode()
+
+    words = ("road closed flooding bridge shelter water food medical team arrived area safe "
+             "evacuation north south checkpoint injured missing power lines down").split()
+    text = []
+    while sum(len(w)+1 for w in text) < size:
+        text.append(rng.choice(words)+("." if rng.random() < 0.1 else ""))
+    corpus["sitrep.txt"] = " ".join(text).encode()
+
+    features = [{"type": "Feature", "properties": {"name": f"Point {i}", "kind": rng.choice(["shelter", "hazard", "water"])},
+                 "geometry": {"type": "Point", "coordinates": [round(rng.uniform(-120, -118), 5), round(rng.uniform(34, 36), 5)]}}
+                for i in range(size//160)]
+    corpus["map.geojson"] = json.dumps({"type": "FeatureCollection", "features": features}).encode()
+
+    corpus["photo.jpg"] = b"\xff\xd8\xff\xe0" + rng.randbytes(size)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("shelters.csv", corpus["shelters.csv"])
+        z.writestr("sitrep.txt", corpus["sitrep.txt"])
+    corpus["reports.zip"] = archive.getvalue()
+    corpus["firmware.bin"] = rng.randbytes(size)
+    # Binary with structure that an extension check alone would miss
+    corpus["telemetry.bin"] = b"".join(bytes([0x7e, i % 8, 0, 0]) + rng.randint(0, 4000).to_bytes(2, "big") for i in range(size//6))
+    return corpus
+
+def load_dir(path):
+    corpus = {}
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        if os.path.isfile(full):
+            with open(full, "rb") as f:
+                corpus[name] = f.read()
+    return corpus
+
+def run(name, data, codec=None):
+    # codec None is the adaptive choice, otherwise that codec is forced
+    started = time.process_time()
+    if codec == None:
+        codec, payload = compress_file(name, data, LOCAL_CAPS)
+    else:
+        payload = compress_bytes(data, codec)
+    compress_ms = (time.process_time()-started)*1000
+
+    started = time.process_time()
+    reader = DecompressReader(io.BytesIO(payload), codec)
+    restored = b"".join(iter(lambda: reader.read(64*KB), b""))
+    decompress_ms = (time.process_time()-started)*1000
+    assert restored == data, f"{name} did not survive {CODEC_NAMES[codec]}"
+
+    on_air = len(payload)+(CODEC_FIELD_BYTES if codec != FILE_CODEC_NONE else 0)
+    return codec, on_air, compress_ms, decompress_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bytes on air and CPU time of file attachment compression")
+    parser.add_argument("--size", type=int, default=256, help="Size of each generated file in KiB (default: 256)")
+    parser.add_argument("--dir", default=None, help="Benchmark the files in this directory instead")
+    parser.add_argument("--seed", type=int, default=2025, help="Seed for the generated corpus")
+    args = parser.parse_args()
+
+    corpus = load_dir(args.dir) if args.dir else make_corpus(random.Random(args.seed), args.size*KB)
+    forced = file_codecs(LOCAL_CAPS)
+    if not zstandard:
+        print("[INFO] zstandard is not installed, zstd is not available")
+
+    raw_total = sum(len(data) for data in corpus.values())
+    totals = {"adaptive": [0, 0.0, 0.0]}
+    totals.update({CODEC_NAMES[codec]: [0, 0.0, 0.0] for codec in forced})
+
+    print(f"[INFO] {'File':<16} {'Raw':>10} {'Codec':>6} {'On air':>10} {'Ratio':>7} {'Comp ms':>9} {'Decomp ms':>10}")
+    for name, data in corpus.items():
+        codec, on_air, compress_ms, decompress_ms = run(name, data)
+        print(f"[INFO] {name:<16} {len(data):>10} {CODEC_NAMES[codec]:>6} {on_air:>10} "
+              f"{len(data)/on_air:>6.2f}x {compress_ms:>9.1f} {decompress_ms:>10.1f}")
+        for key, result in [("adaptive", (on_air, compress_ms, decompress_ms))] + \
+                           [(CODEC_NAMES[c], run(name, data, c)[1:]) for c in forced]:
+            totals[key][0] += result[0]
+            totals[key][1] += result[1]
+            totals[key][2] += result[2]
+
+    print(f"[INFO] Raw total           : {raw_total} bytes")
+    for key, (on_air, compress_ms, decompress_ms) in totals.items():
+        print(f"[INFO] {key:<20}: {on_air:>10} bytes on air ({100*(1-on_air/raw_total):5.1f}% saved), "
+              f"{compress_ms:8.1f} ms compress, {decompress_ms:7.1f} ms decompress")
+
+if __name__ == "__main__":
+    main()
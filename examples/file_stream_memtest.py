@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# Memory ceiling check for streamed file transfers. Sends a file larger than
+# the memory the sender and receiver are allowed to use between two
+# Reticulum instances joined over loopback TCP, then verifies the copy and
+# reports each side's peak resident memory. With --limit the address space
+# of both processes is capped, so a whole-file read fails outright.
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from loopback_utils import *
+
+APP_NAME = "lrecomm"
+MB = 1024*1024
+
+def peak_rss():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def run_receiver(root, port, loglevel, limit, results):
+    import RNS
+    from transfer_utils import FileReceiver
+    start_reticulum(root, "receiver", SERVER_CONFIG, port, loglevel, limit=limit)
+    identity = RNS.Identity()
+    receiver = FileReceiver(save_dir=os.path.join(root, "received"),
+                            on_received=lambda sender, path, file_hash, name: results.put(("received", path, peak_rss())))
+    receiver.start(identity, APP_NAME)
+    results.put(("ready", identity.get_public_key(), peak_rss()))
+    while True:
+        time.sleep(1)
+
+def run_sender(root, port, loglevel, limit, path, public_key, results):
+    import RNS
+    from transfer_utils import FileSender
+    start_reticulum(root, "sender", CLIENT_CONFIG, port, loglevel, limit=limit)
+    identity = RNS.Identity()
+    source = RNS.Destination(identity, RNS.Destination.IN, RNS.Destination.SINGLE, "lxmf", "delivery")
+    peer = RNS.Identity(create_keys=False)
+    peer.load_public_key(public_key)
+    destination = RNS.Destination(peer, RNS.Destination.OUT, RNS.Destination.SINGLE, "lxmf", "delivery")
+
+    started = time.time()
+    last_report = [0]
+    def progress():
+        if time.time()-last_report[0] > 10:
+            last_report[0] = time.time()
+            results.put(("progress", transfer.progress, peak_rss()))
+    transfer = FileSender(APP_NAME).send(destination, source, path,
+                                         lambda: results.put(("sent", True, None, time.time()-started, peak_rss())),
+                                         lambda reason: results.put(("sent", False, reason, time.time()-started, peak_rss())),
+                                         progress)
+    while True:
+        time.sleep(1)
+
+def make_file(path, size, sparse):
+    with open(path, "wb") as f:
+        if sparse:
+            f.truncate(size)
+            return
+        remaining = size
+        while remaining > 0:
+            chunk = os.urandom(min(MB, remaining))
+            f.write(chunk)
+            remaining -= len(chunk)
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a file larger than the memory ceiling and report peak memory")
+    parser.add_argument("--ceiling", type=int, default=256, help="Memory ceiling per process in MiB (default: 256)")
+    parser.add_argument("--size", type=int, default=None, help="File size in MiB (default: twice the ceiling)")
+    parser.add_argument("--limit", action="store_true", help="Enforce the ceiling with RLIMIT_AS in both processes")
+    parser.add_argument("--sparse", action="store_true", help="Use a sparse file of zeros instead of random data")
+    parser.add_argument("--port", type=int, default=42472, help="Loopback TCP port (default: 42472)")
+    parser.add_argument("--loglevel", type=int, default=2, help="Reticulum log level (default: 2)")
+    args = parser.parse_args()
+
+    ceiling = args.ceiling*MB
+    size = (args.size or 2*args.ceiling)*MB
+    # Address space is far larger than resident memory for a threaded
+    # Python process, give the limit headroom and keep malloc arenas few
+    limit = 4*ceiling if args.limit else None
+    os.environ["MALLOC_ARENA_MAX"] = "2"
+
+    from transfer_utils import file_digest
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    root = tempfile.mkdtemp(prefix="lrecomm-memtest-")
+    processes = []
+    try:
+        source = os.path.join(root, "payload.bin")
+        print(f"[INFO] Writing {size//MB} MiB test file")
+        make_file(source, size, args.sparse)
+        digest = file_digest(source)
+
+        receiver = ctx.Process(target=run_receiver, args=(root, args.port, args.loglevel, limit, results), daemon=True)
+        receiver.start()
+        processes.append(receiver)
+        _, public_key, _ = results.get(timeout=60)
+
+        sender = ctx.Process(target=run_sender, args=(root, args.port, args.loglevel, limit, source, public_key, results), daemon=True)
+        sender.start()
+        processes.append(sender)
+
+        sent, received = None, None
+        while sent == None or (sent[1] and received == None):
+            event = results.get(timeout=600)
+            if event[0] == "progress":
+                print(f"[INFO] {round(event[1]*100)}% sent, sender peak {event[2]//MB} MiB")
+            elif event[0] == "sent":
+                sent = event
+            elif event[0] == "received":
+                received = event
+
+        _, ok, reason, elapsed, sender_peak = sent
+        if not ok:
+            print(f"[FAIL] Transfer failed after {elapsed:.0f} s: {reason}")
+            return 1
+        _, path, receiver_peak = received
+        intact = os.path.getsize(path) == size and file_digest(path) == digest
+
+        print(f"[INFO] File size           : {size//MB} MiB")
+        print(f"[INFO] Transfer            : {elapsed:.0f} s, {size/elapsed/1024:.0f} KiB/s")
+        print(f"[INFO] Sender peak RSS     : {sender_peak//MB} MiB")
+        print(f"[INFO] Receiver peak RSS   : {receiver_peak//MB} MiB")
+        print(f"[INFO] Copy intact         : {intact}")
+        passed = intact and max(sender_peak, receiver_peak) < ceiling
+        print(f"[{'PASS' if passed else 'FAIL'}] Peak memory {'stayed under' if passed else 'exceeded'} the {args.ceiling} MiB ceiling"
+              if intact else "[FAIL] Received copy does not match")
+        return 0 if passed else 1
+    finally:
+        for process in processes:
+            process.terminate()
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Crash check for the LogWriter write-behind queue. A child process logs
+# numbered rows as fast as it can, flushing every so often and reporting
+# each flush that returned. The parent SIGKILLs it at a random moment, most
+# often in the middle of a batch, then opens the database and checks that:
+#   - the committed rows are exactly 0..k-1, in insert order, so no batch
+#     was half applied and no row overtook one queued before it
+#   - every row before the last acknowledged flush is there
+#   - the database passes integrity_check
+# An in-process run first checks that rows the writer cannot commit, for
+# any reason, neither stop the writer nor hang flush().
+
+import argparse
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from database_utils import DB, LogWriter
+
+SQL_CREATE = "CREATE TABLE IF NOT EXISTS crash_log (n INTEGER NOT NULL, payload TEXT)"
+SQL_INSERT = "INSERT INTO crash_log (n, payload) VALUES (?, ?)"
+
+class BadParams():
+    # Fails while sqlite3 reads the parameters, with an error that is not a
+    # sqlite3.Error
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, index):
+        raise RuntimeError("bad parameter")
+
+def run_child(path, flush_every, max_queue):
+    db = DB(path)
+    db.execute(SQL_CREATE)
+    writer = LogWriter(db, max_queue=max_queue)
+    writer.start()
+    n = 0
+    while True:
+        writer.enqueue(SQL_INSERT, (n, "x"*64))
+        n += 1
+        if n % flush_every == 0:
+            writer.flush()
+            print(n, flush=True)
+
+def check_errors(path):
+    db = DB(path)
+    db.execute(SQL_CREATE)
+    writer = LogWriter(db)
+    writer.enqueue(SQL_INSERT, (0, "before"))
+    writer.enqueue(SQL_INSERT, BadParams())
+    writer.enqueue("INSERT INTO no_such_table VALUES (?)", (1,))
+    writer.enqueue(SQL_INSERT, (1, "after"))
+    flushed = writer.flush(timeout=10)
+    alive = writer.thread.is_alive()
+    rows = [n for n, in db.query("SELECT n FROM crash_log ORDER BY rowid")]
+    writer.stop(timeout=10)
+    db.close()
+    return flushed and alive and rows == [0, 1] and writer.failed == 2
+
+def run_trial(path, args, rng):
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", path,
+                              "--flush-every", str(args.flush_every), "--max-queue", str(args.max_queue)],
+                             stdout=subprocess.PIPE, text=True)
+    # The acknowledgements are a few bytes each, the pipe holds them all
+    time.sleep(rng.uniform(args.min_run, args.max_run))
+    os.kill(child.pid, signal.SIGKILL)
+    child.wait()
+    output = child.stdout.read()
+    child.stdout.close()
+    # Everything the child printed before it died counts as acknowledged
+    lines = [line for line in output.split("\n") if line.strip().isdigit()]
+    acknowledged = int(lines[-1]) if lines else 0
+
+    conn = sqlite3.connect(path)
+    rows = [n for n, in conn.execute("SELECT n FROM crash_log ORDER BY rowid")]
+    integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    conn.close()
+    in_order = rows == list(range(len(rows)))
+    return len(rows), acknowledged, in_order, integrity
+
+def main():
+    parser = argparse.ArgumentParser(description="Kill a process mid-batch and check what the LogWriter committed")
+    parser.add_argument("--trials", type=int, default=10, help="Kills to try (default: 10)")
+    parser.add_argument("--min-run", type=float, default=0.5, help="Shortest run before the kill in seconds (default: 0.5)")
+    parser.add_argument("--max-run", type=float, default=2.0, help="Longest run before the kill in seconds (default: 2)")
+    parser.add_argument("--flush-every", type=int, default=500, help="Rows between acknowledged flushes (default: 500)")
+    parser.add_argument("--max-queue", type=int, default=256, help="Writer queue size, small to exercise back-pressure (default: 256)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the kill times")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.flush_every, args.max_queue)
+        return 0
+
+    rng = random.Random(args.seed)
+    passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        errors_ok = check_errors(os.path.join(tmp, "errors.db"))
+        print(f"[{'PASS' if errors_ok else 'FAIL'}] Failing rows are skipped, the writer keeps running and flush() returns")
+        passed &= errors_ok
+
+        for trial in range(args.trials):
+            path = os.path.join(tmp, f"crash_{trial}.db")
+            committed, acknowledged, in_order, integrity = run_trial(path, args, rng)
+            ok = in_order and committed >= acknowledged and integrity == "ok"
+            passed &= ok
+            print(f"[{'PASS' if ok else 'FAIL'}] Trial {trial}: {committed} rows committed, {acknowledged} acknowledged, "
+                  f"{'in order' if in_order else 'OUT OF ORDER OR GAPS'}, integrity {integrity}")
+
+    print(f"[{'PASS' if passed else 'FAIL'}] {'Every kill left a consistent prefix' if passed else 'A check failed'}")
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+# Loopback Reticulum instances for the example scripts. One process runs
+# SERVER_CONFIG and listens on 127.0.0.1, the others join it with
+# CLIENT_CONFIG, so nodes run as separate processes without radio hardware.
+
+import os
+import resource
+
+SERVER_CONFIG = """
+[reticulum]
+  enable_transport = {transport}
+  share_instance = No
+
+[logging]
+  loglevel = {loglevel}
+
+[interfaces]
+  [[Loopback Server]]
+    type = TCPServerInterface
+    enabled = yes
+    listen_ip = 127.0.0.1
+    listen_port = {port}
+"""
+
+CLIENT_CONFIG = """
+[reticulum]
+  enable_transport = {transport}
+  share_instance = No
+
+[logging]
+  loglevel = {loglevel}
+
+[interfaces]
+  [[Loopback Client]]
+    type = TCPClientInterface
+    enabled = yes
+    target_host = 127.0.0.1
+    target_port = {port}
+"""
+
+def start_reticulum(root, name, template, port, loglevel, transport=False, limit=None):
+    # limit caps the address space of the calling process, set before RNS
+    # is imported so its allocations count too
+    if limit:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    import RNS
+    configdir = os.path.join(root, name)
+    os.makedirs(configdir, exist_ok=True)
+    with open(os.path.join(configdir, "config"), "w") as f:
+        f.write(template.format(port=port, loglevel=loglevel, transport="Yes" if transport else "No"))
+    return RNS.Reticulum(configdir=configdir)
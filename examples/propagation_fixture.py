@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+# Local stand-in for store-and-forward delivery. Starts an LXMF propagation
+# node and two clients as separate processes, joined over a loopback TCP
+# interface. The receiver is only online for short windows. The sender
+# queues messages in the outbox, which leaves them on the node once direct
+# delivery has failed, and the receiver acknowledges what it picks up from
+# there. The run checks that every such row in the sender's database went
+# to propagated and then delivered, and reports how many messages arrived
+# and what the receiver's syncs cost on the wire. No radio hardware is
+# needed.
+
+import argparse
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from loopback_utils import *
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql")
+IDENTITY_TIMEOUT = 30
+RECEIPT_TIMEOUT = 30
+SENDER_SYNC_INTERVAL = 30
+POLL_INTERVAL = 0.5
+
+def run_node(root, port, loglevel, results, stop):
+    import RNS, LXMF
+    start_reticulum(root, "node", SERVER_CONFIG, port, loglevel, transport=True)
+    router = LXMF.LXMRouter(identity=RNS.Identity(), storagepath=os.path.join(root, "node", "lxmf"))
+    router.enable_propagation()
+    router.announce_propagation_node()
+    results.put(("node", router.propagation_destination.hash.hex()))
+    stop.wait()
+
+def open_db(root, name):
+    # Each client is a device of its own, with its own database
+    from database_utils import db
+    db.path = os.path.join(root, f"{name}.db")
+    db.migrate(SQL_DIR)
+    return db
+
+def build_text(destination, source, content):
+    # The fields lrecomm puts on a text, without the codec
+    import LXMF
+    from globals import FIELD_CAPS, FIELD_TYPE
+    from codec_utils import LOCAL_CAPS
+    from envelope_utils import MSG_TYPE_TEXT
+    msg = LXMF.LXMessage(destination, source, content, "", desired_method=LXMF.LXMessage.DIRECT)
+    msg.fields[FIELD_TYPE] = MSG_TYPE_TEXT
+    msg.fields[FIELD_CAPS] = LOCAL_CAPS
+    return msg
+
+def build_receipt(destination, source, msg_hash):
+    import LXMF
+    from globals import FIELD_CAPS, FIELD_TYPE, FIELD_RECEIPT
+    from codec_utils import LOCAL_CAPS
+    from envelope_utils import MSG_TYPE_RECEIPT
+    msg = LXMF.LXMessage(destination, source, "", "", desired_method=LXMF.LXMessage.DIRECT)
+    msg.fields[FIELD_TYPE] = MSG_TYPE_RECEIPT
+    msg.fields[FIELD_RECEIPT] = bytes.fromhex(msg_hash)
+    msg.fields[FIELD_CAPS] = LOCAL_CAPS
+    return msg
+
+def start_client(root, name, port, loglevel, node_hash):
+    # Returns (router, identity, destination, outbox), set up the way
+    # lrecomm sets itself up. Identity and LXMF storage persist across runs.
+    import RNS, LXMF
+    from outbox_utils import Outbox, KIND_MESSAGE, KIND_RECEIPT
+    from path_utils import PathResolver
+    start_reticulum(root, name, CLIENT_CONFIG, port, loglevel)
+    identity_path = os.path.join(root, name, "identity")
+    if os.path.exists(identity_path):
+        identity = RNS.Identity.from_file(identity_path)
+    else:
+        identity = RNS.Identity()
+        identity.to_file(identity_path)
+
+    router = LXMF.LXMRouter(identity=identity, storagepath=os.path.join(root, name, "lxmf"))
+    destination = router.register_delivery_identity(identity, display_name=name)
+    router.set_outbound_propagation_node(bytes.fromhex(node_hash))
+    outbox = Outbox(PathResolver())
+    outbox.register_builder(KIND_MESSAGE, build_text)
+    outbox.register_builder(KIND_RECEIPT, build_receipt)
+    return router, identity, destination, outbox
+
+def run_receiver(root, port, loglevel, node_hash, online, results):
+    # One online window. Receipts still queued when it ends go out in the next.
+    import LXMF
+    from globals import FIELD_TYPE
+    from envelope_utils import MSG_TYPE_RECEIPT
+    from outbox_utils import KIND_RECEIPT, PRIORITY_TEXT
+    from propagation_utils import PropagationSync
+    open_db(root, "receiver")
+    router, identity, destination, outbox = start_client(root, "receiver", port, loglevel, node_hash)
+
+    def delivered(message):
+        results.put(("received", message.content_as_string()))
+        # As in lrecomm, a message picked up from the node is acknowledged
+        if getattr(message, "method", None) == LXMF.LXMessage.PROPAGATED and message.fields.get(FIELD_TYPE) != MSG_TYPE_RECEIPT:
+            outbox.enqueue(message.source_hash.hex(), KIND_RECEIPT, message.hash.hex(), PRIORITY_TEXT, coalesce=False)
+    router.register_delivery_callback(delivered)
+    outbox.start(router, destination)
+    destination.announce()
+    results.put(("receiver", destination.hash.hex()))
+
+    sync = PropagationSync(interval=online)
+    sync.router, sync.identity = router, identity
+    started = time.time()
+    time.sleep(1)
+    sync.sync()
+    # Stay online for the window, and a little longer while receipts go out
+    while time.time()-started < online or (outbox.pending() and time.time()-started < online+RECEIPT_TIMEOUT):
+        time.sleep(POLL_INTERVAL)
+    outbox.stop()
+    results.put(("sync", sync.stats()))
+
+def run_sender(root, port, loglevel, node_hash, receiver_hash, count, interval, after, results, done):
+    # Sends through the outbox, which falls back to the propagation node
+    # after the given number of failed direct attempts, and records every
+    # state each sent row passes through
+    import RNS
+    from globals import FIELD_TYPE, FIELD_RECEIPT
+    from envelope_utils import MSG_TYPE_RECEIPT
+    from database_utils import log_msg_send
+    from outbox_utils import KIND_MESSAGE, PRIORITY_TEXT
+    from propagation_utils import PropagationSync
+    db = open_db(root, "sender")
+    router, identity, source, outbox = start_client(root, "sender", port, loglevel, node_hash)
+
+    def delivered(message):
+        msg_hash = message.fields.get(FIELD_RECEIPT)
+        if message.fields.get(FIELD_TYPE) == MSG_TYPE_RECEIPT and isinstance(msg_hash, bytes):
+            outbox.confirm(msg_hash.hex(), message.source_hash.hex())
+    router.register_delivery_callback(delivered)
+    if after != None:
+        outbox.enable_propagation(after)
+    outbox.start(router, source)
+    source.announce()
+    # Receipts sent while the direct path was down wait on the node
+    sync = PropagationSync(interval=SENDER_SYNC_INTERVAL)
+    sync.start(router, identity)
+
+    # The receiver announced before we were up, ask the mesh for it
+    receiver = bytes.fromhex(receiver_hash)
+    deadline = time.time()+IDENTITY_TIMEOUT
+    while RNS.Identity.recall(receiver) == None and time.time() < deadline:
+        RNS.Transport.request_path(receiver)
+        time.sleep(1)
+    if RNS.Identity.recall(receiver) == None:
+        results.put(("error", "sender never learned the receiver identity"))
+        return
+
+    states = {}
+    def record():
+        for msg_id, state in db.query("SELECT msgID, state FROM msg_sent"):
+            seen = states.setdefault(msg_id, [])
+            if not seen or seen[-1] != state:
+                seen.append(state)
+
+    for i in range(count):
+        content = f"msg {i}"
+        outbox.enqueue(receiver_hash, KIND_MESSAGE, content, PRIORITY_TEXT, log_msg_send(receiver_hash, content))
+        paced = time.time()+interval
+        while time.time() < paced:
+            record()
+            time.sleep(POLL_INTERVAL)
+    while not done.is_set():
+        record()
+        done.wait(POLL_INTERVAL)
+    record()
+    results.put(("states", list(states.values())))
+
+def passed_through(states, *wanted):
+    # True if states holds wanted in that order, not necessarily adjacent
+    remaining = iter(states)
+    return all(state in remaining for state in wanted)
+
+def drain(results, timeout=0.0):
+    items = []
+    try:
+        while True:
+            items.append(results.get(timeout=timeout))
+    except queue.Empty:
+        pass
+    return items
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure store-and-forward delivery over a loopback propagation node")
+    parser.add_argument("--count", type=int, default=20, help="Messages to send (default: 20)")
+    parser.add_argument("--interval", type=float, default=3, help="Seconds between messages (default: 3)")
+    parser.add_argument("--online", type=float, default=20, help="Receiver online window in seconds (default: 20)")
+    parser.add_argument("--offline", type=float, default=40, help="Receiver offline gap in seconds (default: 40)")
+    parser.add_argument("--cycles", type=int, default=4, help="Receiver online windows after the first (default: 4)")
+    parser.add_argument("--port", type=int, default=42471, help="Loopback TCP port (default: 42471)")
+    parser.add_argument("--after", type=int, default=1, help="Failed direct attempts before using the node (default: 1)")
+    parser.add_argument("--no-fallback", action="store_true", help="Only try DIRECT delivery")
+    parser.add_argument("--loglevel", type=int, default=2, help="Reticulum log level (default: 2)")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    stop = ctx.Event()
+    done = ctx.Event()
+    root = tempfile.mkdtemp(prefix="lrecomm-propagation-")
+    events = []
+    try:
+        node = ctx.Process(target=run_node, args=(root, args.port, args.loglevel, results, stop), daemon=True)
+        node.start()
+        _, node_hash = results.get(timeout=30)
+        print(f"[INFO] Propagation node {node_hash} listening on 127.0.0.1:{args.port}")
+
+        # The first window introduces the receiver to the mesh
+        receiver = ctx.Process(target=run_receiver, args=(root, args.port, args.loglevel, node_hash, args.online, results))
+        receiver.start()
+        receiver_hash = None
+        while receiver_hash == None:
+            kind, value = results.get(timeout=30)
+            if kind == "receiver":
+                receiver_hash = value
+            else:
+                events.append((kind, value))
+        receiver.join()
+        events.extend(drain(results))
+
+        started = time.time()
+        sender = ctx.Process(target=run_sender, args=(root, args.port, args.loglevel, node_hash, receiver_hash,
+                                                      args.count, args.interval, None if args.no_fallback else args.after,
+                                                      results, done), daemon=True)
+        sender.start()
+
+        for cycle in range(args.cycles):
+            time.sleep(args.offline)
+            receiver = ctx.Process(target=run_receiver, args=(root, args.port, args.loglevel, node_hash, args.online, results))
+            receiver.start()
+            receiver.join()
+            events.extend(drain(results))
+
+        done.set()
+        sender.join(timeout=30)
+        events.extend(drain(results, timeout=1))
+        elapsed = time.time()-started
+    finally:
+        stop.set()
+        shutil.rmtree(root, ignore_errors=True)
+
+    received = {value for kind, value in events if kind == "received"}
+    rows = [states for kind, value in events if kind == "states" for states in value]
+    direct = sum(1 for states in rows if states[-1] == "delivered" and "propagated" not in states)
+    confirmed = sum(1 for states in rows if passed_through(states, "propagated", "delivered"))
+    unconfirmed = sum(1 for states in rows if states[-1] == "propagated")
+    failed = sum(1 for states in rows if states[-1] == "failed")
+    syncs = [value for kind, value in events if kind == "sync"]
+    sync_rx = sum(s["rx_bytes"] for s in syncs)
+    sync_tx = sum(s["tx_bytes"] for s in syncs)
+    synced = sum(s["messages"] for s in syncs)
+    errors = [value for kind, value in events if kind == "error"]
+
+    for error in errors:
+        print(f"[ERROR] {error}")
+    print(f"[INFO] Run time            : {elapsed:.0f} s, receiver online {args.online:g} s of every {args.online+args.offline:g} s")
+    print(f"[INFO] Sent                : {len(rows)} of {args.count} ({direct} direct, {confirmed+unconfirmed} via propagation node, {failed} failed)")
+    print(f"[INFO] Receipts            : {confirmed} propagated rows confirmed delivered, {unconfirmed} unconfirmed")
+    print(f"[INFO] Received            : {len(received)} ({100*len(received)/max(1, args.count):.0f}% delivery)")
+    print(f"[INFO] Syncs               : {len(syncs)}, {synced} messages downloaded")
+    print(f"[INFO] Sync bandwidth      : {sync_rx} bytes in, {sync_tx} bytes out ({sync_rx/max(1, synced):.0f} bytes in per synced message)")
+
+    if args.no_fallback:
+        return 1 if errors else 0
+    passed = not errors and confirmed > 0 and unconfirmed == 0
+    print(f"[{'PASS' if passed else 'FAIL'}] "
+          + ("Every row left on the node went to propagated, then delivered" if passed
+             else "No row went through the node" if confirmed+unconfirmed == 0
+             else "A row left on the node was never confirmed delivered"))
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+# Query plan regression check. Migrates a scratch database, fills it with
+# enough history that a scan would hurt, and asserts with EXPLAIN QUERY PLAN
+# that the conversation and unread-voicemail queries still use their
+# indexes. Exits non-zero if a schema or query change loses one.
+
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from database_utils import DB, SQL_MESSAGES, SQL_UNREAD_VMS
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql")
+
+CHECKS = [
+    ("Conversation history", SQL_MESSAGES, ("ab"*16, "ab"*16), ["msg_sent_receiver_time", "msg_recv_sender_time"]),
+    ("Unread voicemails", SQL_UNREAD_VMS, (), ["vm_recv_unread_time"]),
+]
+
+def fill(db, rng, peers=50, rows=5000):
+    hashes = [f"{rng.getrandbits(128):032x}" for _ in range(peers)]
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO msg_sent (receiverHash, content) VALUES (?, ?)",
+                         [(rng.choice(hashes), f"message {i}") for i in range(rows)])
+        conn.executemany("INSERT INTO msg_recv (senderHash, content) VALUES (?, ?)",
+                         [(rng.choice(hashes), f"message {i}") for i in range(rows)])
+        conn.executemany("INSERT INTO vm_recv (senderHash, wavpath, unread) VALUES (?, ?, ?)",
+                         [(rng.choice(hashes), f"vm_{i}.wav", int(rng.random() < 0.05)) for i in range(rows)])
+        conn.execute("ANALYZE")
+
+def plan(db, sql, params):
+    return [row[-1] for row in db.query(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def main():
+    passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DB(os.path.join(tmp, "plan.db"))
+        version = db.migrate(SQL_DIR)
+        fill(db, random.Random(3))
+        print(f"[INFO] Schema version {version}")
+        for label, sql, params, indexes in CHECKS:
+            steps = plan(db, sql, params)
+            missing = [index for index in indexes if not any(f"INDEX {index}" in step for step in steps)]
+            passed &= not missing
+            for step in steps:
+                print(f"[INFO]   {step}")
+            print(f"[{'FAIL' if missing else 'PASS'}] {label} uses {', '.join(indexes)}"
+                  + (f", missing {', '.join(missing)}" if missing else ""))
+        db.close()
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
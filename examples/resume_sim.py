@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+# Resumable transfer check over a flaky link. Two Reticulum instances are
+# joined through a TCP proxy that stands in for a radio interface: it caps
+# throughput and kills the connection at random, and can restart the
+# receiver outright. The sender keeps retrying until the file is through.
+# The run reports how many bytes crossed the proxy against the file size,
+# with resume on and, with --compare, with resume off.
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from loopback_utils import *
+
+APP_NAME = "lrecomm"
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql")
+KB = 1024
+RETRY_WAIT = 5
+
+def open_ledger(root, name, resume):
+    # The receiver's own database, as on a separate device. The sender
+    # keeps no transfer state, resume is entirely the receiver's bitmap.
+    from database_utils import DB
+    from resume_utils import TransferLedger
+    from transfer_utils import MemoryLedger
+    if not resume:
+        class ForgetfulLedger(MemoryLedger):
+            def load(self, direction, file_hash, peer_hash):
+                return None
+        return ForgetfulLedger()
+    db = DB(os.path.join(root, f"{name}.db"))
+    db.migrate(SQL_DIR)
+    return TransferLedger(db)
+
+def run_receiver(root, port, loglevel, resume, results):
+    import RNS
+    from transfer_utils import FileReceiver
+    start_reticulum(root, "receiver", SERVER_CONFIG, port, loglevel)
+    identity_path = os.path.join(root, "receiver.identity")
+    if os.path.exists(identity_path):
+        identity = RNS.Identity.from_file(identity_path)
+    else:
+        identity = RNS.Identity()
+        identity.to_file(identity_path)
+    receiver = FileReceiver(save_dir=os.path.join(root, "received"), ledger=open_ledger(root, "receiver", resume),
+                            on_received=lambda sender, path, file_hash, name: results.put(("received", path)))
+    receiver.start(identity, APP_NAME)
+    results.put(("ready", identity.get_public_key()))
+    while True:
+        time.sleep(1)
+
+def run_sender(root, port, loglevel, resume, path, public_key, stall, results):
+    import RNS
+    from transfer_utils import FileSender
+    start_reticulum(root, "sender", CLIENT_CONFIG, port, loglevel)
+    identity = RNS.Identity()
+    source = RNS.Destination(identity, RNS.Destination.IN, RNS.Destination.SINGLE, "lxmf", "delivery")
+    peer = RNS.Identity(create_keys=False)
+    peer.load_public_key(public_key)
+    destination = RNS.Destination(peer, RNS.Destination.OUT, RNS.Destination.SINGLE, "lxmf", "delivery")
+    sender = FileSender(APP_NAME)
+
+    attempts, resumed_chunks = 0, 0
+    while True:
+        attempts += 1
+        done = threading.Event()
+        outcome = {}
+        last_progress = [time.time(), 0.0]
+        transfer = sender.send(destination, source, path,
+                               lambda: (outcome.update(ok=True), done.set()),
+                               lambda reason: (outcome.update(ok=False, reason=reason), done.set()))
+        # A link over a dead interface can take a long time to time out,
+        # the outbox cancels stalled transfers the same way
+        while not done.wait(1):
+            if transfer.progress != last_progress[1]:
+                last_progress[:] = [time.time(), transfer.progress]
+            elif time.time()-last_progress[0] > stall:
+                transfer.cancel("stalled")
+        resumed_chunks += transfer.resumed
+        results.put(("attempt", attempts, outcome.get("ok"), outcome.get("reason"), transfer.chunks_sent, transfer.chunks))
+        if outcome.get("ok"):
+            results.put(("sent", attempts, resumed_chunks))
+            return
+        time.sleep(RETRY_WAIT)
+
+class FlakyProxy():
+    # Relays TCP between the sender and the receiver at rate bytes per
+    # second in each direction, and drops every connection after an
+    # exponentially distributed time with the given mean
+    def __init__(self, listen_port, target_port, rate, mean_drop):
+        self.listen_port = listen_port
+        self.target_port = target_port
+        self.rate = rate
+        self.mean_drop = mean_drop
+        self.lock = threading.Lock()
+        self.sockets = []
+        self.relayed = 0
+        self.drops = 0
+        self.should_run = True
+
+    def start(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", self.listen_port))
+        self.server.listen()
+        threading.Thread(target=self.__accept, daemon=True).start()
+        if self.mean_drop:
+            threading.Thread(target=self.__killer, daemon=True).start()
+
+    def stop(self):
+        self.should_run = False
+        self.drop()
+        self.server.close()
+
+    def drop(self):
+        with self.lock:
+            sockets, self.sockets = self.sockets, []
+        for s in sockets:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            s.close()
+
+    def __accept(self):
+        while self.should_run:
+            try:
+                client, _ = self.server.accept()
+                target = socket.create_connection(("127.0.0.1", self.target_port))
+            except OSError:
+                continue
+            with self.lock:
+                self.sockets.extend([client, target])
+            threading.Thread(target=self.__relay, args=(client, target), daemon=True).start()
+            threading.Thread(target=self.__relay, args=(target, client), daemon=True).start()
+
+    def __relay(self, source, sink):
+        try:
+            while True:
+                data = source.recv(512)
+                if not data:
+                    break
+                time.sleep(len(data)/self.rate)
+                sink.sendall(data)
+                with self.lock:
+                    self.relayed += len(data)
+        except OSError:
+            pass
+        for s in (source, sink):
+            try:
+                s.close()
+            except OSError:
+                pass
+
+    def __killer(self):
+        while self.should_run:
+            time.sleep(random.expovariate(1/self.mean_drop))
+            if self.should_run:
+                self.drops += 1
+                self.drop()
+
+def run(args, resume):
+    from transfer_utils import file_digest
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    root = tempfile.mkdtemp(prefix="lrecomm-resume-")
+    proxy = FlakyProxy(args.port, args.port+1, args.rate, args.drop)
+    processes = {}
+    def start_receiver():
+        processes["receiver"] = ctx.Process(target=run_receiver, args=(root, args.port+1, args.loglevel, resume, results), daemon=True)
+        processes["receiver"].start()
+    try:
+        source = os.path.join(root, "payload.bin")
+        with open(source, "wb") as f:
+            f.write(os.urandom(args.size*KB))
+        digest = file_digest(source)
+
+        start_receiver()
+        _, public_key = results.get(timeout=60)
+        proxy.start()
+        processes["sender"] = ctx.Process(target=run_sender, args=(root, args.port, args.loglevel, resume, source,
+                                                                  public_key, args.stall, results), daemon=True)
+        processes["sender"].start()
+
+        started = time.time()
+        restarts, sent, received = 0, None, None
+        next_restart = started+random.expovariate(1/args.restart) if args.restart else None
+        while sent == None or received == None:
+            if time.time()-started > args.timeout:
+                break
+            if next_restart and time.time() > next_restart and sent == None:
+                processes["receiver"].terminate()
+                processes["receiver"].join()
+                proxy.drop()
+                start_receiver()
+                restarts += 1
+                next_restart = time.time()+random.expovariate(1/args.restart)
+            try:
+                event = results.get(timeout=1)
+            except Exception:
+                continue
+            if event[0] == "attempt":
+                _, n, ok, reason, chunks_sent, chunks = event
+                print(f"[INFO]   attempt {n}: {'done' if ok else reason}, {chunks_sent} of {chunks or '?'} chunks sent")
+            elif event[0] == "sent":
+                sent = event
+            elif event[0] == "received":
+                received = event
+        elapsed = time.time()-started
+
+        intact = received != None and file_digest(received[1]) == digest
+        return {
+            "done": intact,
+            "attempts": sent[1] if sent else None,
+            "resumed": sent[2] if sent else 0,
+            "relayed": proxy.relayed,
+            "drops": proxy.drops,
+            "restarts": restarts,
+            "elapsed": elapsed
+        }
+    finally:
+        proxy.stop()
+        for process in processes.values():
+            process.terminate()
+        shutil.rmtree(root, ignore_errors=True)
+
+def report(label, size, result):
+    print(f"[INFO] {label}")
+    print(f"[INFO]   Completed         : {result['done']} in {result['elapsed']:.0f} s, {result['attempts']} attempts")
+    print(f"[INFO]   Link drops        : {result['drops']}, receiver restarts {result['restarts']}")
+    print(f"[INFO]   Chunks resumed    : {result['resumed']}")
+    print(f"[INFO]   Bytes on the wire : {result['relayed']} ({result['relayed']/size:.2f}x the file)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a file over a link that keeps dropping and report what resume saves")
+    parser.add_argument("--size", type=int, default=256, help="File size in KiB (default: 256)")
+    parser.add_argument("--rate", type=int, default=8*KB, help="Proxy throughput in bytes per second (default: 8192)")
+    parser.add_argument("--drop", type=float, default=20, help="Mean seconds between link drops, 0 for none (default: 20)")
+    parser.add_argument("--restart", type=float, default=0, help="Mean seconds between receiver restarts, 0 for none (default: 0)")
+    parser.add_argument("--stall", type=float, default=20, help="Seconds without progress before an attempt is cancelled (default: 20)")
+    parser.add_argument("--timeout", type=float, default=1800, help="Give up after this many seconds (default: 1800)")
+    parser.add_argument("--compare", action="store_true", help="Also run with resume off")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the drop schedule")
+    parser.add_argument("--port", type=int, default=42473, help="Proxy port, the receiver listens on the next one (default: 42473)")
+    parser.add_argument("--loglevel", type=int, default=2, help="Reticulum log level (default: 2)")
+    args = parser.parse_args()
+
+    size = args.size*KB
+    runs = [("Resume on", True)]+([("Resume off", False)] if args.compare else [])
+    results = []
+    for label, resume in runs:
+        random.seed(args.seed)
+        print(f"[INFO] {label}: {args.size} KiB at {args.rate} B/s, a drop every {args.drop:g} s on average")
+        results.append((label, run(args, resume)))
+
+    for label, result in results:
+        report(label, size, result)
+    passed = all(result["done"] for _, result in results)
+    print(f"[{'PASS' if passed else 'FAIL'}] {'All runs delivered an intact copy' if passed else 'A run did not deliver an intact copy'}")
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
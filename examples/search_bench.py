@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from database_utils import DB, SQL_SEARCH, SQL_SEARCH_PEER, fts_query
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql")
+
+WORDS = ["need", "water", "food", "shelter", "injured", "medical", "help", "road", "blocked",
+         "bridge", "north", "south", "east", "west", "camp", "supplies", "fuel", "battery",
+         "radio", "team", "arrived", "leaving", "clear", "flood", "fire", "smoke", "evacuate",
+         "children", "elderly", "stable", "critical", "transport", "ETA", "tonight", "morning"]
+
+def vocabulary(rng, size):
+    # Common field vocabulary plus a long tail of place names and callsigns,
+    # drawn with Zipf-like weights so term frequencies resemble real traffic
+    tail = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9))) for _ in range(size)]
+    words = tail[:50] + WORDS + tail[50:]
+    weights = [1/(rank+1) for rank in range(len(words))]
+    return words, list(itertools.accumulate(weights))
+
+def fill(db, count, peers):
+    rng = random.Random(3620)
+    words, cum_weights = vocabulary(rng, 20000)
+    batch = []
+    conn = db.connection()
+    for i in range(count):
+        text = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 14)))
+        peer = rng.choice(peers)
+        batch.append((peer, text))
+        if len(batch) == 10000 or i == count-1:
+            table, column = ("msg_sent", "receiverHash") if i % 2 else ("msg_recv", "senderHash")
+            with conn:
+                conn.executemany(f"INSERT INTO {table} ({column}, content) VALUES (?, ?)", batch)
+            batch = []
+
+def timed(fn, runs):
+    started = time.perf_counter()
+    for _ in range(runs):
+        result = fn()
+    return (time.perf_counter()-started)/runs*1000, result
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark FTS5 message search against a LIKE scan on a synthetic corpus"
+    )
+    parser.add_argument("--count", type=int, default=1000000, help="Messages in the corpus (default: 1000000)")
+    parser.add_argument("--runs", type=int, default=20, help="Runs per query (default: 20)")
+    args = parser.parse_args()
+
+    peers = [os.urandom(16).hex() for _ in range(50)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DB(os.path.join(tmp, "search.db"))
+        db.migrate(SQL_DIR)
+
+        started = time.time()
+        fill(db, args.count, peers)
+        print(f"[INFO] Inserted {args.count} messages with FTS triggers in {time.time()-started:.1f}s")
+
+        conn = db.connection()
+        for query in ["water", "injured", "medical shelter", "bridge blocked north"]:
+            match = fts_query(query)
+            # Without an index the best a LIKE search can do is scan every row
+            like_ms, _ = timed(lambda: conn.execute(
+                "SELECT content, time FROM msg_sent WHERE content LIKE ? UNION ALL SELECT content, time FROM msg_recv WHERE content LIKE ? ORDER BY time DESC LIMIT 50",
+                (f"%{query}%", f"%{query}%")).fetchall(), max(1, args.runs//10))
+            fts_ms, rows = timed(lambda: db.query(SQL_SEARCH, (match, 50)), args.runs)
+            peer_ms, _ = timed(lambda: db.query(SQL_SEARCH_PEER, (match, peers[0], 50)), args.runs)
+            print(f"[INFO] {query!r:24} fts {fts_ms:8.2f} ms  fts+peer {peer_ms:8.2f} ms  like {like_ms:8.2f} ms  ({len(rows)} rows)")
+
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from codec_utils import compress_text, decompress_text, TEXT_CODEC_NONE
+
+SAMPLES = [
+    "Need water at the shelter, 3 people injured",
+    "We are safe at the school gym. ETA 30 minutes.",
+    "Road closed due to flooding on Main St, use the south highway",
+    "copy that, team is on the way",
+    "Patient is conscious and breathing, broken leg, requesting pickup at the bridge",
+    "Battery low, will check in every hour",
+    "How many people are at your location? Do you need food or blankets?",
+    "Gas leak reported near the church, stay where you are",
+    "All clear on the north side",
+    "ok",
+    "Received your message, standing by",
+    "Fire spreading toward the east ridge, evacuate now, meet at the checkpoint",
+    "Need insulin and oxygen for two elderly residents at the community center",
+    "Lat 35.3733 Lon -119.0187 grid 11S KU 1234 5678",
+    "Kids are fine, grandma has chest pain, ambulance requested",
+]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure bytes saved and CPU cost of dictionary text compression"
+    )
+    parser.add_argument("--count", type=int, default=20000, help="Messages to encode (default: 20000)")
+    args = parser.parse_args()
+
+    rng = random.Random(3620)
+    corpus = [rng.choice(SAMPLES) for _ in range(args.count)]
+
+    raw_bytes = sum(len(text.encode("utf-8")) for text in corpus)
+    plain_zlib = sum(min(len(text.encode("utf-8")), len(zlib.compress(text.encode("utf-8"), 9)) - 6) for text in corpus)
+
+    started = time.perf_counter()
+    encoded = [compress_text(text) for text in corpus]
+    encode_us = (time.perf_counter()-started)/args.count*1e6
+
+    started = time.perf_counter()
+    for (codec, payload), text in zip(encoded, corpus):
+        assert decompress_text(payload, codec) == text
+    decode_us = (time.perf_counter()-started)/args.count*1e6
+
+    dict_bytes = sum(len(payload) for _, payload in encoded)
+    compressed = sum(1 for codec, _ in encoded if codec != TEXT_CODEC_NONE)
+    # Compressed messages also carry the codec field, about 3 bytes packed
+    field_bytes = compressed*3
+
+    print(f"[INFO] Messages             : {args.count}")
+    print(f"[INFO] Raw UTF-8            : {raw_bytes/args.count:8.1f} bytes/msg")
+    print(f"[INFO] zlib, no dictionary  : {plain_zlib/args.count:8.1f} bytes/msg")
+    print(f"[INFO] Dictionary codec     : {(dict_bytes+field_bytes)/args.count:8.1f} bytes/msg incl. codec field")
+    print(f"[INFO] Saved                : {100*(1-(dict_bytes+field_bytes)/raw_bytes):8.1f} %")
+    print(f"[INFO] Compressed / total   : {compressed}/{args.count}")
+    print(f"[INFO] Encode               : {encode_us:8.1f} us/msg")
+    print(f"[INFO] Decode               : {decode_us:8.1f} us/msg")
+
+if __name__ == "__main__":
+    main()
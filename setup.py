@@ -5,3 +5,4 @@ pip install pyaudio
 pip install pycodec2
 pip install wave
 pip install keyboard
+pip install zstandard
@@ -0,0 +1,6 @@
+
+create index if not exists msg_sent_receiver_time on msg_sent (receiverHash, time);
+
+create index if not exists msg_recv_sender_time on msg_recv (senderHash, time);
+
+create index if not exists vm_recv_unread_time on vm_recv (unread, time);
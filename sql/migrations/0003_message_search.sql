@@ -0,0 +1,46 @@
+
+-- Full-text index over both message tables. The rowid encodes the source
+-- row: msgID*2 for msg_sent and msgID*2+1 for msg_recv.
+create virtual table if not exists msg_fts using fts5 (
+    content,
+    peerHash unindexed,
+    align unindexed,
+    time unindexed,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+
+insert into msg_fts (rowid, content, peerHash, align, time)
+    select msgID*2, content, receiverHash, align, time from msg_sent;
+
+insert into msg_fts (rowid, content, peerHash, align, time)
+    select msgID*2+1, content, senderHash, align, time from msg_recv;
+
+create trigger if not exists msg_sent_fts_insert after insert on msg_sent begin
+    insert into msg_fts (rowid, content, peerHash, align, time)
+        values (new.msgID*2, new.content, new.receiverHash, new.align, new.time);
+end;
+
+create trigger if not exists msg_sent_fts_delete after delete on msg_sent begin
+    delete from msg_fts where rowid = old.msgID*2;
+end;
+
+create trigger if not exists msg_sent_fts_update after update of content, receiverHash on msg_sent begin
+    delete from msg_fts where rowid = old.msgID*2;
+    insert into msg_fts (rowid, content, peerHash, align, time)
+        values (new.msgID*2, new.content, new.receiverHash, new.align, new.time);
+end;
+
+create trigger if not exists msg_recv_fts_insert after insert on msg_recv begin
+    insert into msg_fts (rowid, content, peerHash, align, time)
+        values (new.msgID*2+1, new.content, new.senderHash, new.align, new.time);
+end;
+
+create trigger if not exists msg_recv_fts_delete after delete on msg_recv begin
+    delete from msg_fts where rowid = old.msgID*2+1;
+end;
+
+create trigger if not exists msg_recv_fts_update after update of content, senderHash on msg_recv begin
+    delete from msg_fts where rowid = old.msgID*2+1;
+    insert into msg_fts (rowid, content, peerHash, align, time)
+        values (new.msgID*2+1, new.content, new.senderHash, new.align, new.time);
+end;
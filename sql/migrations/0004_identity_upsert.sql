@@ -0,0 +1,9 @@
+
+-- Keep the newest row per delivery destination so announces can upsert on it
+delete from identity where id not in (
+    select max(id) from identity group by lxmfHash
+);
+
+create unique index if not exists identity_lxmf on identity (lxmfHash);
+
+create index if not exists identity_rns on identity (rnsHash);
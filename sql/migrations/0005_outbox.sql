@@ -0,0 +1,18 @@
+
+-- Durable outbound queue. payload is the message text, or the path of the
+-- voicemail or file to send. logID points at the matching row in msg_sent,
+-- vm_sent or file_sent.
+create table if not exists outbox (
+    outboxID integer primary key autoincrement,
+    destHash text not null,
+    kind text not null,
+    priority integer not null,
+    payload text not null,
+    logID integer,
+    attempts integer default 0,
+    nextAttempt real default 0,
+    state text default 'queued',
+    created datetime default CURRENT_TIMESTAMP
+);
+
+create index if not exists outbox_state_priority on outbox (state, priority, outboxID);
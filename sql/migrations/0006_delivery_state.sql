@@ -0,0 +1,20 @@
+
+-- Delivery tracking for outgoing rows. state is one of queued, sent,
+-- delivered or failed; the *At columns are unix timestamps.
+alter table msg_sent add column state text;
+alter table msg_sent add column queuedAt real;
+alter table msg_sent add column sentAt real;
+alter table msg_sent add column deliveredAt real;
+alter table msg_sent add column failedAt real;
+
+alter table vm_sent add column state text;
+alter table vm_sent add column queuedAt real;
+alter table vm_sent add column sentAt real;
+alter table vm_sent add column deliveredAt real;
+alter table vm_sent add column failedAt real;
+
+alter table file_sent add column state text;
+alter table file_sent add column queuedAt real;
+alter table file_sent add column sentAt real;
+alter table file_sent add column deliveredAt real;
+alter table file_sent add column failedAt real;
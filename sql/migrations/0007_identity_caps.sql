@@ -0,0 +1,3 @@
+
+-- Capability bits a peer advertised in FIELD_CAPS, see codec_utils
+alter table identity add column caps integer default 0;
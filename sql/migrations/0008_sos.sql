@@ -0,0 +1,18 @@
+-- Latest MAYDAY heard from each peer. session changes when the peer raises
+-- a new MAYDAY; heard counts beacons received in the current session.
+-- lat/lon are null when the peer has no position fix, battery is null when
+-- unknown. active drops to 0 once the peer cancels.
+create table if not exists sos (
+    senderHash text primary key,
+    session integer not null,
+    status integer not null,
+    battery integer,
+    lat real,
+    lon real,
+    firstSeen real not null,
+    lastSeen real not null,
+    heard integer default 1,
+    active integer default 1
+);
+
+create index if not exists sos_active on sos (active, lastSeen);
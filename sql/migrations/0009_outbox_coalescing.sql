@@ -0,0 +1,3 @@
+-- When a row was queued, carried as the original timestamp of texts that
+-- are sent bundled with others
+alter table outbox add column enqueuedAt real;
@@ -0,0 +1,23 @@
+-- Content-addressed store for files and voicemails. Blobs live under
+-- str/blobs named by their SHA-256. Every file_* and vm_* row with a
+-- blobHash holds one reference. A blob at 0 refs is deleted by the first
+-- collection an hour after it was last touched. Rows written before this
+-- migration keep their own paths and a null blobHash.
+create table if not exists blobs (
+    blobHash text primary key,
+    path text not null,
+    size integer not null,
+    refs integer default 0,
+    touchedAt real not null
+);
+
+create index if not exists blobs_refs on blobs (refs);
+
+alter table file_sent add column blobHash text;
+alter table file_recv add column blobHash text;
+alter table vm_sent add column blobHash text;
+alter table vm_recv add column blobHash text;
+
+-- File names as the sender gave them, blob paths carry only the hash
+alter table file_sent add column name text;
+alter table file_recv add column name text;
@@ -0,0 +1,19 @@
+-- Chunk bitmaps of file transfers in progress, so an interrupted transfer
+-- resumes where it stopped, even across restarts. direction is 'send' or
+-- 'recv', peerHash the other side's LXMF delivery hash. path is the file
+-- being sent, or the partial file chunks are written into. Rows go once
+-- the receiver has verified the file, or when left untouched too long.
+create table if not exists transfers (
+    direction text not null,
+    fileHash text not null,
+    peerHash text not null,
+    name text not null,
+    size integer not null,
+    chunkSize integer not null,
+    bitmap blob not null,
+    path text not null,
+    updatedAt real not null,
+    primary key (direction, fileHash, peerHash)
+);
+
+create index if not exists transfers_updated on transfers (updatedAt);
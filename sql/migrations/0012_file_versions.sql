@@ -0,0 +1,3 @@
+-- Earlier versions of a file are looked up by name for delta transfers
+create index if not exists file_recv_name on file_recv (name, time);
+create index if not exists file_sent_name on file_sent (name, time);
@@ -0,0 +1,18 @@
+-- Deleting a file_* or vm_* row gives back the reference it took on its
+-- blob, whichever code path deletes it. collect() removes the blob once
+-- no rows are left.
+create trigger if not exists file_sent_blob_release after delete on file_sent when old.blobHash is not null begin
+    update blobs set refs = max(0, refs-1) where blobHash = old.blobHash;
+end;
+
+create trigger if not exists file_recv_blob_release after delete on file_recv when old.blobHash is not null begin
+    update blobs set refs = max(0, refs-1) where blobHash = old.blobHash;
+end;
+
+create trigger if not exists vm_sent_blob_release after delete on vm_sent when old.blobHash is not null begin
+    update blobs set refs = max(0, refs-1) where blobHash = old.blobHash;
+end;
+
+create trigger if not exists vm_recv_blob_release after delete on vm_recv when old.blobHash is not null begin
+    update blobs set refs = max(0, refs-1) where blobHash = old.blobHash;
+end;
@@ -0,0 +1,14 @@
+-- Rows sent through a propagation node, until the peer's receipt says it
+-- picked the message up. LXMF reports no delivery for these. msgHash is the
+-- LXMF message hash, shared by every row of a bundle. logID points at the
+-- matching row in msg_sent, vm_sent or file_sent.
+create table if not exists receipts (
+    msgHash text not null,
+    destHash text not null,
+    kind text not null,
+    logID integer not null,
+    handedAt real not null,
+    primary key (msgHash, logID)
+);
+
+create index if not exists receipts_handed on receipts (handedAt);
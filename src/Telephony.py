@@ -38,7 +38,7 @@ class Telephone(SignallingReceiver):
     ALLOW_ALL             = 0xFF
     ALLOW_NONE            = 0xFE
 
-    def __init__(self, identity, ring_time=RING_TIME, wait_time=WAIT_TIME, auto_answer=None, allowed=ALLOW_ALL, receive_sink: FileSink=None):
+    def __init__(self, identity, ring_time=RING_TIME, wait_time=WAIT_TIME, auto_answer=None, allowed=ALLOW_ALL, receive_sink: FileSink=None, auto_announce=True):
         super().__init__()
         self.identity = identity
         self.destination = RNS.Destination(self.identity, RNS.Destination.IN, RNS.Destination.SINGLE, APP_NAME, PRIMITIVE_NAME)
@@ -47,6 +47,7 @@ class Telephone(SignallingReceiver):
         self.allowed = allowed
         self.blocked = None
         self.last_announce = 0
+        self.auto_announce = auto_announce
         self.call_handler_lock = threading.Lock()
         self.pipeline_lock = threading.Lock()
         self.caller_pipeline_open_lock = threading.Lock()
@@ -141,7 +142,7 @@ class Telephone(SignallingReceiver):
         while self.destination != None:
             time.sleep(self.JOB_INTERVAL)
             if time.time() > self.last_announce+self.ANNOUNCE_INTERVAL:
-                if self.destination != None: self.announce()
+                if self.auto_announce and self.destination != None: self.announce()
 
     def __is_allowed(self, remote_identity):
         identity_hash = remote_identity.hash
@@ -0,0 +1,240 @@
+import RNS
+import time
+import threading
+from collections import deque
+
+TRAFFIC_EMERGENCY = 0
+TRAFFIC_VOICE     = 1
+TRAFFIC_TEXT      = 2
+TRAFFIC_CONTROL   = 3
+TRAFFIC_BULK      = 4
+
+TRAFFIC_NAMES = {
+    TRAFFIC_EMERGENCY: "emergency",
+    TRAFFIC_VOICE: "voice",
+    TRAFFIC_TEXT: "text",
+    TRAFFIC_CONTROL: "control",
+    TRAFFIC_BULK: "bulk"
+}
+
+# Relative share of the budget each class gets while several are backlogged.
+# Emergency traffic is not weighted, it always goes first.
+TRAFFIC_WEIGHTS = {
+    TRAFFIC_VOICE: 4,
+    TRAFFIC_TEXT: 4,
+    TRAFFIC_CONTROL: 1,
+    TRAFFIC_BULK: 2
+}
+
+# An announce without app_data: header, public key, name hash, random hash
+# and signature
+ANNOUNCE_OVERHEAD = 167
+
+class AirtimeTicket():
+    def __init__(self, traffic_class, cost):
+        self.traffic_class = traffic_class
+        self.cost = cost
+        self.granted = False
+        self.requested = None
+
+class AirtimeScheduler():
+    # Token bucket over on-air time, shared by everything lrecomm transmits.
+    #
+    # The bucket refills at DUTY_CYCLE seconds of airtime per second and
+    # holds at most DUTY_CYCLE*BURST seconds. A transmission's cost is its
+    # estimated time on air at the slowest outgoing interface's bitrate.
+    # Requests queue per traffic class; emergency traffic is served first
+    # and the other classes share what is left in proportion to
+    # TRAFFIC_WEIGHTS using start-time fair queueing, so a backlogged class
+    # cannot bank credit while idle or starve the others.
+    #
+    # request()/poll() never block and suit the scheduler loops; admit()
+    # blocks the calling thread. reserve() sets aside a fraction of the
+    # refill for traffic that is not metered here, i.e. call audio.
+    DUTY_CYCLE       = 0.1
+    BURST            = 60
+    DEFAULT_BITRATE  = 1200
+    BITRATE_REFRESH  = 30
+    MAX_WAIT         = 1.0
+
+    def __init__(self, duty_cycle=DUTY_CYCLE, burst=BURST, bitrate=None, clock=time.monotonic):
+        self.duty_cycle = duty_cycle
+        self.capacity = duty_cycle*burst
+        self.fixed_bitrate = bitrate
+        self.detected_bitrate = None
+        self.bitrate_checked = 0
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.cond = threading.Condition(self.lock)
+        self.tokens = self.capacity
+        self.refilled = clock()
+        self.reserved = {}
+        self.waiting = {traffic_class: deque() for traffic_class in TRAFFIC_NAMES}
+        self.vtime = {traffic_class: 0.0 for traffic_class in TRAFFIC_NAMES}
+        self.virtual_now = 0.0
+        self.used = {traffic_class: 0.0 for traffic_class in TRAFFIC_NAMES}
+        self.granted = {traffic_class: 0 for traffic_class in TRAFFIC_NAMES}
+        self.delayed = 0
+
+    @property
+    def bitrate(self):
+        if self.fixed_bitrate:
+            return self.fixed_bitrate
+        now = self.clock()
+        if now-self.bitrate_checked > self.BITRATE_REFRESH:
+            self.bitrate_checked = now
+            rates = [i.bitrate for i in RNS.Transport.interfaces if getattr(i, "OUT", False) and getattr(i, "bitrate", None)]
+            self.detected_bitrate = min(rates) if rates else None
+        return self.detected_bitrate or self.DEFAULT_BITRATE
+
+    def airtime(self, nbytes):
+        # Seconds on air for nbytes of payload, split into packets that each
+        # carry a full Reticulum header
+        mdu, mtu = RNS.Reticulum.MDU, RNS.Reticulum.MTU
+        packets = max(1, -(-nbytes//mdu))
+        return (nbytes+packets*(mtu-mdu))*8/self.bitrate
+
+    @property
+    def refill_rate(self):
+        return self.duty_cycle*max(0.0, 1-sum(self.reserved.values()))
+
+    def __refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens+(now-self.refilled)*self.refill_rate)
+        self.refilled = now
+
+    def __next_class(self):
+        if self.waiting[TRAFFIC_EMERGENCY]:
+            return TRAFFIC_EMERGENCY
+        backlogged = [traffic_class for traffic_class, queue in self.waiting.items() if queue]
+        if not backlogged:
+            return None
+        return min(backlogged, key=lambda traffic_class: (self.vtime[traffic_class], traffic_class))
+
+    def __grant(self):
+        self.__refill()
+        granted = False
+        while True:
+            traffic_class = self.__next_class()
+            if traffic_class == None:
+                break
+            ticket = self.waiting[traffic_class][0]
+            # A transmission larger than the bucket goes once it is full
+            # and leaves the bucket in debt
+            if self.tokens < min(ticket.cost, self.capacity):
+                break
+
+            self.waiting[traffic_class].popleft()
+            self.tokens -= ticket.cost
+            start = max(self.vtime[traffic_class], self.virtual_now)
+            self.virtual_now = start
+            self.vtime[traffic_class] = start+ticket.cost/TRAFFIC_WEIGHTS.get(traffic_class, 1)
+            self.used[traffic_class] += ticket.cost
+            self.granted[traffic_class] += 1
+            ticket.granted = True
+            granted = True
+        if granted:
+            self.cond.notify_all()
+
+    def request(self, traffic_class, nbytes):
+        ticket = AirtimeTicket(traffic_class, self.airtime(nbytes))
+        with self.lock:
+            ticket.requested = self.clock()
+            if not self.waiting[traffic_class]:
+                # A class returning from idle starts at the current virtual time
+                self.vtime[traffic_class] = max(self.vtime[traffic_class], self.virtual_now)
+            self.waiting[traffic_class].append(ticket)
+            self.__grant()
+            if not ticket.granted:
+                self.delayed += 1
+        return ticket
+
+    def poll(self, ticket):
+        with self.lock:
+            if not ticket.granted:
+                self.__grant()
+            return ticket.granted
+
+    def cancel(self, ticket):
+        # Withdraws a ticket that will not be transmitted after all. A
+        # granted one gives its airtime back to the bucket.
+        with self.lock:
+            if ticket.granted:
+                ticket.granted = False
+                self.__refill()
+                self.tokens = min(self.capacity, self.tokens+ticket.cost)
+                self.used[ticket.traffic_class] -= ticket.cost
+                self.granted[ticket.traffic_class] -= 1
+            else:
+                try:
+                    self.waiting[ticket.traffic_class].remove(ticket)
+                except ValueError:
+                    pass
+            self.__grant()
+
+    def wait_hint(self, ticket):
+        # Seconds until the bucket could cover ticket, ignoring queued tickets
+        with self.lock:
+            self.__refill()
+            missing = min(ticket.cost, self.capacity)-self.tokens
+            if missing <= 0:
+                return 0
+            rate = self.refill_rate
+            return missing/rate if rate > 0 else self.MAX_WAIT
+
+    def admit(self, traffic_class, nbytes, timeout=None):
+        # Blocks until the transmission may go. Returns False if timeout
+        # passed first, in which case nothing was charged.
+        ticket = self.request(traffic_class, nbytes)
+        deadline = None if timeout == None else time.monotonic()+timeout
+        with self.cond:
+            while not ticket.granted:
+                self.__grant()
+                if ticket.granted:
+                    break
+                wait = min(self.MAX_WAIT, self.wait_hint(ticket))
+                if deadline != None:
+                    remaining = deadline-time.monotonic()
+                    if remaining <= 0:
+                        self.cancel(ticket)
+                        return False
+                    wait = min(wait, remaining)
+                self.cond.wait(max(0.01, wait))
+        return True
+
+    def reserve(self, traffic_class, fraction):
+        with self.lock:
+            self.__refill()
+            self.reserved[traffic_class] = fraction
+
+    def release(self, traffic_class):
+        with self.lock:
+            self.__refill()
+            self.reserved.pop(traffic_class, None)
+            self.__grant()
+
+    def status(self):
+        with self.lock:
+            self.__refill()
+            return {
+                "bitrate": self.bitrate,
+                "duty_cycle": self.duty_cycle,
+                "available": max(0.0, self.tokens)/self.capacity,
+                "queued": sum(len(queue) for queue in self.waiting.values()),
+                "reserved": dict(self.reserved),
+                "used": dict(self.used),
+                "granted": dict(self.granted),
+                "delayed": self.delayed
+            }
+
+    @property
+    def status_text(self):
+        status = self.status()
+        parts = [f"Airtime {round(status['available']*100)}% of {status['duty_cycle']*100:g}% duty cycle"]
+        if status["queued"]:
+            parts.append(f"{status['queued']} waiting")
+        if TRAFFIC_VOICE in status["reserved"]:
+            parts.append("voice reserved")
+        return " | ".join(parts)
+
+airtime = AirtimeScheduler()
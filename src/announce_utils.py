@@ -0,0 +1,270 @@
+import RNS
+import time
+import random
+import threading
+
+from airtime_utils import TRAFFIC_CONTROL, ANNOUNCE_OVERHEAD
+
+def display_name_from_app_data(app_data):
+    try:
+        return app_data.decode("utf-8")
+    except Exception as e:
+        RNS.log(f"[WARN] Failed to decode announce name: {e}")
+        return "Unknown"
+
+class AnnounceIngestor():
+    # Takes announces off the RNS transport thread. ingest() only does dict
+    # work: repeats of an unchanged announce inside COALESCE_WINDOW are
+    # dropped, and announces that arrive while an earlier one from the same
+    # destination is still pending replace it. A worker thread writes the
+    # survivors through to the contact registry.
+    COALESCE_WINDOW = 60
+    MAX_PENDING     = 4096
+    PRUNE_INTERVAL  = 300
+
+    def __init__(self, registry, coalesce_window=COALESCE_WINDOW, max_pending=MAX_PENDING):
+        self.registry = registry
+        self.coalesce_window = coalesce_window
+        self.max_pending = max_pending
+        self.pending = {}
+        self.pending_cond = threading.Condition()
+        self.last_accepted = {}
+        self.last_prune = time.time()
+        self.should_run = False
+        self.busy = False
+        self.thread = None
+        self.seen = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.persisted = 0
+
+    def start(self):
+        if not self.should_run:
+            self.should_run = True
+            self.thread = threading.Thread(target=self.__worker, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.pending_cond:
+            self.should_run = False
+            self.pending_cond.notify_all()
+
+    def ingest(self, destination_hash, announced_identity, app_data):
+        self.seen += 1
+        now = time.time()
+        hex_hash = destination_hash.hex().lower()
+
+        last = self.last_accepted.get(hex_hash)
+        if last and now-last[0] < self.coalesce_window and last[1] == app_data:
+            self.deduplicated += 1
+            return False
+
+        with self.pending_cond:
+            if hex_hash in self.pending:
+                self.deduplicated += 1
+            elif len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self.last_accepted[hex_hash] = (now, app_data)
+            self.pending[hex_hash] = (announced_identity.hash.hex().lower(), app_data)
+            self.pending_cond.notify()
+        return True
+
+    def drain(self, timeout=None):
+        # Waits until everything ingested so far has been processed
+        deadline = None if timeout == None else time.time()+timeout
+        while self.pending or self.busy:
+            if deadline and time.time() > deadline: return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        return {
+            "seen": self.seen,
+            "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+            "persisted": self.persisted,
+            "pending": len(self.pending)
+        }
+
+    def __prune(self, now):
+        expired = [h for h, (at, _) in list(self.last_accepted.items()) if now-at > self.coalesce_window]
+        for hex_hash in expired:
+            self.last_accepted.pop(hex_hash, None)
+        self.last_prune = now
+
+    def __worker(self):
+        while self.should_run:
+            with self.pending_cond:
+                while self.should_run and not self.pending:
+                    self.pending_cond.wait(timeout=self.PRUNE_INTERVAL)
+                batch, self.pending = self.pending, {}
+                self.busy = True
+
+            try:
+                for hex_hash, (identity_hash, app_data) in batch.items():
+                    name = display_name_from_app_data(app_data)
+                    try:
+                        if self.registry.upsert(identity_hash, hex_hash, name):
+                            self.persisted += 1
+                    except Exception as e:
+                        RNS.log(f"Could not store announced identity {hex_hash}: {e}", RNS.LOG_ERROR)
+
+                now = time.time()
+                if now-self.last_prune > self.PRUNE_INTERVAL:
+                    self.__prune(now)
+            finally:
+                self.busy = False
+
+class AnnounceScheduler():
+    # Announces every registered destination from one thread.
+    #
+    # Each destination is re-announced after its interval, stretched by
+    # DENSITY_BACKOFF when the mesh is busy and spread by JITTER so nodes
+    # that booted together drift apart. Density is the rate of announces
+    # heard, taken from density_source() (a running count). An announce with
+    # unchanged app_data inside MIN_SPACING of the previous one is redundant
+    # and suppressed. Changing app_data announces right away. Announces go
+    # through the airtime scheduler as control traffic and are retried after
+    # RETRY_DELAY when the budget is exhausted.
+    JITTER            = 0.25
+    STARTUP_JITTER    = 5
+    MIN_SPACING       = 60
+    RETRY_DELAY       = 30
+    DENSITY_WINDOW    = 60*5
+    DENSITY_REFERENCE = 30
+    DENSITY_BACKOFF   = 4
+    MAX_SLEEP         = 30
+
+    def __init__(self, density_source=None, airtime=None):
+        self.density_source = density_source
+        self.airtime = airtime
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.entries = {}
+        self.density = 0.0
+        self.density_sample = None
+        self.should_run = False
+        self.thread = None
+        self.sent = 0
+        self.suppressed = 0
+        self.deferred = 0
+
+    def register(self, key, destination, interval, app_data=None):
+        with self.lock:
+            self.entries[key] = {
+                "destination": destination,
+                "interval": interval,
+                "app_data": app_data,
+                "last_sent": None,
+                "last_app_data": None,
+                "due": time.time()+random.uniform(0, self.STARTUP_JITTER)
+            }
+        self.wakeup.set()
+
+    def unregister(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def set_app_data(self, key, app_data):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None or entry["app_data"] == app_data:
+                return
+            entry["app_data"] = app_data
+            entry["due"] = time.time()
+        self.wakeup.set()
+
+    def start(self):
+        if not self.should_run:
+            self.should_run = True
+            self.thread = threading.Thread(target=self.__worker, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.should_run = False
+        self.wakeup.set()
+
+    def backoff(self):
+        # Interval multiplier, 1 on a quiet mesh up to DENSITY_BACKOFF
+        return min(self.DENSITY_BACKOFF, 1+self.density/self.DENSITY_REFERENCE)
+
+    def announce_now(self, key, timeout=None, force=False):
+        # Returns True if an announce went out. Without force a redundant
+        # announce is suppressed, which also counts as success.
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None:
+                return False
+            if not force and self.__redundant(entry, time.time()):
+                self.suppressed += 1
+                return True
+        return self.__announce(key, entry, timeout)
+
+    def __redundant(self, entry, now):
+        return (entry["last_sent"] != None and now-entry["last_sent"] < self.MIN_SPACING
+                and entry["last_app_data"] == entry["app_data"])
+
+    def __announce(self, key, entry, timeout):
+        app_data = entry["app_data"]
+        cost = ANNOUNCE_OVERHEAD+(len(app_data) if app_data else 0)
+        if self.airtime and not self.airtime.admit(TRAFFIC_CONTROL, cost, timeout=timeout):
+            self.deferred += 1
+            with self.lock:
+                entry["due"] = time.time()+self.RETRY_DELAY
+            RNS.log(f"Announce for {key} deferred, airtime budget exhausted", RNS.LOG_DEBUG)
+            return False
+
+        entry["destination"].announce(app_data=app_data)
+        now = time.time()
+        with self.lock:
+            self.sent += 1
+            entry["last_sent"] = now
+            entry["last_app_data"] = app_data
+            entry["due"] = now+entry["interval"]*self.backoff()*random.uniform(1-self.JITTER, 1+self.JITTER)
+        RNS.log(f"Sent {key} announce from {RNS.prettyhexrep(entry['destination'].hash)}", RNS.LOG_DEBUG)
+        return True
+
+    def __sample_density(self, now):
+        if self.density_source == None:
+            return
+        count = self.density_source()
+        if self.density_sample != None:
+            then, previous = self.density_sample
+            if now > then:
+                rate = (count-previous)*60/(now-then)
+                weight = min(1.0, (now-then)/self.DENSITY_WINDOW)
+                self.density += (rate-self.density)*weight
+        self.density_sample = (now, count)
+
+    def __worker(self):
+        while self.should_run:
+            self.wakeup.clear()
+            now = time.time()
+            self.__sample_density(now)
+            with self.lock:
+                due = [(key, entry) for key, entry in self.entries.items() if entry["due"] <= now]
+            for key, entry in due:
+                with self.lock:
+                    redundant = self.__redundant(entry, now)
+                    if redundant:
+                        self.suppressed += 1
+                        entry["due"] = entry["last_sent"]+entry["interval"]*self.backoff()
+                if not redundant:
+                    try:
+                        self.__announce(key, entry, timeout=0)
+                    except Exception as e:
+                        RNS.log(f"Could not announce {key}: {e}", RNS.LOG_ERROR)
+
+            with self.lock:
+                next_due = min([entry["due"] for entry in self.entries.values()], default=now+self.MAX_SLEEP)
+            self.wakeup.wait(max(0.1, min(self.MAX_SLEEP, next_due-time.time())))
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "suppressed": self.suppressed,
+            "deferred": self.deferred,
+            "density": self.density,
+            "backoff": self.backoff()
+        }
@@ -0,0 +1,97 @@
+import RNS
+import os
+import time
+import threading
+
+from database_utils import db
+from transfer_utils import write_temp, discard, sync_dir, file_digest, remove_partials
+
+BLOB_DIR = "../str/blobs"
+
+SQL_BLOB_ADD   = """
+    INSERT INTO blobs (blobHash, path, size, touchedAt) VALUES (?, ?, ?, ?)
+    ON CONFLICT (blobHash) DO UPDATE SET path = excluded.path, size = excluded.size, touchedAt = excluded.touchedAt
+"""
+SQL_BLOB_GET   = "SELECT path FROM blobs WHERE blobHash = ?"
+SQL_BLOB_TOUCH = "UPDATE blobs SET touchedAt = ? WHERE blobHash = ?"
+SQL_BLOB_DEAD  = "SELECT blobHash, path FROM blobs WHERE refs <= 0 AND touchedAt < ?"
+SQL_BLOB_DROP  = "DELETE FROM blobs WHERE blobHash = ? AND refs <= 0"
+SQL_BLOB_USAGE = "SELECT COUNT(*), coalesce(SUM(size), 0), coalesce(SUM(size*max(refs-1, 0)), 0) FROM blobs"
+
+class BlobStore():
+    # Files and voicemails stored once, by SHA-256, at
+    # <root>/<first two hex digits>/<hash><suffix>. The suffix keeps the
+    # extension that ffmpeg and friends go by. put() adds a blob with no
+    # references; the file and voicemail rows logged for it take them. A
+    # blob nobody referenced within GRACE seconds of its last put() is
+    # removed by collect().
+    GRACE = 60*60
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def path_for(self, blob_hash, suffix=""):
+        return os.path.join(self.root, blob_hash[:2], blob_hash+suffix)
+
+    def find(self, blob_hash):
+        rows = db.query(SQL_BLOB_GET, (blob_hash,))
+        if rows and os.path.exists(rows[0][0]):
+            return rows[0][0]
+        return None
+
+    def put(self, source, expected_hash=None, suffix=""):
+        # Streams the file object source into the store and returns
+        # (path, blob_hash). Content already stored costs no extra disk.
+        temp_path, digest = write_temp(source, self.root, expected_hash)
+        return self.__commit(temp_path, digest.hex(), suffix)
+
+    def put_file(self, path, move=False, suffix=None):
+        # With move, path is taken over by the store, or deleted if the
+        # store already holds the same content. The suffix defaults to the
+        # extension of path.
+        if suffix == None:
+            suffix = os.path.splitext(path)[1]
+        if move:
+            try:
+                return self.__commit(path, file_digest(path).hex(), suffix)
+            except OSError:
+                pass
+        with open(path, "rb") as f:
+            stored = self.put(f, suffix=suffix)
+        if move:
+            discard(path)
+        return stored
+
+    def __commit(self, temp_path, blob_hash, suffix):
+        with self.lock:
+            existing = self.find(blob_hash)
+            if existing:
+                discard(temp_path)
+                db.execute(SQL_BLOB_TOUCH, (time.time(), blob_hash))
+                return existing, blob_hash
+            path = self.path_for(blob_hash, suffix)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            sync_dir(os.path.dirname(path))
+            db.execute(SQL_BLOB_ADD, (blob_hash, path, os.path.getsize(path), time.time()))
+        return path, blob_hash
+
+    def collect(self):
+        # Run at startup, it also clears writes cut short by a crash
+        removed = 0
+        with self.lock:
+            for blob_hash, path in db.query(SQL_BLOB_DEAD, (time.time()-self.GRACE,)):
+                discard(path)
+                db.execute(SQL_BLOB_DROP, (blob_hash,))
+                removed += 1
+            remove_partials(self.root)
+        if removed:
+            RNS.log(f"Removed {removed} unreferenced blobs", RNS.LOG_DEBUG)
+        return removed
+
+    def usage(self):
+        # (blobs, bytes on disk, bytes saved by deduplication)
+        return tuple(db.query(SQL_BLOB_USAGE)[0])
+
+blob_store = BlobStore()
@@ -0,0 +1,218 @@
+import RNS
+import os
+import math
+import time
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+from codec_utils import *
+
+# Broadcast frame, used for bulletins that do not fit one plain packet or
+# that are compressed:
+#
+#   magic (2) | flags (1) | message id (4) | fragment index (1) | fragment count (1)
+#
+# The low nibble of flags carries the text codec. UTF-8 text never starts
+# with a NUL byte, so a frame cannot be mistaken for a legacy broadcast.
+BROADCAST_FRAME_MAGIC = b"\x00\xa2"
+FRAME_HEADER          = struct.Struct("!2sBIBB")
+FLAG_CODEC_MASK       = 0x0F
+MAX_FRAGMENTS         = 255
+
+def broadcast_mdu():
+    return RNS.Packet.PLAIN_MDU
+
+def fragment_broadcast(text, compress=False, mdu=None):
+    # Returns the list of packet payloads for text. Short uncompressed texts
+    # go out as a single legacy packet so older clients still read them.
+    mdu = mdu or broadcast_mdu()
+    codec, payload = TEXT_CODEC_NONE, text.encode("utf-8")
+    if compress:
+        codec, payload = compress_text(text)
+
+    if codec == TEXT_CODEC_NONE and len(payload) <= mdu and not payload.startswith(b"\x00"):
+        return [payload]
+
+    chunk = mdu-FRAME_HEADER.size
+    count = max(1, -(-len(payload)//chunk))
+    if count > MAX_FRAGMENTS:
+        raise ValueError(f"Broadcast of {len(payload)} bytes needs {count} fragments, at most {MAX_FRAGMENTS} are allowed")
+
+    msg_id = struct.unpack("!I", os.urandom(4))[0]
+    flags = codec & FLAG_CODEC_MASK
+    return [
+        FRAME_HEADER.pack(BROADCAST_FRAME_MAGIC, flags, msg_id, index, count) + payload[index*chunk:(index+1)*chunk]
+        for index in range(count)
+    ]
+
+class BroadcastReassembler():
+    # Collects broadcast fragments until a bulletin is complete. Fragments
+    # may arrive in any order and repeats are ignored. At most MAX_PENDING
+    # bulletins and MAX_PENDING_BYTES are buffered, the byte bound checked
+    # on every fragment. The oldest other partial bulletin is dropped to
+    # make room; a bulletin that alone would exceed the bound is dropped
+    # itself. Partials older than TIMEOUT are expired on the next packet.
+    # Ids of recently completed or dropped bulletins are remembered so late
+    # repeats do not open a new buffer.
+    TIMEOUT           = 120
+    MAX_PENDING       = 32
+    MAX_PENDING_BYTES = 256*1024
+    MAX_RECENT        = 256
+
+    def __init__(self, timeout=TIMEOUT, max_pending=MAX_PENDING, max_pending_bytes=MAX_PENDING_BYTES):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.pending_bytes = 0
+        self.recent = OrderedDict()
+        self.completed = 0
+        self.expired = 0
+        self.evicted = 0
+        self.oversized = 0
+        self.malformed = 0
+
+    def feed(self, data):
+        # Returns the decoded text once a bulletin is complete, else None
+        if not data.startswith(BROADCAST_FRAME_MAGIC):
+            return data.decode("utf-8")
+
+        if len(data) < FRAME_HEADER.size:
+            self.malformed += 1
+            return None
+        _, flags, msg_id, index, count = FRAME_HEADER.unpack_from(data)
+        chunk = data[FRAME_HEADER.size:]
+        codec = flags & FLAG_CODEC_MASK
+        if count == 0 or index >= count:
+            self.malformed += 1
+            return None
+
+        if count == 1:
+            self.completed += 1
+            return decompress_text(chunk, codec)
+
+        now = time.time()
+        with self.lock:
+            self.__expire(now)
+            if msg_id in self.recent:
+                return None
+            entry = self.pending.get(msg_id)
+            if entry == None:
+                while len(self.pending) >= self.max_pending:
+                    self.__evict_oldest()
+                entry = {"started": now, "count": count, "codec": codec, "fragments": {}}
+                self.pending[msg_id] = entry
+            elif entry["count"] != count or entry["codec"] != codec:
+                self.malformed += 1
+                return None
+
+            if index in entry["fragments"]:
+                return None
+            while self.pending_bytes+len(chunk) > self.max_pending_bytes:
+                if len(self.pending) == 1:
+                    self.__drop(msg_id)
+                    self.__remember(msg_id)
+                    self.oversized += 1
+                    RNS.log(f"Dropping broadcast {msg_id:08x}, larger than the reassembly buffer", RNS.LOG_DEBUG)
+                    return None
+                self.__evict_oldest(keep=msg_id)
+            entry["fragments"][index] = chunk
+            self.pending_bytes += len(chunk)
+
+            if len(entry["fragments"]) < count:
+                return None
+            self.__drop(msg_id)
+            self.__remember(msg_id)
+
+        self.completed += 1
+        payload = b"".join(entry["fragments"][i] for i in range(count))
+        return decompress_text(payload, codec)
+
+    def __evict_oldest(self, keep=None):
+        self.__drop(min((key for key in self.pending if key != keep), key=lambda key: self.pending[key]["started"]))
+        self.evicted += 1
+
+    def __remember(self, msg_id):
+        self.recent[msg_id] = True
+        if len(self.recent) > self.MAX_RECENT:
+            self.recent.popitem(last=False)
+
+    def __drop(self, msg_id):
+        entry = self.pending.pop(msg_id)
+        self.pending_bytes -= sum(len(chunk) for chunk in entry["fragments"].values())
+
+    def __expire(self, now):
+        for msg_id in [key for key, entry in self.pending.items() if now-entry["started"] > self.timeout]:
+            RNS.log(f"Dropping incomplete broadcast {msg_id:08x}", RNS.LOG_DEBUG)
+            self.__drop(msg_id)
+            self.expired += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pending": len(self.pending),
+                "pending_bytes": self.pending_bytes,
+                "oversized": self.oversized,
+                "completed": self.completed,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "malformed": self.malformed
+            }
+
+class RotatingBloomFilter():
+    # Remembers recently seen keys in two Bloom filter generations. New keys
+    # go into the current generation, lookups check both, and the older one
+    # is discarded every WINDOW seconds or once the current one holds
+    # CAPACITY keys. A key is therefore remembered for one to two windows,
+    # less under heavy traffic, memory stays fixed, and false positives stay
+    # near FALSE_POSITIVE_RATE.
+    WINDOW              = 60*5
+    CAPACITY            = 4096
+    FALSE_POSITIVE_RATE = 0.0001
+
+    def __init__(self, window=WINDOW, capacity=CAPACITY, false_positive_rate=FALSE_POSITIVE_RATE):
+        self.window = window
+        self.capacity = capacity
+        self.bits = max(8, int(-capacity*math.log(false_positive_rate)/math.log(2)**2))
+        self.hashes = max(1, round(self.bits/capacity*math.log(2)))
+        self.lock = threading.Lock()
+        self.current = bytearray(-(-self.bits//8))
+        self.previous = bytearray(len(self.current))
+        self.count = 0
+        self.rotated = time.time()
+        self.suppressed = 0
+
+    def __positions(self, key):
+        digest = hashlib.sha256(key).digest()
+        h1, h2 = struct.unpack_from("!QQ", digest)
+        return [(h1+i*h2) % self.bits for i in range(self.hashes)]
+
+    def __contains(self, bits, positions):
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def __rotate(self, now):
+        # After a quiet spell longer than two windows both generations are
+        # stale
+        stale = now-self.rotated > 2*self.window
+        self.previous = bytearray(len(self.current)) if stale else self.current
+        self.current = bytearray(len(self.previous))
+        self.count = 0
+        self.rotated = now
+
+    def check_and_add(self, key):
+        # Returns True if key was already seen inside the window
+        positions = self.__positions(key)
+        now = time.time()
+        with self.lock:
+            if now-self.rotated > self.window or self.count >= self.capacity:
+                self.__rotate(now)
+            if self.__contains(self.current, positions) or self.__contains(self.previous, positions):
+                self.suppressed += 1
+                return True
+            for p in positions:
+                self.current[p >> 3] |= 1 << (p & 7)
+            self.count += 1
+            return False
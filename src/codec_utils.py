@@ -0,0 +1,245 @@
+import os
+import zlib
+import lzma
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Text codecs carried in FIELD_TEXT_CODEC. A dictionary is never changed in
+# place: new phrasing means a new codec id so older peers keep decoding.
+TEXT_CODEC_NONE    = 0x00
+TEXT_CODEC_DICT_V1 = 0x01
+
+# Capability bits advertised in FIELD_CAPS on every outgoing message
+CAP_TEXT_DICT_V1   = 0x01
+CAP_TYPED_ENVELOPE = 0x02
+CAP_TEXT_BUNDLE    = 0x04
+CAP_FILE_STREAM    = 0x08
+CAP_FILE_LZMA      = 0x10
+CAP_FILE_ZSTD      = 0x20
+CAP_RECEIPT        = 0x40
+LOCAL_CAPS         = CAP_TEXT_DICT_V1 | CAP_TYPED_ENVELOPE | CAP_TEXT_BUNDLE | CAP_FILE_STREAM | CAP_FILE_LZMA | CAP_RECEIPT
+if zstandard:
+    LOCAL_CAPS |= CAP_FILE_ZSTD
+
+# File codecs carried in FIELD_FILE_CODEC, one per attachment, and in the
+# offer of a streamed transfer. zstd is only offered when the zstandard
+# package is installed on both ends.
+FILE_CODEC_NONE    = 0x00
+FILE_CODEC_ZSTD    = 0x01
+FILE_CODEC_LZMA    = 0x02
+
+ZSTD_LEVEL         = 19
+LZMA_PRESET        = 6
+PROBE_SAMPLE       = 16*1024
+PROBE_RATIO        = 0.9
+MIN_COMPRESS_SIZE  = 256
+MAX_TEXT_SIZE      = 256*1024
+DECOMPRESS_READ    = 64*1024
+
+# Already compressed formats, not worth a probe
+INCOMPRESSIBLE_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp3", ".ogg", ".opus", ".m4a",
+    ".mp4", ".mkv", ".webm", ".mov", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z",
+    ".rar", ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".apk", ".jar", ".pdf"
+}
+
+# Preset dictionary of typical emergency traffic. zlib reaches back into it
+# for matches, so common phrases cost a couple of bytes instead of their
+# full length. The most frequent material sits at the end, where match
+# distances are shortest.
+TEXT_DICTIONARY_V1 = (
+    "Situation report: road closed due to flooding, bridge washed out, "
+    "power lines down, gas leak reported, building collapse, trapped under debris, "
+    "fire spreading toward the north side, smoke visible from the east, "
+    "evacuation route via the south highway, shelter at the school gym, "
+    "shelter at the community center, shelter at the church, "
+    "supplies needed: drinking water, food, blankets, diapers, baby formula, "
+    "batteries, fuel, generator, tarps, flashlights, radios, phone chargers, "
+    "medical supplies needed: bandages, insulin, oxygen, antibiotics, painkillers, "
+    "first aid kit, stretcher, wheelchair, ambulance requested, "
+    "patient is conscious and breathing, patient is unconscious, not breathing, "
+    "broken leg, broken arm, head injury, heavy bleeding, burns, hypothermia, "
+    "dehydrated, chest pain, difficulty breathing, allergic reaction, pregnant, "
+    "children, elderly, disabled, pets, livestock, "
+    "how many people, how many injured, what is your location, what is your status, "
+    "send help to, requesting assistance at, requesting pickup at, "
+    "team is on the way, team has arrived, team is leaving, ETA 10 minutes, ETA 30 minutes, "
+    "ETA 1 hour, copy that, roger, affirmative, negative, standing by, over and out, "
+    "all clear, area is safe, area is not safe, stay where you are, do not move, "
+    "move to higher ground, meet at the checkpoint, check in every hour, "
+    "battery low, signal weak, will try again later, received your message, "
+    "people injured, people missing, people safe, we are safe, we need help, "
+    "please send, please confirm, please respond, thank you, "
+    "water, food, medical, help, injured, missing, safe, location, status, need, "
+    "the, and, at, to, is, are, we, I, you, on, in, of, for, with, near, "
+)
+
+def compress_text(text, codec=TEXT_CODEC_DICT_V1):
+    # Returns (codec, payload). Falls back to plain UTF-8 whenever the
+    # compressed form would not be smaller.
+    raw = text.encode("utf-8")
+    if codec == TEXT_CODEC_DICT_V1:
+        compressor = zlib.compressobj(level=9, wbits=-15, memLevel=9, zdict=TEXT_DICTIONARY_V1.encode("utf-8"))
+        packed = compressor.compress(raw) + compressor.flush()
+        if len(packed) < len(raw):
+            return TEXT_CODEC_DICT_V1, packed
+    return TEXT_CODEC_NONE, raw
+
+def decompress_text(payload, codec, max_size=MAX_TEXT_SIZE):
+    # Payloads come from peers, so a few bytes must not unpack into more
+    # than max_size
+    if codec == TEXT_CODEC_DICT_V1:
+        decompressor = zlib.decompressobj(wbits=-15, zdict=TEXT_DICTIONARY_V1.encode("utf-8"))
+        raw = decompressor.decompress(payload, max_size+1)
+        if len(raw) > max_size or decompressor.unconsumed_tail:
+            raise ValueError("decompressed text exceeds its size limit")
+        if not decompressor.eof:
+            raise ValueError("truncated compressed text")
+    elif codec == TEXT_CODEC_NONE:
+        raw = payload
+    else:
+        raise ValueError(f"Unknown text codec {codec}")
+    return raw.decode("utf-8")
+
+def peer_supports(caps, codec):
+    if codec == TEXT_CODEC_DICT_V1:
+        return bool(caps & CAP_TEXT_DICT_V1)
+    return codec == TEXT_CODEC_NONE
+
+def peer_supports_envelope(caps):
+    return bool(caps & CAP_TYPED_ENVELOPE)
+
+def peer_supports_bundles(caps):
+    return bool(caps & CAP_TEXT_BUNDLE)
+
+def peer_supports_file_stream(caps):
+    return bool(caps & CAP_FILE_STREAM)
+
+def peer_supports_receipts(caps):
+    return bool(caps & CAP_RECEIPT)
+
+def file_codecs(caps):
+    # Codecs both ends can use, preferred first
+    codecs = []
+    if zstandard and caps & CAP_FILE_ZSTD:
+        codecs.append(FILE_CODEC_ZSTD)
+    if caps & CAP_FILE_LZMA:
+        codecs.append(FILE_CODEC_LZMA)
+    return codecs
+
+def compress_bytes(data, codec):
+    if codec == FILE_CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == FILE_CODEC_LZMA:
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=LZMA_PRESET)
+    return data
+
+def probe_sample(data):
+    # Start, middle and end, so a text header on a binary file does not
+    # pass for text
+    if len(data) <= 3*PROBE_SAMPLE:
+        return data
+    middle = len(data)//2-PROBE_SAMPLE//2
+    return data[:PROBE_SAMPLE]+data[middle:middle+PROBE_SAMPLE]+data[-PROBE_SAMPLE:]
+
+def choose_file_codec(name, data, caps):
+    # A fast zlib pass over a sample rules out data that will not shrink.
+    # When more than one codec is available the sample decides between
+    # them, they trade places depending on the content.
+    codecs = file_codecs(caps)
+    if not codecs or len(data) < MIN_COMPRESS_SIZE:
+        return FILE_CODEC_NONE
+    if os.path.splitext(name)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return FILE_CODEC_NONE
+    sample = probe_sample(data)
+    if len(zlib.compress(sample, 1)) > len(sample)*PROBE_RATIO:
+        return FILE_CODEC_NONE
+    if len(codecs) == 1:
+        return codecs[0]
+    return min(codecs, key=lambda codec: len(compress_bytes(sample, codec)))
+
+def compress_file(name, data, caps):
+    # Returns (codec, payload). Falls back to the raw bytes whenever the
+    # compressed form would not be smaller.
+    codec = choose_file_codec(name, data, caps)
+    if codec != FILE_CODEC_NONE:
+        packed = compress_bytes(data, codec)
+        if len(packed) < len(data):
+            return codec, packed
+    return FILE_CODEC_NONE, data
+
+def read_probe(path):
+    # probe_sample() of the file at path without reading all of it
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if size <= 3*PROBE_SAMPLE:
+            return f.read()
+        parts = []
+        for offset in (0, size//2-PROBE_SAMPLE//2, size-PROBE_SAMPLE):
+            f.seek(offset)
+            parts.append(f.read(PROBE_SAMPLE))
+        return b"".join(parts)
+
+def compress_path(path, out, codec):
+    # Streams the file at path through codec into the file object out and
+    # returns the compressed length. The same file always gives the same
+    # bytes, so an interrupted transfer of them can resume.
+    with open(path, "rb") as f:
+        if codec == FILE_CODEC_ZSTD:
+            _, written = zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(f, out)
+            return written
+        compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=LZMA_PRESET)
+        written = 0
+        for data in iter(lambda: f.read(DECOMPRESS_READ), b""):
+            written += out.write(compressor.compress(data))
+        return written+out.write(compressor.flush())
+
+class DecompressReader():
+    # File-like view of the decompressed contents of source, decoded a
+    # piece at a time. Reading past max_size raises, so a small attachment
+    # cannot unpack into a disk-filling one.
+    def __init__(self, source, codec, max_size=None):
+        self.source = source
+        self.codec = codec
+        self.max_size = max_size
+        self.total = 0
+        self.reader = None
+        self.decompressor = None
+        if codec == FILE_CODEC_ZSTD:
+            if zstandard == None:
+                raise ValueError("zstd file codec needs the zstandard package")
+            self.reader = zstandard.ZstdDecompressor().stream_reader(source)
+        elif codec == FILE_CODEC_LZMA:
+            self.decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+        elif codec == FILE_CODEC_NONE:
+            self.reader = source
+        else:
+            raise ValueError(f"Unknown file codec {codec}")
+
+    def read(self, size=-1):
+        data = self.reader.read(size) if self.reader else self.__read_lzma(size)
+        self.total += len(data)
+        if self.max_size != None and self.total > self.max_size:
+            raise ValueError("decompressed file exceeds its size limit")
+        return data
+
+    def __read_lzma(self, size):
+        parts, length = [], 0
+        while (size < 0 or length < size) and not self.decompressor.eof:
+            data = b""
+            if self.decompressor.needs_input:
+                data = self.source.read(DECOMPRESS_READ)
+                if not data:
+                    raise ValueError("truncated compressed file")
+            piece = self.decompressor.decompress(data, max_length=-1 if size < 0 else size-length)
+            parts.append(piece)
+            length += len(piece)
+        return b"".join(parts)
+
+    def close(self):
+        if self.reader != None and self.reader != self.source:
+            self.reader.close()
+        self.source.close()
@@ -0,0 +1,103 @@
+import threading
+
+from database_utils import get_all_id, upsert_identity, set_identity_caps
+
+class ContactRegistry():
+    # In-memory view of the identity table, indexed by identity hash, LXMF
+    # delivery hash and display name. Announces update entries in place and
+    # only touch the database when something actually changed.
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.by_delivery = {}
+        self.by_identity = {}
+        self.by_name = {}
+        self.persisted = 0
+
+    def __len__(self):
+        return len(self.by_delivery)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __index(self, entry):
+        self.by_delivery[entry["delivery_hash"]] = entry
+        self.by_identity.setdefault(entry["identity_hash"], {})[entry["delivery_hash"]] = entry
+        self.by_name.setdefault(entry["name"], {})[entry["delivery_hash"]] = entry
+
+    def __unindex(self, entry):
+        for index, key in ((self.by_identity, entry["identity_hash"]), (self.by_name, entry["name"])):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(entry["delivery_hash"], None)
+                if not bucket: del index[key]
+
+    def load(self):
+        with self.lock:
+            for row in get_all_id():
+                entry = self.__update(row["rnsHash"], row["lxmfHash"], row["name"])
+                entry["caps"] = row["caps"] or 0
+
+    def __update(self, identity_hash, delivery_hash, name):
+        entry = self.by_delivery.get(delivery_hash)
+        if entry is None:
+            entry = {
+                "name": name,
+                "identity_hash": identity_hash,
+                "delivery_hash": delivery_hash,
+                "hash": delivery_hash,
+                "caps": 0
+            }
+        else:
+            self.__unindex(entry)
+            entry["name"] = name
+            entry["identity_hash"] = identity_hash
+        self.__index(entry)
+        return entry
+
+    def upsert(self, identity_hash, delivery_hash, name):
+        # Returns True if the contact was new or changed and was written through
+        with self.lock:
+            entry = self.by_delivery.get(delivery_hash)
+            if entry and entry["name"] == name and entry["identity_hash"] == identity_hash:
+                return False
+            upsert_identity(identity_hash, delivery_hash, name)
+            self.__update(identity_hash, delivery_hash, name)
+            self.persisted += 1
+            return True
+
+    def set_caps(self, delivery_hash, caps):
+        # Peers advertise their capabilities on every message, only changes
+        # are written through
+        with self.lock:
+            entry = self.by_delivery.get(delivery_hash)
+            if entry == None or entry["caps"] == caps:
+                return False
+            set_identity_caps(delivery_hash, caps)
+            entry["caps"] = caps
+            return True
+
+    def caps_for(self, delivery_hash):
+        entry = self.by_delivery.get(delivery_hash)
+        return entry["caps"] if entry else 0
+
+    def get(self, delivery_hash):
+        return self.by_delivery.get(delivery_hash)
+
+    def get_by_identity(self, identity_hash):
+        with self.lock:
+            return list(self.by_identity.get(identity_hash, {}).values())
+
+    def find_by_name(self, name):
+        with self.lock:
+            return list(self.by_name.get(name, {}).values())
+
+    def name_for(self, delivery_hash, default=None):
+        entry = self.by_delivery.get(delivery_hash)
+        return entry["name"] if entry else default
+
+    def snapshot(self):
+        # A stable list for menus that address contacts by position
+        with self.lock:
+            return list(self.by_delivery.values())
+
+contacts = ContactRegistry()
@@ -1,145 +1,465 @@
 import sqlite3
 import os
 import time
+import threading
+import queue
+from contextlib import contextmanager
 
 DB_PATH = os.path.join("..", "dbs", "lrecomm_local.db")
+SQL_DIR = os.path.join("..", "sql")
+
+class DB():
+    # One long-lived connection per thread. The RNS/LXMF callback threads and
+    # the curses thread each get their own handle instead of reopening the
+    # database file for every row.
+    BUSY_TIMEOUT      = 10
+    CACHE_SIZE_KB     = 8192
+    STATEMENT_CACHE   = 256
+    JOURNAL_MODE      = "WAL"
+    SYNCHRONOUS       = "NORMAL"
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, cached_statements=self.STATEMENT_CACHE, check_same_thread=False)
+            conn.execute(f"PRAGMA journal_mode = {self.JOURNAL_MODE}")
+            conn.execute(f"PRAGMA synchronous = {self.SYNCHRONOUS}")
+            conn.execute(f"PRAGMA cache_size = -{self.CACHE_SIZE_KB}")
+            conn.execute("PRAGMA temp_store = MEMORY")
+            self.local.conn = conn
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    def execute(self, sql, params=()):
+        with self.transaction() as conn:
+            return conn.execute(sql, params).lastrowid
+
+    def executemany(self, sql, seq_of_params):
+        with self.transaction() as conn:
+            conn.executemany(sql, seq_of_params)
+
+    def query(self, sql, params=(), row_factory=None):
+        c = self.connection().cursor()
+        if row_factory:
+            c.row_factory = row_factory
+        c.execute(sql, params)
+        return c.fetchall()
+
+    def schema_version(self):
+        return self.connection().execute("PRAGMA user_version").fetchone()[0]
+
+    def migrations(self, sql_dir=SQL_DIR):
+        # Version 1 is the baseline schema, later versions are numbered
+        # scripts in sql/migrations named <version>_<description>.sql
+        found = [(1, os.path.join(sql_dir, "lrecomm.sql"))]
+        migrations_dir = os.path.join(sql_dir, "migrations")
+        if os.path.isdir(migrations_dir):
+            for name in os.listdir(migrations_dir):
+                prefix = name.split("_", 1)[0]
+                if name.endswith(".sql") and prefix.isdigit():
+                    found.append((int(prefix), os.path.join(migrations_dir, name)))
+        return sorted(found)
+
+    def migrate(self, sql_dir=SQL_DIR):
+        current = self.schema_version()
+        pending = [(v, path) for v, path in self.migrations(sql_dir) if v > current]
+        conn = self.connection()
+        for version, path in pending:
+            with open(path) as f:
+                script = f.read()
+            try:
+                # Each migration and its version bump commit together
+                conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;")
+            except sqlite3.Error:
+                if conn.in_transaction: conn.rollback()
+                raise
+        return self.schema_version()
+
+    def close(self):
+        with self.connections_lock:
+            for conn in self.connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self.connections = []
+        self.local = threading.local()
+
+db = DB(DB_PATH)
+
+def migrate():
+    return db.migrate()
+
+class LogWriter():
+    # Write-behind queue for records logged from the RNS/LXMF callback
+    # threads. Callers enqueue and return; a single writer thread commits
+    # whatever has accumulated as one transaction once MAX_BATCH records are
+    # pending or MAX_DELAY_MS has passed since the first one arrived.
+    #
+    # Crash semantics:
+    #   - A record is durable once the batch holding it has committed. A hard
+    #     crash loses at most the records still in the queue, which is bounded
+    #     by MAX_QUEUE and in steady state by one MAX_DELAY_MS window.
+    #   - A batch is a single transaction, so a crash mid-commit leaves either
+    #     all or none of its rows in the database, never a partial batch.
+    #   - Records are committed in the order they were enqueued and never
+    #     dropped on back-pressure. A full queue blocks the caller until the
+    #     writer has made room; stalls counts the enqueues that had to wait.
+    #   - If a batch fails to commit it is retried row by row so a single bad
+    #     record cannot take the rest of the batch down with it. No error
+    #     stops the writer thread.
+    #   - flush() and stop() return only after everything enqueued before the
+    #     call has committed; lrecomm.shutdown() stops the writer on exit.
+    MAX_BATCH       = 64
+    MAX_DELAY_MS    = 250
+    MAX_QUEUE       = 4096
+    ENQUEUE_TIMEOUT = 0.5
+    ERROR_BACKOFF   = 1
+
+    def __init__(self, db, max_batch=MAX_BATCH, max_delay_ms=MAX_DELAY_MS, max_queue=MAX_QUEUE):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms/1000
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        self.should_run = False
+        self.committed = 0
+        self.batches = 0
+        self.stalls = 0
+        self.failed = 0
+        self.last_error = None
+
+    def start(self):
+        with self.thread_lock:
+            if not self.should_run:
+                self.should_run = True
+                self.thread = threading.Thread(target=self.__writer, daemon=True)
+                self.thread.start()
+
+    def enqueue(self, sql, params):
+        if not self.should_run:
+            self.start()
+        try:
+            self.queue.put((sql, params), timeout=self.ENQUEUE_TIMEOUT)
+        except queue.Full:
+            # Writing it directly would overtake the rows still queued
+            self.stalls += 1
+            self.queue.put((sql, params))
+
+    def flush(self, timeout=None):
+        if not self.should_run:
+            return True
+        done = threading.Event()
+        self.queue.put((None, done))
+        return done.wait(timeout)
+
+    def stop(self, timeout=None):
+        if not self.should_run:
+            return True
+        flushed = self.flush(timeout)
+        self.should_run = False
+        self.queue.put((None, None))
+        self.thread.join(timeout)
+        return flushed
+
+    def __writer(self):
+        while self.should_run or not self.queue.empty():
+            sql, params = self.queue.get()
+            batch, waiters = [], []
+            deadline = time.time()+self.max_delay
+            while True:
+                if sql is None:
+                    if params is not None: waiters.append(params)
+                    # Flush markers and stop requests end the batch early
+                    break
+                batch.append((sql, params))
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    sql, params = self.queue.get(timeout=max(0, deadline-time.time()))
+                except queue.Empty:
+                    break
+
+            try:
+                if batch:
+                    self.__commit(batch)
+            except Exception as e:
+                # Only reached when the database itself is unusable, e.g.
+                # the disk is gone. The batch is lost, the writer lives on.
+                self.failed += len(batch)
+                self.last_error = e
+                time.sleep(self.ERROR_BACKOFF)
+            finally:
+                for waiter in waiters:
+                    waiter.set()
+
+    def __commit(self, batch):
+        try:
+            with self.db.transaction() as conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+            self.committed += len(batch)
+            self.batches += 1
+        except Exception:
+            for sql, params in batch:
+                try:
+                    self.db.execute(sql, params)
+                    self.committed += 1
+                except Exception as e:
+                    self.failed += 1
+                    self.last_error = e
+
+log_writer = LogWriter(db)
+
+# Statements are kept as module constants so every call hands sqlite3 the
+# identical string and hits its per-connection prepared statement cache.
+SQL_ADD_IDENTITY = "INSERT INTO identity (rnsHash, lxmfHash, name, username) VALUES (?, ?, ?, ?)"
+SQL_UPSERT_ID    = """
+    INSERT INTO identity (rnsHash, lxmfHash, name, username) VALUES (?, ?, ?, ?)
+    ON CONFLICT (lxmfHash) DO UPDATE SET rnsHash = excluded.rnsHash, name = excluded.name
+"""
+SQL_ALL_ID       = "SELECT rnsHash, lxmfHash, name, username, caps FROM identity"
+SQL_SET_CAPS     = "UPDATE identity SET caps = ? WHERE lxmfHash = ?"
+SQL_MSG_SEND     = "INSERT INTO msg_sent (receiverHash, content) VALUES (?, ?)"
+SQL_MSG_RECV     = "INSERT INTO msg_recv (senderHash, content) VALUES (?, ?)"
+SQL_MSG_RECV_AT  = "INSERT INTO msg_recv (senderHash, content, time) VALUES (?, ?, ?)"
+SQL_VM_SEND      = "INSERT INTO vm_sent (receiverHash, wavpath, blobHash) VALUES (?, ?, ?)"
+SQL_VM_RECV      = "INSERT INTO vm_recv (senderHash, wavpath, blobHash) VALUES (?, ?, ?)"
+SQL_FILE_SEND    = "INSERT INTO file_sent (receiverHash, filepath, blobHash, name) VALUES (?, ?, ?, ?)"
+SQL_FILE_RECV    = "INSERT INTO file_recv (senderHash, filepath, blobHash, name) VALUES (?, ?, ?, ?)"
+SQL_BLOB_REF     = "UPDATE blobs SET refs = refs+1 WHERE blobHash = ?"
+SQL_UNREAD_VMS   = "SELECT wavpath, time, senderHash FROM vm_recv WHERE unread = 1 ORDER BY time;"
+# Blobs of a file name, received or sent, newest first
+SQL_FILE_VERSIONS = """
+    SELECT blobHash FROM (
+        SELECT blobHash, time, fileID FROM file_recv WHERE name = ? AND blobHash IS NOT NULL
+        UNION ALL
+        SELECT blobHash, time, fileID FROM file_sent WHERE name = ? AND blobHash IS NOT NULL)
+    ORDER BY time DESC, fileID DESC LIMIT ?;
+"""
+SQL_MESSAGES     = """
+    SELECT content, time, align FROM msg_sent WHERE receiverHash = ?
+    UNION ALL
+    SELECT content, time, align FROM msg_recv WHERE senderHash = ?
+    ORDER BY time;
+"""
+# Keyset pages of a conversation, newest first. A page boundary is the
+# (time, msgID, align) of the oldest row already shown; align keeps the key
+# unique across the two tables whose msgIDs overlap.
+SQL_MESSAGE_PAGE = """
+    SELECT * FROM (
+        SELECT content, time, align, msgID FROM msg_sent WHERE receiverHash = ?
+        ORDER BY time DESC, msgID DESC LIMIT ?)
+    UNION ALL
+    SELECT * FROM (
+        SELECT content, time, align, msgID FROM msg_recv WHERE senderHash = ?
+        ORDER BY time DESC, msgID DESC LIMIT ?)
+    ORDER BY time DESC, msgID DESC, align DESC LIMIT ?;
+"""
+SQL_MESSAGE_PAGE_BEFORE = """
+    SELECT * FROM (
+        SELECT content, time, align, msgID FROM msg_sent WHERE receiverHash = ?
+        AND time <= ? AND (time, msgID, align) < (?, ?, ?)
+        ORDER BY time DESC, msgID DESC LIMIT ?)
+    UNION ALL
+    SELECT * FROM (
+        SELECT content, time, align, msgID FROM msg_recv WHERE senderHash = ?
+        AND time <= ? AND (time, msgID, align) < (?, ?, ?)
+        ORDER BY time DESC, msgID DESC LIMIT ?)
+    ORDER BY time DESC, msgID DESC, align DESC LIMIT ?;
+"""
+SQL_SEARCH       = """
+    SELECT content, time, align, peerHash FROM msg_fts
+    WHERE msg_fts MATCH ? ORDER BY rank LIMIT ?;
+"""
+SQL_SEARCH_PEER  = """
+    SELECT content, time, align, peerHash FROM msg_fts
+    WHERE msg_fts MATCH ? AND peerHash = ? ORDER BY rank LIMIT ?;
+"""
 
 def add_identity(rns_hash, lxmf_hash, name, username):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO identity (rnsHash, lxmfHash, name, username)
-            VALUES (?, ?, ?, ?)
-        """, (rns_hash, lxmf_hash, name, username))
-        conn.commit()
+    db.execute(SQL_ADD_IDENTITY, (rns_hash, lxmf_hash, name, username))
+
+def upsert_identity(rns_hash, lxmf_hash, name):
+    # Display names are not unique on the mesh, so the delivery hash doubles
+    # as the username for identities learned from announces
+    db.execute(SQL_UPSERT_ID, (rns_hash, lxmf_hash, name, lxmf_hash))
+
+def set_identity_caps(lxmf_hash, caps):
+    db.execute(SQL_SET_CAPS, (caps, lxmf_hash))
 
 def get_all_id():
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row  # Enable dict-like access
-        c = conn.cursor()
-        c.execute("SELECT rnsHash, lxmfHash, name, username FROM identity")
-        rows = c.fetchall()
-        return [dict(row) for row in rows]
+    rows = db.query(SQL_ALL_ID, row_factory=sqlite3.Row)  # Enable dict-like access
+    return [dict(row) for row in rows]
 
 def log_msg_send(receiver_hash, content):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO msg_sent (receiverHash, content)
-            VALUES (?, ?)
-        """, (receiver_hash, content))
-        conn.commit()
-
-def log_msg_recv(sender_hash, content):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO msg_recv (senderHash, content)
-            VALUES (?, ?)
-        """, (sender_hash, content))
-        conn.commit()
-
-def log_vm_send(receiver_hash, wavpath):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO vm_sent (receiverHash, wavpath)
-            VALUES (?, ?)
-        """, (receiver_hash, wavpath))
-        conn.commit()
-
-def log_vm_recv(sender_hash, wavpath):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO vm_recv (senderHash, wavpath)
-            VALUES (?, ?)
-        """, (sender_hash, wavpath))
-        conn.commit()
-
-def log_file_send(receiver_hash, filepath):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO file_sent (receiverHash, filepath)
-            VALUES (?, ?)
-        """, (receiver_hash, filepath))
-        conn.commit()
-
-def log_file_recv(sender_hash, filepath):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO file_recv (senderHash, filepath)
-            VALUES (?, ?)
-        """, (sender_hash, filepath))
-        conn.commit()
+    return db.execute(SQL_MSG_SEND, (receiver_hash, content))
+
+def log_msg_recv(sender_hash, content, at=None):
+    # at is a unix timestamp, stored in the same UTC format as CURRENT_TIMESTAMP
+    if at is None:
+        log_writer.enqueue(SQL_MSG_RECV, (sender_hash, content))
+    else:
+        log_writer.enqueue(SQL_MSG_RECV_AT, (sender_hash, content, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(at))))
+
+# Rows that point at a blob take a reference on it, in the same
+# transaction for the synchronous writers. Deleting a row gives it back
+# through the triggers in 0013_blob_release.sql.
+def log_vm_send(receiver_hash, wavpath, blob_hash=None):
+    with db.transaction() as conn:
+        if blob_hash: conn.execute(SQL_BLOB_REF, (blob_hash,))
+        return conn.execute(SQL_VM_SEND, (receiver_hash, wavpath, blob_hash)).lastrowid
+
+def log_vm_recv(sender_hash, wavpath, blob_hash=None):
+    if blob_hash: log_writer.enqueue(SQL_BLOB_REF, (blob_hash,))
+    log_writer.enqueue(SQL_VM_RECV, (sender_hash, wavpath, blob_hash))
+
+def log_file_send(receiver_hash, filepath, blob_hash=None, name=None):
+    with db.transaction() as conn:
+        if blob_hash: conn.execute(SQL_BLOB_REF, (blob_hash,))
+        return conn.execute(SQL_FILE_SEND, (receiver_hash, filepath, blob_hash, name)).lastrowid
+
+def log_file_recv(sender_hash, filepath, blob_hash=None, name=None):
+    if blob_hash: log_writer.enqueue(SQL_BLOB_REF, (blob_hash,))
+    log_writer.enqueue(SQL_FILE_RECV, (sender_hash, filepath, blob_hash, name))
 
 def get_messages(identity_hash):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("""
-            SELECT content, time, align FROM msg_sent WHERE receiverHash = ?
-            UNION
-            SELECT content, time, align FROM msg_recv WHERE senderHash = ?
-            ORDER BY time;
-        """, (identity_hash, identity_hash))
-        return c.fetchall()
+    return db.query(SQL_MESSAGES, (identity_hash, identity_hash))
+
+def get_message_page(identity_hash, before=None, limit=50):
+    # Returns up to limit rows older than the before key, oldest first, as
+    # (content, time, align, msgID). Pass the page_key() of the first row of
+    # the previous page to walk backwards through the history.
+    if before is None:
+        rows = db.query(SQL_MESSAGE_PAGE, (identity_hash, limit, identity_hash, limit, limit))
+    else:
+        before_time, before_id, before_align = before
+        bound = (before_time, before_time, before_id, before_align, limit)
+        rows = db.query(SQL_MESSAGE_PAGE_BEFORE, (identity_hash,)+bound+(identity_hash,)+bound+(limit,))
+    rows.reverse()
+    return rows
+
+def page_key(row):
+    content, time, align, msg_id = row
+    return (time, msg_id, align)
+
+def fts_query(text):
+    # Quote every term so operator input is matched literally instead of
+    # being parsed as FTS5 syntax. Terms are ANDed.
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    return " ".join(terms)
+
+def search_messages(query, peer=None, limit=50):
+    # Returns (content, time, align, peerHash) rows best match first
+    match = fts_query(query)
+    if not match:
+        return []
+    if peer is None:
+        return db.query(SQL_SEARCH, (match, limit))
+    else:
+        return db.query(SQL_SEARCH_PEER, (match, peer, limit))
+
+SENT_TABLES = {
+    "message":   ("msg_sent", "msgID"),
+    "voicemail": ("vm_sent", "vmID"),
+    "file":      ("file_sent", "fileID")
+}
+DELIVERY_COLUMNS = {
+    "queued":    "queuedAt",
+    "sent":      "sentAt",
+    "propagated": "sentAt",
+    "delivered": "deliveredAt",
+    "failed":    "failedAt"
+}
+
+def set_delivery_state(kind, log_id, state, at=None):
+    # Retries move a row back to queued without losing when it was first queued
+    table, key = SENT_TABLES[kind]
+    column = DELIVERY_COLUMNS[state]
+    value = "coalesce(queuedAt, ?)" if column == "queuedAt" else "?"
+    at = time.time() if at is None else at
+    db.execute(f"UPDATE {table} SET state = ?, {column} = {value} WHERE {key} = ?", (state, at, log_id))
+
+def get_delivery_times(kind, peer=None):
+    # (peer, queuedAt, sentAt, deliveredAt) for every delivered row of a kind
+    table, key = SENT_TABLES[kind]
+    sql = f"SELECT receiverHash, queuedAt, sentAt, deliveredAt FROM {table} WHERE state = 'delivered'"
+    if peer is None:
+        return db.query(sql)
+    else:
+        return db.query(sql + " AND receiverHash = ?", (peer,))
+
+SQL_SOS_UPSERT   = """
+    INSERT INTO sos (senderHash, session, status, battery, lat, lon, firstSeen, lastSeen, heard, active)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+    ON CONFLICT(senderHash) DO UPDATE SET
+        firstSeen = CASE WHEN sos.session = excluded.session THEN sos.firstSeen ELSE excluded.firstSeen END,
+        heard     = CASE WHEN sos.session = excluded.session THEN sos.heard+1 ELSE 1 END,
+        lat       = coalesce(excluded.lat, CASE WHEN sos.session = excluded.session THEN sos.lat END),
+        lon       = coalesce(excluded.lon, CASE WHEN sos.session = excluded.session THEN sos.lon END),
+        session   = excluded.session,
+        status    = excluded.status,
+        battery   = excluded.battery,
+        lastSeen  = excluded.lastSeen,
+        active    = excluded.active
+"""
+SQL_SOS_ACTIVE   = "SELECT senderHash, status, battery, lat, lon, firstSeen, lastSeen, heard FROM sos WHERE active = 1 ORDER BY lastSeen DESC"
+
+def log_sos(sender_hash, session, status, battery, lat, lon, active, at=None):
+    # A beacon without a position keeps the last fix from the same session
+    at = time.time() if at is None else at
+    db.execute(SQL_SOS_UPSERT, (sender_hash, session, status, battery, lat, lon, at, at, 1 if active else 0))
+
+def get_active_sos():
+    return db.query(SQL_SOS_ACTIVE)
 
 def get_voicemail(vm_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("SELECT wavpath FROM vm_recv WHERE vmID = ?;", (vm_id,))
-        return c.fetchall()
+    return db.query("SELECT wavpath FROM vm_recv WHERE vmID = ?;", (vm_id,))
 
 def get_all_voicemails(direction):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        if direction == "sent":
-            c.execute("SELECT wavpath, time FROM vm_sent ORDER BY time;")
-        elif direction == "recv":
-            c.execute("SELECT wavpath, time FROM vm_recv ORDER BY time;")
-        else:
-            return []
-        return c.fetchall()
+    if direction == "sent":
+        return db.query("SELECT wavpath, time FROM vm_sent ORDER BY time;")
+    elif direction == "recv":
+        return db.query("SELECT wavpath, time FROM vm_recv ORDER BY time;")
+    else:
+        return []
 
 def get_unread_voicemails():
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("SELECT wavpath, time, senderHash FROM vm_recv WHERE unread = 1 ORDER BY time;")
-        return c.fetchall()
+    return db.query(SQL_UNREAD_VMS)
 
 def get_recv_voicemails():
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("SELECT wavpath, time, senderHash FROM vm_recv;")
-        return c.fetchall()
+    return db.query("SELECT wavpath, time, senderHash FROM vm_recv;")
 
 def get_sent_voicemails():
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("SELECT wavpath, time, receiverHash FROM vm_sent;")
-        return c.fetchall()
+    return db.query("SELECT wavpath, time, receiverHash FROM vm_sent;")
 
 def get_all_files(direction):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        if direction == "sent":
-            c.execute("SELECT filepath, time FROM file_sent ORDER BY time;")
-        elif direction == "recv":
-            c.execute("SELECT filepath, time FROM file_recv ORDER BY time;")
-        else:
-            return []
-        return c.fetchall()
+    if direction == "sent":
+        return db.query("SELECT filepath, time FROM file_sent ORDER BY time;")
+    elif direction == "recv":
+        return db.query("SELECT filepath, time FROM file_recv ORDER BY time;")
+    else:
+        return []
+
+def get_file_versions(name, limit=5):
+    return [row[0] for row in db.query(SQL_FILE_VERSIONS, (name, name, limit))]
 
 def get_recv_files():
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("SELECT filepath, time, senderHash FROM file_recv;")
-        return c.fetchall()
+    return db.query("SELECT filepath, time, senderHash, name FROM file_recv;")
 
 def get_sent_files():
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("SELECT filepath, time, receiverHash FROM file_sent;")
-        return c.fetchall()
+    return db.query("SELECT filepath, time, receiverHash, name FROM file_sent;")
@@ -0,0 +1,187 @@
+import os
+import math
+import struct
+import hashlib
+
+from itertools import accumulate
+
+# rsync-style deltas. The side holding an old version of a file sends a
+# signature: a weak rolling checksum and a truncated SHA-256 for every
+# whole block. The side with the new version slides a window over it one
+# byte at a time, and wherever the window matches a block emits a copy of
+# that block instead of the bytes. Everything else goes as literal data.
+#
+# Delta: magic | base hash (32) | block size (4), then ops
+#   COPY:    "C" | first block (4) | block count (4)
+#   LITERAL: "L" | length (4) | data
+DELTA_MAGIC   = b"LRD1"
+DELTA_HEADER  = struct.Struct("!4s32sI")
+SIG_HEADER    = struct.Struct("!I")
+SIG_ENTRY     = struct.Struct("!I8s")
+OP_COPY       = b"C"
+OP_LITERAL    = b"L"
+COPY_ARGS     = struct.Struct("!II")
+LITERAL_ARGS  = struct.Struct("!I")
+
+MIN_BLOCK     = 512
+MAX_BLOCK     = 8192
+STRONG_BYTES  = 8
+LITERAL_MAX   = 64*1024
+
+class DeltaError(Exception):
+    pass
+
+def block_size(size):
+    # About the square root of the file, as rsync does, so signature and
+    # literal costs stay balanced
+    block = int(math.isqrt(max(0, size)))//64*64
+    return max(MIN_BLOCK, min(MAX_BLOCK, block))
+
+def weak_sum(block):
+    a = sum(block) & 0xffff
+    b = sum(accumulate(block)) & 0xffff
+    return a, b
+
+def strong_sum(block):
+    return hashlib.sha256(block).digest()[:STRONG_BYTES]
+
+def signature(path, size=None):
+    # Only whole blocks are signed, a short tail is always sent as literal
+    size = size if size != None else os.path.getsize(path)
+    block = block_size(size)
+    parts = [SIG_HEADER.pack(block)]
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(block), b""):
+            if len(data) < block:
+                break
+            a, b = weak_sum(data)
+            parts.append(SIG_ENTRY.pack((b << 16) | a, strong_sum(data)))
+    return b"".join(parts)
+
+def parse_signature(sig):
+    if len(sig) < SIG_HEADER.size or (len(sig)-SIG_HEADER.size) % SIG_ENTRY.size:
+        raise DeltaError("malformed signature")
+    block, = SIG_HEADER.unpack_from(sig)
+    if not MIN_BLOCK <= block <= MAX_BLOCK:
+        raise DeltaError("unsupported block size")
+    table = {}
+    for index, (weak, strong) in enumerate(SIG_ENTRY.iter_unpack(sig[SIG_HEADER.size:])):
+        table.setdefault(weak, {}).setdefault(strong, index)
+    return block, table
+
+def make_delta(data, sig, base_hash, out):
+    # Writes the delta turning the signed base into data to the file
+    # object out and returns its length
+    block, table = parse_signature(sig)
+    written = out.write(DELTA_HEADER.pack(DELTA_MAGIC, base_hash, block))
+    copy = None
+    def flush_copy():
+        nonlocal copy, written
+        if copy:
+            written += out.write(OP_COPY+COPY_ARGS.pack(*copy))
+            copy = None
+    def literal(start, end):
+        nonlocal written
+        for offset in range(start, end, LITERAL_MAX):
+            piece = data[offset:min(end, offset+LITERAL_MAX)]
+            written += out.write(OP_LITERAL+LITERAL_ARGS.pack(len(piece))+piece)
+
+    n, i, literal_start = len(data), 0, 0
+    if table and n >= block:
+        a, b = weak_sum(data[0:block])
+    while table and i+block <= n:
+        match = None
+        candidates = table.get((b << 16) | a)
+        if candidates:
+            match = candidates.get(strong_sum(data[i:i+block]))
+        if match != None:
+            if literal_start < i:
+                flush_copy()
+                literal(literal_start, i)
+            if copy and copy[0]+copy[1] == match:
+                copy = (copy[0], copy[1]+1)
+            else:
+                flush_copy()
+                copy = (match, 1)
+            i += block
+            literal_start = i
+            if i+block <= n:
+                a, b = weak_sum(data[i:i+block])
+            continue
+        if i+block < n:
+            out_byte, in_byte = data[i], data[i+block]
+            a = (a-out_byte+in_byte) & 0xffff
+            b = (b-block*out_byte+a) & 0xffff
+        i += 1
+    flush_copy()
+    literal(literal_start, n)
+    return written
+
+class DeltaReader():
+    # File-like view of the file rebuilt from base (a path) and delta (a
+    # file object), read a piece at a time so neither is held in memory.
+    # Rebuilding past max_size raises, so a few copy ops cannot repeat the
+    # base into a disk-filling file.
+    def __init__(self, base_path, delta, base_hash=None, max_size=None):
+        self.delta = delta
+        self.max_size = max_size
+        self.total = 0
+        magic, delta_base, self.block = DELTA_HEADER.unpack(self.__read_exact(DELTA_HEADER.size))
+        if magic != DELTA_MAGIC:
+            raise DeltaError("not a delta")
+        if base_hash != None and delta_base != base_hash:
+            raise DeltaError("delta is for another base")
+        self.base = open(base_path, "rb")
+        self.pieces = self.__pieces()
+        self.buffer = b""
+
+    def __read_exact(self, size):
+        data = self.delta.read(size)
+        if len(data) != size:
+            raise DeltaError("truncated delta")
+        return data
+
+    def __pieces(self):
+        for piece in self.__ops():
+            self.total += len(piece)
+            if self.max_size != None and self.total > self.max_size:
+                raise DeltaError("rebuilt file exceeds its size limit")
+            yield piece
+
+    def __ops(self):
+        while True:
+            op = self.delta.read(1)
+            if not op:
+                return
+            if op == OP_COPY:
+                first, count = COPY_ARGS.unpack(self.__read_exact(COPY_ARGS.size))
+                self.base.seek(first*self.block)
+                for _ in range(count):
+                    data = self.base.read(self.block)
+                    if len(data) != self.block:
+                        raise DeltaError("copy beyond the end of the base")
+                    yield data
+            elif op == OP_LITERAL:
+                length, = LITERAL_ARGS.unpack(self.__read_exact(LITERAL_ARGS.size))
+                yield self.__read_exact(length)
+            else:
+                raise DeltaError("unknown delta op")
+
+    def read(self, size=-1):
+        parts, length = [self.buffer], len(self.buffer)
+        while size < 0 or length < size:
+            piece = next(self.pieces, None)
+            if piece == None:
+                break
+            parts.append(piece)
+            length += len(piece)
+        data = b"".join(parts)
+        if size < 0:
+            self.buffer = b""
+            return data
+        data, self.buffer = data[:size], data[size:]
+        return data
+
+    def close(self):
+        self.base.close()
+        self.delta.close()
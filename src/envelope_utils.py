@@ -0,0 +1,45 @@
+import RNS
+
+# Message types carried as a small integer in FIELD_TYPE. Codes are part of
+# the wire format and must never be reused.
+MSG_TYPE_TEXT      = 0x01
+MSG_TYPE_VOICEMAIL = 0x02
+MSG_TYPE_FILE      = 0x03
+MSG_TYPE_BUNDLE    = 0x04
+MSG_TYPE_RECEIPT   = 0x05
+
+# Titles sent by builds that predate FIELD_TYPE, and still sent to peers
+# that do not advertise CAP_TYPED_ENVELOPE. Newer types have no title.
+LEGACY_TITLES = {
+    MSG_TYPE_TEXT: "Message",
+    MSG_TYPE_VOICEMAIL: "Voicemail",
+    MSG_TYPE_FILE: "File"
+}
+LEGACY_TYPES = {title: msg_type for msg_type, title in LEGACY_TITLES.items()}
+
+def message_type(message, field):
+    # FIELD_TYPE wins, the title is only consulted for legacy senders
+    msg_type = message.fields.get(field)
+    if msg_type == None:
+        msg_type = LEGACY_TYPES.get(message.title_as_string())
+    return msg_type
+
+class MessageDispatcher():
+    # Maps message type codes to handler(sender_hash, message)
+    def __init__(self, field):
+        self.field = field
+        self.handlers = {}
+        self.unhandled = 0
+
+    def register(self, msg_type, handler):
+        self.handlers[msg_type] = handler
+
+    def dispatch(self, sender_hash, message):
+        msg_type = message_type(message, self.field)
+        handler = self.handlers.get(msg_type)
+        if handler == None:
+            self.unhandled += 1
+            RNS.log(f"No handler for message type {msg_type} from {sender_hash}", RNS.LOG_DEBUG)
+            return False
+        handler(sender_hash, message)
+        return True
@@ -1,26 +1,39 @@
 import threading
 
-'''
-contacts = [
-    {"hash": "ABC123", "name": "Alice"},
-    {"hash": "DEF456", "name": "Bob"},
-    {"hash": "GHI789", "name": "Charlie"}
-]
-'''
-contacts = []
-
 my_destination = None
 broadcast_destination = None
 reticulum = None
 router = None
 
 APP_NAME = "lrecomm"
+# Base announce interval in seconds. The announce scheduler stretches it up
+# to 4x on a busy mesh, so it only needs to suit a quiet one.
 ANNOUNCE_INTERVAL = 60
 IDENTITY_PATH = "../dbs/my_identity"
 STORAGE_DIR = "../dbs/lxmf"
 STAMP_COST = 1
 DISPLAY_NAME = "Cheeky Monkey"
 
+# Hex hash of an LXMF propagation node. When set, messages that failed
+# PROPAGATION_AFTER_ATTEMPTS direct attempts are left there for the peer,
+# and messages left for us are synced every PROPAGATION_SYNC_INTERVAL.
+PROPAGATION_NODE = None
+PROPAGATION_AFTER_ATTEMPTS = 2
+PROPAGATION_SYNC_INTERVAL = 60*10
+
+# LXMF field ids used by lrecomm on top of the standard LXMF fields
+FIELD_CAPS       = 0xA0
+FIELD_TEXT_CODEC = 0xA1
+FIELD_TYPE       = 0xA2
+FIELD_BUNDLE     = 0xA3
+FIELD_FILE_HASH  = 0xA4
+FIELD_FILE_CODEC = 0xA5
+FIELD_RECEIPT    = 0xA6
+
+# Broadcasts reach every client on the channel and cannot be negotiated, so
+# they are only compressed once the whole mesh runs a codec-aware build
+COMPRESS_BROADCASTS = False
+
 
 refresh_needed = threading.Event()
 my_destination, router, reticulum, broadcast_destination = None, None, None, None
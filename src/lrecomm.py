@@ -14,6 +14,7 @@ from reticulum_utils import *
 # from audio_call import *
 from message_utils import *
 from file_utils import *
+from contact_utils import contacts
 from globals import *
 
 from datetime import datetime as dt
@@ -21,6 +22,7 @@ from LXMF import LXMessage as LXM
 from LXST.Sources import LineSource
 from LXST.Sinks import LineSink
 from voice import ReticulumTelephone
+from Telephony import Telephone
 from wav_sink import FileSink
 from audio_call import setup_audio_call
 
@@ -29,9 +31,11 @@ RNS.loglevel = RNS.LOG_EXTREME
 RNS.logdest = RNS.LOG_FILE
 
 
-def draw_box(stdscr, title, options, descriptions, current_idx):
+def draw_box(stdscr, title, options, descriptions, current_idx, status=None):
     stdscr.clear()
     height, width = stdscr.getmaxyx()
+    if status:
+        stdscr.addstr(height - 1, 0, status[:width - 1], curses.A_DIM)
     box_height = len(options) + 4
     box_width = max(len(f"[{k}] {descriptions[k]}") for k in options) + 6
     start_y = (height - box_height) // 2
@@ -80,13 +84,16 @@ def handle_menu(stdscr, title, descriptions):
 
     base_title = title  # Keep the original title static
     dynamic_title = f"{base_title} [{telephone.status_text}]"
-    draw_box(stdscr, dynamic_title, options, descriptions, current_idx)
+    status = status_text()
+    draw_box(stdscr, dynamic_title, options, descriptions, current_idx, status)
     try:
         while True:
             dynamic_title = f"{base_title} [{telephone.status_text}]"
 
-            if refresh_needed.is_set():
-                draw_box(stdscr, dynamic_title, options, descriptions, current_idx)
+            current_status = status_text()
+            if refresh_needed.is_set() or current_status != status:
+                status = current_status
+                draw_box(stdscr, dynamic_title, options, descriptions, current_idx, status)
                 refresh_needed.clear()
 
             key = stdscr.getch()
@@ -96,10 +103,10 @@ def handle_menu(stdscr, title, descriptions):
 
             if key == curses.KEY_UP:
                 current_idx = (current_idx - 1) % len(options)
-                draw_box(stdscr, dynamic_title, options, descriptions, current_idx)
+                draw_box(stdscr, dynamic_title, options, descriptions, current_idx, status)
             elif key == curses.KEY_DOWN:
                 current_idx = (current_idx + 1) % len(options)
-                draw_box(stdscr, dynamic_title, options, descriptions, current_idx)
+                draw_box(stdscr, dynamic_title, options, descriptions, current_idx, status)
             elif key in [curses.KEY_ENTER, 10, 13]:
                 return options[current_idx]
             elif key == 27:  # ESC
@@ -109,22 +116,25 @@ def handle_menu(stdscr, title, descriptions):
 
 
 def show_menu(stdscr):
-    global contacts, my_destination, router, reticulum, broadcast_destination, telephone
+    global my_destination, router, reticulum, broadcast_destination, telephone
     curses.curs_set(0)
     stdscr.keypad(True)
     # threading.Thread(target=background_refresh, args=(stdscr,), daemon=True).start()
 
     main_menu = {
         "messages": "Messages",
+        "search": "Search Messages",
         "voicemail": "Voicemail",
         "audio": "Audio Call",
         "files": "Files",
         "announce": "Announce",
         "broadcast": "Broadcast",
         "sip": "SIP",
-        "mayday": "MAYDAY [Emergency Broadcast]",
-        "q": "Quit"
+        "mayday": "MAYDAY [Emergency Broadcast]"
     }
+    if PROPAGATION_NODE:
+        main_menu["sync"] = "Sync Propagated Messages"
+    main_menu["q"] = "Quit"
 
     while True:
         title = f"LRECOMM"
@@ -134,13 +144,14 @@ def show_menu(stdscr):
             break
 
         elif selected == "messages":
-            contact_menu = {str(i): f"{c['name']} " for i, c in enumerate(contacts)}
+            contact_list = contacts.snapshot()
+            contact_menu = {str(i): f"{c['name']} " for i, c in enumerate(contact_list)}
             contact_menu["back"] = "Back to Main Menu"
 
             contact_selected = handle_menu(stdscr, "Send Message To", contact_menu)
 
             if contact_selected in contact_menu and contact_selected != "back":
-                recipient = contacts[int(contact_selected)]
+                recipient = contact_list[int(contact_selected)]
                 while True:
                     user_input = show_messages(stdscr, recipient['hash'], recipient['name'])
 
@@ -149,9 +160,18 @@ def show_menu(stdscr):
                     elif user_input == "":
                         pass
                     else:
-                        dest = resolve_destination(recipient['hash'])
-                        send_msg(router, dest, my_destination, user_input)
-                        log_msg_send(recipient['hash'], user_input)
+                        log_id = log_msg_send(recipient['hash'], user_input)
+                        status = send_msg_to(recipient['hash'], user_input, log_id)
+                        if status != SEND_SENT:
+                            stdscr.clear()
+                            stdscr.addstr(0, 0, f"{recipient['name']} is {status}", curses.A_BOLD)
+                            stdscr.refresh()
+                            time.sleep(1)
+        elif selected == "search":
+            query = get_user_input(stdscr, "Search messages for:")
+            if query.strip():
+                names = {c["hash"]: c["name"] for c in contacts.snapshot()}
+                show_search_results(stdscr, query, names)
         elif selected == "voicemail":
             vm_menu = {}
             vm_menu["send"] = "Send a Voicemail"
@@ -163,26 +183,29 @@ def show_menu(stdscr):
             vm_selected = handle_menu(stdscr, "Voicemail", vm_menu)
 
             if vm_selected == "send":
-                send_vm_menu = {str(i): f"{c['name']} " for i, c in enumerate(contacts)}
+                contact_list = contacts.snapshot()
+                send_vm_menu = {str(i): f"{c['name']} " for i, c in enumerate(contact_list)}
                 send_vm_menu["back"] = "Back to Voicemail Menu"
 
                 send_vm_selected = handle_menu(stdscr, "Send Voicemail To", send_vm_menu)
                 if send_vm_selected in send_vm_menu and send_vm_selected != "back":
-                    recipient = contacts[int(send_vm_selected)]
+                    recipient = contact_list[int(send_vm_selected)]
                     
                     # records a voice message in wav format and returns filepath
                     vm_filepath = record_voicemail(stdscr, recipient["hash"])
                     
                     #vm_filepath = "../str/voicemails/received/demo.wav"
+                    vm_filepath, blob_hash = blob_store.put_file(vm_filepath, move=True)
                     
-                    send_vm(vm_filepath, my_destination, recipient["hash"], router)
+                    log_id = log_vm_send(recipient["hash"], vm_filepath, blob_hash)
                     
-                    log_vm_send(recipient["hash"], vm_filepath)
+                    status = send_vm(vm_filepath, recipient["hash"], log_id)
                     
                     stdscr.clear()
                     stdscr.addstr(0, 0, f"To: {recipient['name']} [{recipient['hash']}]", curses.A_BOLD)
                     stdscr.addstr(1, 0, f"Voicemail Path: {vm_filepath}")
                     stdscr.addstr(2, 0, f"Logged into the database")
+                    stdscr.addstr(3, 0, f"Status: {status}")
                     stdscr.refresh()
                     time.sleep(2)
 
@@ -221,29 +244,34 @@ def show_menu(stdscr):
             file_selected = handle_menu(stdscr, "File", file_menu)
 
             if file_selected == "send":
-                send_file_menu = {str(i): f"{c['name']} " for i, c in enumerate(contacts)}
+                contact_list = contacts.snapshot()
+                send_file_menu = {str(i): f"{c['name']} " for i, c in enumerate(contact_list)}
                 send_file_menu["back"] = "Back to File Menu"
 
                 send_file_selected = handle_menu(stdscr, "Send File To", send_file_menu)
                 if send_file_selected in send_file_menu and send_file_selected != "back":
-                    recipient = contacts[int(send_file_selected)]
+                    recipient = contact_list[int(send_file_selected)]
                     
                     file_filepath = get_manual_file_path(stdscr)
                     
-                    send_file(file_filepath, my_destination, recipient["hash"], router)
-                    
-                    log_file_send(recipient["hash"], file_filepath)
-                    
-                    stdscr.clear()
-                    stdscr.addstr(0, 0, f"To: {recipient['name']} [{recipient['hash']}]", curses.A_BOLD)
-                    stdscr.addstr(1, 0, f"File Path: {file_filepath}")
-                    stdscr.addstr(2, 0, f"Logged into the database")
-                    stdscr.refresh()
-                    time.sleep(2)
+                    if file_filepath:
+                        blob_path, blob_hash = blob_store.put_file(file_filepath)
+                        file_name = os.path.basename(file_filepath)
+                        log_id = log_file_send(recipient["hash"], blob_path, blob_hash, file_name)
+                        
+                        status = send_file(blob_path, recipient["hash"], log_id, file_name)
+                        
+                        stdscr.clear()
+                        stdscr.addstr(0, 0, f"To: {recipient['name']} [{recipient['hash']}]", curses.A_BOLD)
+                        stdscr.addstr(1, 0, f"File Path: {file_filepath}")
+                        stdscr.addstr(2, 0, f"Logged into the database")
+                        stdscr.addstr(3, 0, f"Status: {status}")
+                        stdscr.refresh()
+                        time.sleep(2)
 
             elif file_selected == "recv":
                 recv_file = get_recv_files()
-                recv_file_menu = {str(i): f"{c[0]} " for i, c in enumerate(recv_file)}
+                recv_file_menu = {str(i): f"{c[3] or c[0]} " for i, c in enumerate(recv_file)}
                 recv_file_menu["back"] = "Back to File Menu"
                 recv_file_selected = handle_menu(stdscr, "Received Files", recv_file_menu)
                 
@@ -252,7 +280,7 @@ def show_menu(stdscr):
                     open_file_in_new_shell(file[0])
             elif file_selected == "sent":
                 sent_file = get_sent_files()
-                sent_file_menu = {str(i): f"{c[0]} " for i, c in enumerate(sent_file)}
+                sent_file_menu = {str(i): f"{c[3] or c[0]} " for i, c in enumerate(sent_file)}
                 sent_file_menu["back"] = "Back to File Menu"
                 sent_file_selected = handle_menu(stdscr, "Files Sent", sent_file_menu)
                 
@@ -281,9 +309,11 @@ def show_menu(stdscr):
             else:
                 pass
         elif selected == "announce":
-            announce_myself(my_destination, router)
             stdscr.clear()
-            stdscr.addstr(0, 0, f"Announced myself with hash: {my_destination.hash.hex()}", curses.A_BOLD)
+            if announce_myself(my_destination, router, timeout=5):
+                stdscr.addstr(0, 0, f"Announced myself with hash: {my_destination.hash.hex()}", curses.A_BOLD)
+            else:
+                stdscr.addstr(0, 0, "Announce deferred, airtime budget exhausted", curses.A_BOLD)
             stdscr.refresh()
             time.sleep(1)
         elif selected == "broadcast":
@@ -307,12 +337,13 @@ def show_menu(stdscr):
             audio_selected = handle_menu(stdscr, "Audio Call", audio_menu)
 
             if audio_selected == "call":
-                call_menu = {str(i): f"{c['name']}" for i, c in enumerate(contacts)}
+                contact_list = contacts.snapshot()
+                call_menu = {str(i): f"{c['name']}" for i, c in enumerate(contact_list)}
                 call_menu["back"] = "Back to Audio Menu"
 
                 selected_contact = handle_menu(stdscr, "Call Contact", call_menu)
                 if selected_contact != "back":
-                    recipient = contacts[int(selected_contact)]
+                    recipient = contact_list[int(selected_contact)]
 
                     RNS.log(f"Calling {recipient['name']} with delivery_hash {recipient['delivery_hash']}", RNS.LOG_DEBUG)
                     try:
@@ -344,6 +375,46 @@ def show_menu(stdscr):
                 stdscr.refresh()
                 time.sleep(2)
 
+        elif selected == "sync":
+            propagation_sync.sync_now()
+            stdscr.clear()
+            stdscr.addstr(0, 0, "Syncing messages from the propagation node...", curses.A_BOLD)
+            stdscr.refresh()
+            time.sleep(1)
+        elif selected == "mayday":
+            mayday_menu = {}
+            if mayday.active:
+                mayday_menu["update"] = "Update MAYDAY Status"
+                mayday_menu["cancel"] = "Cancel MAYDAY"
+            else:
+                mayday_menu["raise"] = "Raise MAYDAY"
+            mayday_menu["heard"] = "Active MAYDAYs Heard"
+            mayday_menu["back"] = "Back to Main Menu"
+
+            mayday_selected = handle_menu(stdscr, "MAYDAY", mayday_menu)
+
+            if mayday_selected in ["raise", "update"]:
+                status_menu = {str(code): name for code, name in SOS_STATUS_NAMES.items() if code != SOS_CANCEL}
+                status_menu["back"] = "Back to Main Menu"
+                status_selected = handle_menu(stdscr, "MAYDAY Status", status_menu)
+                if status_selected != "back":
+                    position = parse_position(get_user_input(stdscr, "Position as lat, lon (leave empty if unknown):"))
+                    raise_mayday(broadcast_destination, my_destination, int(status_selected), position)
+                    stdscr.clear()
+                    stdscr.addstr(0, 0, f"MAYDAY active: {status_menu[status_selected]}", curses.A_BOLD)
+                    stdscr.addstr(1, 0, "Voicemails and files are held until it is cancelled")
+                    stdscr.refresh()
+                    time.sleep(2)
+            elif mayday_selected == "cancel":
+                mayday.cancel()
+                stdscr.clear()
+                stdscr.addstr(0, 0, "MAYDAY cancelled", curses.A_BOLD)
+                stdscr.refresh()
+                time.sleep(2)
+            elif mayday_selected == "heard":
+                names = {c["hash"]: c["name"] for c in contacts.snapshot()}
+                show_sos_list(stdscr, names)
+
         else:
             stdscr.clear()
             msg = f"You selected: {main_menu[selected]}"
@@ -373,9 +444,19 @@ def shutdown():
         RNS.log(f"[ERROR] During telephone shutdown: {e}", RNS.LOG_ERROR)
         # print(f"[ERROR] During telephone shutdown: {e}")
 
+    announce_ingestor.stop()
+    announcer.stop()
+    outbox.stop()
+    propagation_sync.stop()
+
+    # Commit any received messages, voicemails and files still queued
+    if not log_writer.stop(timeout=5):
+        RNS.log("Timed out flushing queued log records", RNS.LOG_ERROR)
+
     RNS.Transport.detach_interfaces()
     RNS.Transport.identity = None
     RNS.reticulum = None
+    db.close()
 
 
 # sigint handler
@@ -391,6 +472,11 @@ signal.signal(signal.SIGTERM, signal_handler)
 
 def main():
     global my_destination, router, reticulum, broadcast_destination, telephone
+    schema_version = migrate()
+    RNS.log(f"Database schema at version {schema_version}", RNS.LOG_DEBUG)
+    blob_store.collect()
+    blobs, stored_bytes, saved_bytes = blob_store.usage()
+    RNS.log(f"Blob store holds {blobs} files, {stored_bytes} bytes, {saved_bytes} bytes saved by deduplication", RNS.LOG_DEBUG)
     my_destination, router, reticulum, broadcast_destination = rns_setup("../.reticulum")
     id = load_identity()
     # telephone = setup_audio_call()
@@ -403,8 +489,8 @@ def main():
 
     file_sink = FileSink(recording_path, samplerate=8000)
     # telephone = ReticulumTelephone(id, microphone=microphone, auto_answer=0.5, receive_sink=file_sink)
-    telephone = ReticulumTelephone(id, speaker=speaker, microphone=microphone, auto_answer=0.5)
-    telephone.announce()
+    telephone = ReticulumTelephone(id, speaker=speaker, microphone=microphone, auto_answer=0.5, auto_announce=False)
+    announcer.register(ANNOUNCE_TELEPHONY, telephone.destination, Telephone.ANNOUNCE_INTERVAL)
 
     try:
         run_menu()
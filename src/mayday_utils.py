@@ -0,0 +1,218 @@
+import RNS
+import os
+import glob
+import time
+import random
+import struct
+import threading
+
+from database_utils import log_sos
+from airtime_utils import TRAFFIC_EMERGENCY
+
+# SOS beacon frame, 33 bytes:
+#
+#   magic (2) | version (1) | sender hash (16) | session (2) | repeat (2) |
+#   status (1) | battery (1) | latitude (4) | longitude (4)
+#
+# The sender hash is the LXMF delivery hash so receivers can reply. Latitude
+# and longitude are signed 1e-7 degree units, NO_POSITION when there is no
+# fix. session is random per MAYDAY and repeat counts its beacons, so every
+# repeat has distinct bytes and gets past broadcast duplicate suppression.
+SOS_MAGIC    = b"\x00\xa3"
+SOS_VERSION  = 1
+SOS_FRAME    = struct.Struct("!2sB16sHHBBii")
+NO_POSITION  = -2**31
+NO_BATTERY   = 0xFF
+
+SOS_GENERAL  = 0
+SOS_MEDICAL  = 1
+SOS_INJURED  = 2
+SOS_TRAPPED  = 3
+SOS_FIRE     = 4
+SOS_FLOOD    = 5
+SOS_CANCEL   = 0xFF
+
+SOS_STATUS_NAMES = {
+    SOS_GENERAL: "Needs help",
+    SOS_MEDICAL: "Medical emergency",
+    SOS_INJURED: "Injured",
+    SOS_TRAPPED: "Trapped",
+    SOS_FIRE: "Fire",
+    SOS_FLOOD: "Flooding",
+    SOS_CANCEL: "Cancelled"
+}
+
+def pack_sos(sender_hash, session, repeat, status, battery=None, position=None):
+    lat, lon = NO_POSITION, NO_POSITION
+    if position:
+        lat, lon = round(position[0]*1e7), round(position[1]*1e7)
+    battery = NO_BATTERY if battery is None else max(0, min(100, int(battery)))
+    return SOS_FRAME.pack(SOS_MAGIC, SOS_VERSION, sender_hash, session & 0xFFFF, min(repeat, 0xFFFF), status, battery, lat, lon)
+
+def unpack_sos(data):
+    if len(data) < SOS_FRAME.size or not data.startswith(SOS_MAGIC):
+        raise ValueError("Not an SOS frame")
+    _, version, sender_hash, session, repeat, status, battery, lat, lon = SOS_FRAME.unpack_from(data)
+    if version != SOS_VERSION:
+        raise ValueError(f"Unsupported SOS frame version {version}")
+    return {
+        "sender_hash": sender_hash,
+        "session": session,
+        "repeat": repeat,
+        "status": status,
+        "battery": None if battery == NO_BATTERY else battery,
+        "position": None if lat == NO_POSITION else (lat/1e7, lon/1e7)
+    }
+
+def battery_level():
+    # Percentage from the first battery the kernel reports, None elsewhere
+    for path in sorted(glob.glob("/sys/class/power_supply/BAT*/capacity")):
+        try:
+            with open(path) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            pass
+    return None
+
+def parse_position(text):
+    # "lat, lon" in decimal degrees, None if empty or invalid
+    try:
+        lat, lon = (float(part) for part in text.replace(" ", "").split(","))
+    except ValueError:
+        return None
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
+        return (lat, lon)
+    return None
+
+class MaydayBeacon():
+    # Repeats an SOS frame on the broadcast destination until cancelled.
+    # Beacons go out at the offsets in SCHEDULE after activation, then every
+    # MAX_INTERVAL, each with JITTER so nearby beacons do not keep colliding.
+    # Battery is re-read for every beacon. While active the outbox holds
+    # queued voicemails and files back and pauses file transfers already
+    # under way. Cancelling sends CANCEL_REPEATS frames with SOS_CANCEL so
+    # receivers clear the alert. Beacons are admitted as emergency traffic,
+    # ahead of everything else.
+    SCHEDULE       = (0, 5, 15, 30, 60, 120, 300)
+    MAX_INTERVAL   = 300
+    JITTER         = 0.1
+    CANCEL_REPEATS = 3
+    CANCEL_SPACING = 5
+    ADMIT_TIMEOUT  = 30
+
+    def __init__(self, outbox=None, airtime=None):
+        self.outbox = outbox
+        self.airtime = airtime
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.destination = None
+        self.sender_hash = None
+        self.session = None
+        self.status = None
+        self.position = None
+        self.repeat = 0
+        self.started = None
+        self.thread = None
+
+    @property
+    def active(self):
+        return self.session != None
+
+    def start(self, destination, sender_hash, status=SOS_GENERAL, position=None):
+        with self.lock:
+            self.destination = destination
+            self.sender_hash = sender_hash
+            self.status = status
+            self.position = position
+            if self.active:
+                self.wakeup.set()
+            else:
+                self.session = struct.unpack("!H", os.urandom(2))[0]
+                self.repeat = 0
+                self.started = time.time()
+                self.thread = threading.Thread(target=self.__beacon, args=(self.session,), daemon=True)
+                self.thread.start()
+        if self.outbox:
+            self.outbox.hold_bulk(True)
+        RNS.log(f"MAYDAY raised: {SOS_STATUS_NAMES.get(status, status)}", RNS.LOG_WARNING)
+
+    def update(self, status=None, position=None):
+        # Takes effect with the next beacon, sent right away
+        with self.lock:
+            if not self.active:
+                return False
+            if status != None: self.status = status
+            if position != None: self.position = position
+        self.wakeup.set()
+        return True
+
+    def cancel(self):
+        with self.lock:
+            if not self.active:
+                return False
+            session = self.session
+            self.session = None
+        if self.outbox:
+            self.outbox.hold_bulk(False)
+        self.wakeup.set()
+        threading.Thread(target=self.__cancel_beacons, args=(session,), daemon=True).start()
+        RNS.log("MAYDAY cancelled", RNS.LOG_WARNING)
+        return True
+
+    def __cancel_beacons(self, session):
+        for i in range(self.CANCEL_REPEATS):
+            if i: time.sleep(self.CANCEL_SPACING)
+            self.__send(session, SOS_CANCEL)
+
+    def __send(self, session, status):
+        frame = pack_sos(self.sender_hash, session, self.repeat, status, battery_level(), self.position)
+        self.repeat += 1
+        if self.airtime and not self.airtime.admit(TRAFFIC_EMERGENCY, len(frame), timeout=self.ADMIT_TIMEOUT):
+            RNS.log("MAYDAY beacon skipped, airtime budget exhausted", RNS.LOG_WARNING)
+            return
+        try:
+            RNS.Packet(self.destination, frame).send()
+        except Exception as e:
+            RNS.log(f"Could not send MAYDAY beacon: {e}", RNS.LOG_ERROR)
+
+    def __next_delay(self):
+        elapsed = time.time()-self.started
+        for offset in self.SCHEDULE:
+            if offset > elapsed:
+                return offset-elapsed
+        return self.MAX_INTERVAL*random.uniform(1-self.JITTER, 1+self.JITTER)
+
+    def __beacon(self, session):
+        while True:
+            self.wakeup.clear()
+            with self.lock:
+                if self.session != session:
+                    return
+                status = self.status
+            self.__send(session, status)
+            self.wakeup.wait(self.__next_delay())
+
+class MaydayReceiver():
+    # Aggregates heard beacons into the sos table, one row per peer
+    def __init__(self, own_hash=None):
+        self.own_hash = own_hash
+        self.received = 0
+        self.malformed = 0
+
+    def handle(self, data):
+        try:
+            frame = unpack_sos(data)
+        except (ValueError, struct.error) as e:
+            self.malformed += 1
+            RNS.log(f"Dropping SOS frame: {e}", RNS.LOG_DEBUG)
+            return None
+        if frame["sender_hash"] == self.own_hash:
+            return None
+
+        self.received += 1
+        lat, lon = frame["position"] or (None, None)
+        active = frame["status"] != SOS_CANCEL
+        sender = frame["sender_hash"].hex()
+        RNS.log(f"MAYDAY from {sender}: {SOS_STATUS_NAMES.get(frame['status'], frame['status'])}", RNS.LOG_WARNING if active else RNS.LOG_INFO)
+        log_sos(sender, frame["session"], frame["status"], frame["battery"], lat, lon, active)
+        return frame
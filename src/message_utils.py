@@ -1,11 +1,59 @@
 import curses
 import textwrap
 from database_utils import get_messages
+from database_utils import get_message_page
+from database_utils import page_key
+from database_utils import search_messages
 from database_utils import log_msg_send
+from database_utils import get_active_sos
+from mayday_utils import SOS_STATUS_NAMES
+from datetime import datetime as dt
 
 WIDTH = 70
 FILLCHAR = " "
 SCROLL_STEP = 1
+PREFETCH_ROWS = 20
+PREFETCH_LINES = 10
+SEARCH_LIMIT = 200
+
+class MessageHistory():
+    # Wrapped lines for the part of a conversation loaded so far. Starts with
+    # the newest page and pulls older pages in on demand as the view scrolls up.
+    def __init__(self, identity_hash, width, page_size):
+        self.identity_hash = identity_hash
+        self.width = width
+        self.page_size = page_size
+        self.lines = []
+        self.oldest = None
+        self.exhausted = False
+
+    def format_rows(self, rows):
+        formatted_lines = []
+        for x in rows:
+            wrapped = textwrap.wrap(x[0], WIDTH)
+            if x[2] == 1:
+                aligned = [line.rjust(self.width) for line in wrapped]
+                aligned.append(x[1].rjust(self.width))
+            else:
+                aligned = [line.ljust(self.width) for line in wrapped]
+                aligned.append(x[1].ljust(self.width))
+            formatted_lines.extend(aligned)
+        return formatted_lines
+
+    def load_older(self):
+        if self.exhausted:
+            return 0
+
+        rows = get_message_page(self.identity_hash, self.oldest, self.page_size)
+        if len(rows) < self.page_size:
+            self.exhausted = True
+        if not rows:
+            return 0
+
+        self.oldest = page_key(rows[0])
+        older_lines = self.format_rows(rows)
+        self.lines[:0] = older_lines
+        return len(older_lines)
 
 def show_messages(stdscr, identity_hash, NAME):
     curses.curs_set(1)
@@ -16,21 +64,12 @@ def show_messages(stdscr, identity_hash, NAME):
     input_win_height = 8
     content_height = height - input_win_height - 5
 
-    msg = get_messages(identity_hash)
+    # Every message takes at least two lines, so one screen plus the prefetch
+    # margin in rows is always enough to fill the view
+    history = MessageHistory(identity_hash, width, max(1, content_height) + PREFETCH_ROWS)
+    history.load_older()
 
-    # Build wrapped and aligned message lines
-    formatted_lines = []
-    for x in msg:
-        wrapped = textwrap.wrap(x[0], WIDTH)
-        if x[2] == 1:
-            aligned = [line.rjust(width) for line in wrapped]
-            aligned.append(x[1].rjust(width))
-        else:
-            aligned = [line.ljust(width) for line in wrapped]
-            aligned.append(x[1].ljust(width))
-        formatted_lines.extend(aligned)
-
-    total_lines = len(formatted_lines)
+    total_lines = len(history.lines)
     scroll_pos = max(0, total_lines - content_height)
 
     while True:
@@ -42,7 +81,7 @@ def show_messages(stdscr, identity_hash, NAME):
         stdscr.addstr(2, 0, "-" * width)
 
         # Message view
-        view_lines = formatted_lines[scroll_pos:scroll_pos + content_height]
+        view_lines = history.lines[scroll_pos:scroll_pos + content_height]
         for idx, line in enumerate(view_lines):
             stdscr.addstr(3 + idx, 0, line[:width])  # Clip long lines
             stdscr.addstr(3 + idx, 0, "")
@@ -62,9 +101,12 @@ def show_messages(stdscr, identity_hash, NAME):
             key = stdscr.getch()
             if key == curses.KEY_UP:
                 scroll_pos = max(0, scroll_pos - SCROLL_STEP)
+                if scroll_pos < PREFETCH_LINES and not history.exhausted:
+                    scroll_pos += history.load_older()
+                    total_lines = len(history.lines)
                 break
             elif key == curses.KEY_DOWN:
-                scroll_pos = min(total_lines - content_height, scroll_pos + SCROLL_STEP)
+                scroll_pos = max(0, min(total_lines - content_height, scroll_pos + SCROLL_STEP))
                 break
             elif key == curses.KEY_BACKSPACE or key == 127:
                 box = box[:-1]
@@ -79,3 +121,92 @@ def show_messages(stdscr, identity_hash, NAME):
                 box += chr(key)
                 win.addstr(0, len(box) - 1, chr(key))
                 win.refresh()
+
+def show_search_results(stdscr, query, names=None):
+    curses.curs_set(0)
+    names = names or {}
+    height, width = stdscr.getmaxyx()
+    content_height = height - 5
+
+    results = search_messages(query, limit=SEARCH_LIMIT)
+
+    formatted_lines = []
+    for content, time, align, peer in results:
+        if peer == "None":
+            who = "Broadcast"
+        else:
+            who = names.get(peer, peer[:8])
+        arrow = "to" if align == 1 else "from"
+        prefix = f"{time} {arrow} {who}: "
+        wrapped = textwrap.wrap(content, max(10, width - len(prefix) - 1))
+        for idx, line in enumerate(wrapped):
+            formatted_lines.append((prefix if idx == 0 else " " * len(prefix)) + line)
+
+    total_lines = len(formatted_lines)
+    scroll_pos = 0
+    header = f"Search: {query} [{len(results)} matches]"
+
+    while True:
+        stdscr.clear()
+        stdscr.addstr(0, 0, "-" * width)
+        stdscr.addstr(1, max(0, (width - len(header)) // 2), header[:width - 1])
+        stdscr.addstr(2, 0, "-" * width)
+
+        if not formatted_lines:
+            stdscr.addstr(3, 0, "No messages found")
+        view_lines = formatted_lines[scroll_pos:scroll_pos + content_height]
+        for idx, line in enumerate(view_lines):
+            stdscr.addstr(3 + idx, 0, line[:width - 1])
+
+        stdscr.addstr(height - 1, 0, "[UP/DOWN to scroll] [ESC or q to go back]"[:width - 1])
+        stdscr.refresh()
+
+        key = stdscr.getch()
+        if key == curses.KEY_UP:
+            scroll_pos = max(0, scroll_pos - SCROLL_STEP)
+        elif key == curses.KEY_DOWN:
+            scroll_pos = max(0, min(total_lines - content_height, scroll_pos + SCROLL_STEP))
+        elif key in [27, ord("q")]:
+            return
+
+def show_sos_list(stdscr, names=None):
+    curses.curs_set(0)
+    names = names or {}
+    height, width = stdscr.getmaxyx()
+    content_height = height - 5
+    scroll_pos = 0
+
+    while True:
+        # Re-read on every key so new beacons show up while the list is open
+        rows = get_active_sos()
+        formatted_lines = []
+        for sender, status, battery, lat, lon, first_seen, last_seen, heard in rows:
+            who = names.get(sender, sender[:8])
+            where = f"{lat:.5f}, {lon:.5f}" if lat is not None else "position unknown"
+            power = f"{battery}%" if battery is not None else "?"
+            formatted_lines.append(f"{who}: {SOS_STATUS_NAMES.get(status, status)}")
+            formatted_lines.append(f"    {where}, battery {power}, heard {heard}x, last {dt.fromtimestamp(last_seen):%H:%M:%S}")
+
+        total_lines = len(formatted_lines)
+        header = f"Active MAYDAYs [{len(rows)}]"
+        stdscr.clear()
+        stdscr.addstr(0, 0, "-" * width)
+        stdscr.addstr(1, max(0, (width - len(header)) // 2), header[:width - 1])
+        stdscr.addstr(2, 0, "-" * width)
+
+        if not formatted_lines:
+            stdscr.addstr(3, 0, "No active MAYDAYs heard")
+        view_lines = formatted_lines[scroll_pos:scroll_pos + content_height]
+        for idx, line in enumerate(view_lines):
+            stdscr.addstr(3 + idx, 0, line[:width - 1])
+
+        stdscr.addstr(height - 1, 0, "[UP/DOWN to scroll] [r to refresh] [ESC or q to go back]"[:width - 1])
+        stdscr.refresh()
+
+        key = stdscr.getch()
+        if key == curses.KEY_UP:
+            scroll_pos = max(0, scroll_pos - SCROLL_STEP)
+        elif key == curses.KEY_DOWN:
+            scroll_pos = max(0, min(total_lines - content_height, scroll_pos + SCROLL_STEP))
+        elif key in [27, ord("q")]:
+            return
@@ -0,0 +1,49 @@
+from database_utils import SENT_TABLES, get_delivery_times
+
+PERCENTILES = (50, 95, 99)
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, -(-p*len(sorted_values)//100))
+    return sorted_values[min(rank, len(sorted_values))-1]
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    summary = {"count": len(latencies)}
+    for p in PERCENTILES:
+        summary[f"p{p}"] = percentile(latencies, p)
+    return summary
+
+def delivery_latency(peer=None, kind=None, end_to_end=False):
+    # Send-to-delivery latency in seconds. sentAt is when the outbox handed the
+    # final attempt to LXMF; with end_to_end the clock starts when the message
+    # was first queued, so path discovery and retries are included.
+    kinds = [kind] if kind else list(SENT_TABLES)
+    latencies = []
+    for k in kinds:
+        for _, queued_at, sent_at, delivered_at in get_delivery_times(k, peer):
+            start = queued_at if end_to_end else sent_at
+            if start is not None and delivered_at is not None:
+                latencies.append(delivered_at-start)
+    return summarize(latencies)
+
+def latency_report(end_to_end=False):
+    # {"peer": {hash: {kind: summary}}, "kind": {kind: summary}}
+    by_peer = {}
+    by_kind = {}
+    for kind in SENT_TABLES:
+        per_peer = {}
+        for peer, queued_at, sent_at, delivered_at in get_delivery_times(kind):
+            start = queued_at if end_to_end else sent_at
+            if start is not None and delivered_at is not None:
+                per_peer.setdefault(peer, []).append(delivered_at-start)
+
+        all_latencies = []
+        for peer, latencies in per_peer.items():
+            by_peer.setdefault(peer, {})[kind] = summarize(latencies)
+            all_latencies.extend(latencies)
+        by_kind[kind] = summarize(all_latencies)
+
+    return {"peer": by_peer, "kind": by_kind}
@@ -0,0 +1,457 @@
+import RNS
+import os
+import LXMF
+import json
+import time
+import random
+import threading
+
+from database_utils import db, set_delivery_state
+from airtime_utils import TRAFFIC_EMERGENCY, TRAFFIC_TEXT, TRAFFIC_BULK
+
+PRIORITY_EMERGENCY = 0
+PRIORITY_TEXT      = 1
+PRIORITY_VOICEMAIL = 2
+PRIORITY_FILE      = 3
+
+KIND_MESSAGE   = "message"
+KIND_VOICEMAIL = "voicemail"
+KIND_FILE      = "file"
+KIND_RECEIPT   = "receipt"
+
+PRIORITY_TRAFFIC = {
+    PRIORITY_EMERGENCY: TRAFFIC_EMERGENCY,
+    PRIORITY_TEXT: TRAFFIC_TEXT,
+    PRIORITY_VOICEMAIL: TRAFFIC_BULK,
+    PRIORITY_FILE: TRAFFIC_BULK
+}
+
+STATE_QUEUED    = "queued"
+STATE_SENDING   = "sending"
+STATE_SENT      = "sent"
+STATE_DELIVERED = "delivered"
+STATE_PROPAGATED = "propagated"
+STATE_FAILED    = "failed"
+
+def file_payload(path, name=None):
+    # Files are queued as the stored copy to read and the name the peer
+    # sees, which the content-addressed copy no longer carries
+    return json.dumps({"path": path, "name": name or os.path.basename(path)})
+
+def parse_file_payload(payload):
+    # Returns (path, name). Rows queued by earlier builds are a bare path.
+    if payload.startswith("{"):
+        entry = json.loads(payload)
+        return entry["path"], entry["name"]
+    return payload, os.path.basename(payload)
+
+SQL_OUTBOX_ADD    = """
+    INSERT INTO outbox (destHash, kind, priority, payload, logID, nextAttempt, enqueuedAt)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_OUTBOX_QUEUED = """
+    SELECT outboxID, destHash, kind, priority, payload, logID, attempts, nextAttempt, enqueuedAt
+    FROM outbox WHERE state = 'queued' ORDER BY priority, outboxID
+"""
+SQL_OUTBOX_STATE  = "UPDATE outbox SET state = ? WHERE outboxID = ?"
+SQL_OUTBOX_RETRY  = "UPDATE outbox SET state = ?, attempts = ?, nextAttempt = ? WHERE outboxID = ?"
+SQL_OUTBOX_DONE   = "DELETE FROM outbox WHERE outboxID = ?"
+SQL_OUTBOX_RESET  = "UPDATE outbox SET state = 'queued' WHERE state = 'sending'"
+
+SQL_RECEIPT_ADD    = "INSERT OR IGNORE INTO receipts (msgHash, destHash, kind, logID, handedAt) VALUES (?, ?, ?, ?, ?)"
+SQL_RECEIPT_FIND   = "SELECT kind, logID FROM receipts WHERE msgHash = ? AND destHash = ?"
+SQL_RECEIPT_DONE   = "DELETE FROM receipts WHERE msgHash = ? AND destHash = ?"
+SQL_RECEIPT_EXPIRE = "DELETE FROM receipts WHERE handedAt < ?"
+
+class Outbox():
+    # Durable, prioritized queue in front of router.handle_outbound.
+    #
+    # Rows are dispatched lowest priority class first. Within a class each
+    # peer is strictly FIFO: the next row for a (peer, class) pair is only
+    # sent once the previous one was delivered or gave up. A text therefore
+    # never waits behind a file to the same peer. At most MAX_BULK_IN_FLIGHT
+    # voicemails and files are handed to LXMF at once. A failed delivery is
+    # retried with jittered exponential backoff until MAX_ATTEMPTS.
+    # hold_bulk() parks queued voicemails and files, e.g. while a MAYDAY is
+    # active, so texts have the channel to themselves. Streamed transfers
+    # already under way are paused, they are queued again without counting
+    # an attempt and resume from the receiver's chunks. With an airtime
+    # scheduler a row is only handed to LXMF once its traffic class has
+    # been granted the estimated airtime. A row that is not sent after all,
+    # because it was held or failed first, cancels its ticket.
+    #
+    # Small texts wait COALESCE_WINDOW before they are sent. Texts queued to
+    # the same peer meanwhile go out with them as one bundle, if a bundler
+    # is registered and the peer supports it. Emergency texts never wait.
+    #
+    # With propagation enabled, a row that failed propagation_after direct
+    # attempts is sent PROPAGATED instead. That only needs the peer's
+    # identity, not a path, and the row is done once the propagation node
+    # has accepted it. LXMF reports no delivery from there, so the row is
+    # marked delivered when confirm() is called with the peer's receipt.
+    # Receipts not heard within RECEIPT_TTL are forgotten.
+    #
+    # Kinds with a registered streamer, e.g. files, go to peers that
+    # support it as a streamed transfer instead of an LXMF message. A
+    # transfer only times out after SEND_TIMEOUT without progress.
+    #
+    # Rows survive restarts. Anything that was mid-send when the process
+    # died is queued again on start, so delivery is at-least-once.
+    POLL_INTERVAL      = 1
+    PATH_TIMEOUT       = 30
+    SEND_TIMEOUT       = 60*15
+    BACKOFF_BASE       = 15
+    BACKOFF_MAX        = 60*30
+    MAX_ATTEMPTS       = 12
+    MAX_BULK_IN_FLIGHT = 1
+    LXMF_OVERHEAD      = 112
+    VOICEMAIL_RATIO    = 16
+    COALESCE_WINDOW    = 2.0
+    SMALL_TEXT         = 200
+    MAX_BUNDLE         = 16
+    MAX_BUNDLE_BYTES   = 1024
+    RECEIPT_TTL        = 60*60*24*30
+
+    def __init__(self, resolver, airtime=None, max_bulk_in_flight=MAX_BULK_IN_FLIGHT, coalesce_window=COALESCE_WINDOW):
+        self.resolver = resolver
+        self.airtime = airtime
+        self.coalesce_window = coalesce_window
+        self.propagation_after = None
+        self.bundlers = {}
+        self.streamers = {}
+        self.tickets = {}
+        self.max_bulk_in_flight = max_bulk_in_flight
+        self.builders = {}
+        self.router = None
+        self.source = None
+        self.lock = threading.RLock()
+        self.wakeup = threading.Event()
+        self.inflight = {}
+        self.busy_keys = set()
+        self.resolving = set()
+        self.bulk_held = False
+        self.should_run = False
+        self.thread = None
+
+    def register_builder(self, kind, builder):
+        # builder(destination, source, payload) returns an LXMessage
+        self.builders[kind] = builder
+
+    def register_bundler(self, kind, bundler, supported):
+        # bundler(destination, source, [(enqueued_at, payload), ...]) returns
+        # one LXMessage for several rows, used when supported(dest_hash)
+        self.bundlers[kind] = (bundler, supported)
+
+    def register_streamer(self, kind, streamer, supported):
+        # streamer(destination, source, payload, delivered, failed, progress)
+        # starts a transfer and returns it, used when supported(dest_hash).
+        # The transfer calls delivered() or failed(reason) once, progress()
+        # whenever it moves, and has cancel(reason).
+        self.streamers[kind] = (streamer, supported)
+
+    def start(self, router, source):
+        self.router = router
+        self.source = source
+        if not self.should_run:
+            db.execute(SQL_OUTBOX_RESET)
+            db.execute(SQL_RECEIPT_EXPIRE, (time.time()-self.RECEIPT_TTL,))
+            self.should_run = True
+            self.thread = threading.Thread(target=self.__scheduler, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.should_run = False
+        self.wakeup.set()
+
+    def enable_propagation(self, after_attempts):
+        self.propagation_after = after_attempts
+        self.wakeup.set()
+
+    def hold_bulk(self, held):
+        self.bulk_held = held
+        if held:
+            self.__pause_streams()
+        self.wakeup.set()
+
+    def __pause_streams(self):
+        with self.lock:
+            paused = [entry for entry in self.inflight.values()
+                      if entry["bulk"] and entry["transfer"] != None and not entry["paused"]]
+            for entry in paused:
+                entry["paused"] = True
+        for entry in paused:
+            entry["transfer"].cancel("paused")
+
+    def enqueue(self, dest_hash, kind, payload, priority, log_id=None, coalesce=True):
+        now = time.time()
+        next_attempt = 0
+        if coalesce and self.__coalescable(dest_hash, kind, priority, payload):
+            next_attempt = now+self.coalesce_window
+        outbox_id = db.execute(SQL_OUTBOX_ADD, (dest_hash, kind, priority, payload, log_id, next_attempt, now))
+        self.__track(kind, log_id, STATE_QUEUED)
+        self.wakeup.set()
+        return outbox_id
+
+    def __coalescable(self, dest_hash, kind, priority, payload):
+        return (kind in self.bundlers and priority != PRIORITY_EMERGENCY and self.coalesce_window > 0
+                and len(payload.encode("utf-8")) <= self.SMALL_TEXT and self.bundlers[kind][1](dest_hash))
+
+    def __track(self, kind, log_id, state):
+        if log_id == None:
+            return
+        try:
+            set_delivery_state(kind, log_id, state)
+        except Exception as e:
+            RNS.log(f"Could not record {state} for {kind} {log_id}: {e}", RNS.LOG_ERROR)
+
+    @property
+    def bulk_in_flight(self):
+        return sum(1 for entry in self.inflight.values() if entry["bulk"])
+
+    def pending(self):
+        return db.query("SELECT COUNT(*) FROM outbox WHERE state != 'failed'")[0][0]
+
+    def __scheduler(self):
+        while self.should_run:
+            self.wakeup.wait(self.POLL_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.__expire_inflight()
+                self.__dispatch()
+            except Exception as e:
+                RNS.log(f"Outbox scheduler error: {e}", RNS.LOG_ERROR)
+        for outbox_id in list(self.tickets):
+            self.__cancel_ticket(outbox_id)
+
+    def __expire_inflight(self):
+        now = time.time()
+        with self.lock:
+            expired = [(oid, entry["transfer"]) for oid, entry in self.inflight.items() if now-entry["active"] > self.SEND_TIMEOUT]
+            # LXMF reports no delivery for propagated messages, only that
+            # the node took them
+            handed_off = [oid for oid, entry in self.inflight.items()
+                          if entry["propagated"] and entry["msg"] != None and entry["msg"].state == LXMF.LXMessage.SENT]
+        for outbox_id in handed_off:
+            self.__handed_off(outbox_id)
+        for outbox_id, transfer in expired:
+            self.__failed(outbox_id, "no delivery report")
+            if transfer != None:
+                transfer.cancel("timed out")
+
+    def __dispatch(self):
+        now = time.time()
+        heads = set()
+        queued = db.query(SQL_OUTBOX_QUEUED)
+        for row in queued:
+            outbox_id, dest_hash, kind, priority, payload, log_id, attempts, next_attempt, enqueued_at = row
+            key = (dest_hash, priority)
+            if key in heads:
+                continue
+            heads.add(key)
+
+            bulk = priority >= PRIORITY_VOICEMAIL
+            with self.lock:
+                held = key in self.busy_keys or next_attempt > now
+                held |= bulk and (self.bulk_held or self.bulk_in_flight >= self.max_bulk_in_flight)
+            if held:
+                self.__cancel_ticket(outbox_id)
+                continue
+
+            propagated = self.propagation_after != None and attempts >= self.propagation_after
+            if propagated:
+                destination = self.resolver.recall(dest_hash)
+            else:
+                if dest_hash in self.resolving:
+                    self.__cancel_ticket(outbox_id)
+                    continue
+                future = self.resolver.resolve(dest_hash, timeout=self.PATH_TIMEOUT)
+                if not future.done():
+                    self.resolving.add(dest_hash)
+                    def resolved(future, dest_hash=dest_hash):
+                        self.resolving.discard(dest_hash)
+                        self.wakeup.set()
+                    future.add_done_callback(resolved)
+                    self.__cancel_ticket(outbox_id)
+                    continue
+                destination = future.result()
+
+            members = [row]
+            if destination != None and kind in self.bundlers and self.bundlers[kind][1](dest_hash):
+                members = self.__gather(queued, row)
+            size = self.__estimate_size(kind, payload)+sum(len(member[4].encode("utf-8")) for member in members[1:])
+            if destination != None and not self.__admitted(outbox_id, priority, size):
+                continue
+
+            with self.lock:
+                self.inflight[outbox_id] = {
+                    "key": key, "bulk": bulk, "active": now, "attempts": attempts, "kind": kind,
+                    "members": [(member[0], member[5]) for member in members],
+                    "propagated": propagated, "msg": None, "transfer": None, "paused": False
+                }
+                self.busy_keys.add(key)
+
+            if destination == None:
+                self.__cancel_ticket(outbox_id)
+                self.__failed(outbox_id, "identity unknown" if propagated else "peer unreachable")
+                continue
+
+            streamer = self.streamers.get(kind)
+            if not propagated and streamer != None and streamer[1](dest_hash):
+                self.__stream(outbox_id, streamer[0], destination, payload, kind, log_id)
+                continue
+
+            try:
+                if len(members) > 1:
+                    entries = [(member[8], member[4]) for member in members]
+                    msg = self.bundlers[kind][0](destination, self.source, entries)
+                else:
+                    msg = self.builders[kind](destination, self.source, payload)
+                if not msg:
+                    raise Exception("Failed to build LXMF message")
+            except Exception as e:
+                self.__cancel_ticket(outbox_id)
+                self.__failed(outbox_id, f"could not build {kind}: {e}", retry=False)
+                continue
+
+            if propagated:
+                msg.desired_method = LXMF.LXMessage.PROPAGATED
+            with self.lock:
+                self.inflight[outbox_id]["msg"] = msg
+
+            msg.register_delivery_callback(lambda message, outbox_id=outbox_id: self.__delivered(outbox_id))
+            msg.register_failed_callback(lambda message, outbox_id=outbox_id: self.__failed(outbox_id, "delivery failed"))
+            for member in members:
+                db.execute(SQL_OUTBOX_STATE, (STATE_SENDING, member[0]))
+                self.__track(kind, member[5], STATE_SENT)
+            self.tickets.pop(outbox_id, None)
+            self.router.handle_outbound(msg)
+
+    def __stream(self, outbox_id, streamer, destination, payload, kind, log_id):
+        db.execute(SQL_OUTBOX_STATE, (STATE_SENDING, outbox_id))
+        self.__track(kind, log_id, STATE_SENT)
+        try:
+            transfer = streamer(destination, self.source, payload,
+                                lambda: self.__delivered(outbox_id),
+                                lambda reason: self.__failed(outbox_id, reason),
+                                lambda: self.__touch(outbox_id))
+        except Exception as e:
+            self.__cancel_ticket(outbox_id)
+            self.__failed(outbox_id, f"could not start {kind} transfer: {e}", retry=False)
+            return
+        self.tickets.pop(outbox_id, None)
+        with self.lock:
+            entry = self.inflight.get(outbox_id)
+            if entry:
+                entry["transfer"] = transfer
+        if self.bulk_held:
+            self.__pause_streams()
+
+    def __touch(self, outbox_id):
+        with self.lock:
+            entry = self.inflight.get(outbox_id)
+            if entry:
+                entry["active"] = time.time()
+
+    def __gather(self, queued, head):
+        # The head row plus the small texts queued behind it for the same
+        # peer and class, oldest first
+        members = [head]
+        total = len(head[4].encode("utf-8"))
+        for row in queued:
+            if len(members) >= self.MAX_BUNDLE:
+                break
+            if row[0] == head[0] or row[1] != head[1] or row[2] != head[2] or row[3] != head[3]:
+                continue
+            size = len(row[4].encode("utf-8"))
+            if size > self.SMALL_TEXT or total+size > self.MAX_BUNDLE_BYTES:
+                break
+            members.append(row)
+            total += size
+        return members
+
+    def __estimate_size(self, kind, payload):
+        # Voicemails go out codec-compressed, the WAV on disk is much larger
+        try:
+            if kind in (KIND_MESSAGE, KIND_RECEIPT):
+                size = len(payload.encode("utf-8"))
+            elif kind == KIND_VOICEMAIL:
+                size = os.path.getsize(payload)//self.VOICEMAIL_RATIO
+            else:
+                size = os.path.getsize(parse_file_payload(payload)[0])
+        except (OSError, ValueError, KeyError):
+            size = 0
+        return size+self.LXMF_OVERHEAD
+
+    def __admitted(self, outbox_id, priority, size):
+        if self.airtime == None:
+            return True
+        ticket = self.tickets.get(outbox_id)
+        if ticket == None:
+            ticket = self.airtime.request(PRIORITY_TRAFFIC.get(priority, TRAFFIC_BULK), size)
+            self.tickets[outbox_id] = ticket
+        return self.airtime.poll(ticket)
+
+    def __cancel_ticket(self, outbox_id):
+        # The ticket of a row that is not sent this time. Once the row is
+        # sent its ticket is dropped without cancelling, the airtime is spent.
+        ticket = self.tickets.pop(outbox_id, None)
+        if ticket != None:
+            self.airtime.cancel(ticket)
+
+    def __release(self, outbox_id):
+        with self.lock:
+            entry = self.inflight.pop(outbox_id, None)
+            if entry:
+                self.busy_keys.discard(entry["key"])
+        self.wakeup.set()
+        return entry
+
+    def __delivered(self, outbox_id):
+        entry = self.__release(outbox_id)
+        if entry:
+            for member_id, log_id in entry["members"]:
+                self.__track(entry["kind"], log_id, STATE_DELIVERED)
+                db.execute(SQL_OUTBOX_DONE, (member_id,))
+
+    def __handed_off(self, outbox_id):
+        entry = self.__release(outbox_id)
+        if entry:
+            msg_hash = entry["msg"].hash.hex()
+            for member_id, log_id in entry["members"]:
+                self.__track(entry["kind"], log_id, STATE_PROPAGATED)
+                if log_id != None:
+                    db.execute(SQL_RECEIPT_ADD, (msg_hash, entry["key"][0], entry["kind"], log_id, time.time()))
+                db.execute(SQL_OUTBOX_DONE, (member_id,))
+
+    def confirm(self, msg_hash, dest_hash):
+        # dest_hash picked up the propagated message msg_hash. Returns False
+        # for a receipt that matches nothing it was sent.
+        rows = db.query(SQL_RECEIPT_FIND, (msg_hash, dest_hash))
+        for kind, log_id in rows:
+            self.__track(kind, log_id, STATE_DELIVERED)
+        db.execute(SQL_RECEIPT_DONE, (msg_hash, dest_hash))
+        return len(rows) > 0
+
+    def __failed(self, outbox_id, reason, retry=True):
+        entry = self.__release(outbox_id)
+        if not entry:
+            return
+        if entry["paused"]:
+            RNS.log(f"Outbox item {outbox_id} paused while bulk traffic is held", RNS.LOG_DEBUG)
+            for member_id, log_id in entry["members"]:
+                db.execute(SQL_OUTBOX_RETRY, (STATE_QUEUED, entry["attempts"], 0, member_id))
+                self.__track(entry["kind"], log_id, STATE_QUEUED)
+            return
+        attempts = entry["attempts"]+1
+        if retry and attempts < self.MAX_ATTEMPTS:
+            backoff = min(self.BACKOFF_MAX, self.BACKOFF_BASE*2**(attempts-1))
+            next_attempt = time.time()+backoff*random.uniform(0.8, 1.2)
+            RNS.log(f"Outbox item {outbox_id} {reason}, retrying in {RNS.prettytime(backoff)}", RNS.LOG_DEBUG)
+            for member_id, log_id in entry["members"]:
+                db.execute(SQL_OUTBOX_RETRY, (STATE_QUEUED, attempts, next_attempt, member_id))
+                self.__track(entry["kind"], log_id, STATE_QUEUED)
+        else:
+            RNS.log(f"Outbox item {outbox_id} {reason}, giving up after {attempts} attempts", RNS.LOG_WARNING)
+            for member_id, log_id in entry["members"]:
+                db.execute(SQL_OUTBOX_RETRY, (STATE_FAILED, attempts, time.time(), member_id))
+                self.__track(entry["kind"], log_id, STATE_FAILED)
@@ -0,0 +1,112 @@
+import RNS
+import time
+import threading
+from concurrent.futures import Future
+
+class PathResolver():
+    # Resolves LXMF delivery destinations without blocking the caller.
+    # resolve() returns a Future that completes with an OUT destination once
+    # a path and identity are known, or with None when the deadline passes.
+    # Concurrent requests for the same hash share one Future, and resolved
+    # destinations are cached for CACHE_TTL seconds.
+    PATH_TIMEOUT  = 15
+    POLL_INTERVAL = 0.2
+    CACHE_TTL     = 60*10
+
+    def __init__(self, app_name="lxmf", aspects=("delivery",), cache_ttl=CACHE_TTL):
+        self.app_name = app_name
+        self.aspects = aspects
+        self.cache_ttl = cache_ttl
+        self.cache = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def __start(self):
+        if self.thread == None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.__poller, daemon=True)
+            self.thread.start()
+
+    def __build(self, pri_bytes):
+        identity = RNS.Identity.recall(pri_bytes)
+        if identity == None:
+            return None
+        return RNS.Destination(identity, RNS.Destination.OUT, RNS.Destination.SINGLE, self.app_name, *self.aspects)
+
+    def cached(self, hex_hash):
+        entry = self.cache.get(hex_hash)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        return None
+
+    def recall(self, hex_hash):
+        # An OUT destination from a known identity, whether or not there is
+        # a path. Enough for propagated delivery.
+        destination = self.cached(hex_hash)
+        if destination == None:
+            destination = self.__build(bytes.fromhex(hex_hash))
+        return destination
+
+    def invalidate(self, hex_hash):
+        with self.lock:
+            self.cache.pop(hex_hash, None)
+
+    def resolve(self, hex_hash, timeout=PATH_TIMEOUT):
+        with self.lock:
+            destination = self.cached(hex_hash)
+            if destination == None:
+                pending = self.inflight.get(hex_hash)
+                if pending:
+                    future, deadline = pending
+                    # A later caller willing to wait longer extends the deadline
+                    self.inflight[hex_hash] = (future, max(deadline, time.time()+timeout))
+                    return future
+
+                pri_bytes = bytes.fromhex(hex_hash)
+                if RNS.Transport.has_path(pri_bytes):
+                    destination = self.__build(pri_bytes)
+
+            if destination != None:
+                self.cache[hex_hash] = (time.time()+self.cache_ttl, destination)
+                future = Future()
+                future.set_result(destination)
+                return future
+
+            RNS.Transport.request_path(pri_bytes)
+            future = Future()
+            self.inflight[hex_hash] = (future, time.time()+timeout)
+            self.__start()
+            self.wakeup.set()
+            return future
+
+    def __poller(self):
+        while True:
+            self.wakeup.wait(self.POLL_INTERVAL)
+            self.wakeup.clear()
+
+            completed = []
+            with self.lock:
+                now = time.time()
+                for hex_hash, (future, deadline) in list(self.inflight.items()):
+                    pri_bytes = bytes.fromhex(hex_hash)
+                    destination = None
+                    if RNS.Transport.has_path(pri_bytes):
+                        destination = self.__build(pri_bytes)
+                    if destination != None:
+                        self.cache[hex_hash] = (now+self.cache_ttl, destination)
+                        completed.append((future, destination))
+                        del self.inflight[hex_hash]
+                    elif now > deadline:
+                        RNS.log(f"No path to {RNS.prettyhexrep(pri_bytes)} after waiting, giving up", RNS.LOG_DEBUG)
+                        completed.append((future, None))
+                        del self.inflight[hex_hash]
+
+                for hex_hash, (expires, _) in list(self.cache.items()):
+                    if expires < now: del self.cache[hex_hash]
+
+            # Futures run their callbacks inline, so complete them outside the lock
+            for future, destination in completed:
+                future.set_result(destination)
+
+resolver = PathResolver()
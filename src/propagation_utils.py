@@ -0,0 +1,113 @@
+import RNS
+import LXMF
+import time
+import random
+import threading
+
+def interface_bytes():
+    # Total (rx, tx) bytes over all interfaces, used to meter syncs
+    rx, tx = 0, 0
+    for interface in RNS.Transport.interfaces:
+        rx += getattr(interface, "rxb", 0)
+        tx += getattr(interface, "txb", 0)
+    return rx, tx
+
+class PropagationSync():
+    # Periodically downloads messages held for us by the outbound
+    # propagation node. A sync runs every interval, with JITTER, and as soon
+    # as sync_now() is called. Each sync is metered with the interface byte
+    # counters, which include any other traffic during the sync, so the
+    # figures are an upper bound.
+    SYNC_INTERVAL  = 60*10
+    SYNC_TIMEOUT   = 60*2
+    JITTER         = 0.1
+    POLL_INTERVAL  = 0.5
+    DONE_STATES    = (
+        LXMF.LXMRouter.PR_COMPLETE,
+        LXMF.LXMRouter.PR_NO_PATH,
+        LXMF.LXMRouter.PR_LINK_FAILED,
+        LXMF.LXMRouter.PR_TRANSFER_FAILED,
+        LXMF.LXMRouter.PR_NO_IDENTITY_RCVD,
+        LXMF.LXMRouter.PR_NO_ACCESS,
+        LXMF.LXMRouter.PR_FAILED
+    )
+
+    def __init__(self, interval=SYNC_INTERVAL):
+        self.router = None
+        self.identity = None
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.should_run = False
+        self.thread = None
+        self.syncs = 0
+        self.failures = 0
+        self.messages = 0
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.last_sync = None
+        self.last_result = None
+
+    def start(self, router, identity):
+        self.router = router
+        self.identity = identity
+        if not self.should_run:
+            self.should_run = True
+            self.thread = threading.Thread(target=self.__worker, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.should_run = False
+        self.wakeup.set()
+
+    def sync_now(self):
+        self.wakeup.set()
+
+    def sync(self):
+        # Returns the number of messages downloaded, None if the sync failed
+        if self.router.get_outbound_propagation_node() == None:
+            return None
+        rx_before, tx_before = interface_bytes()
+        self.router.request_messages_from_propagation_node(self.identity)
+
+        deadline = time.time()+self.SYNC_TIMEOUT
+        while self.router.propagation_transfer_state not in self.DONE_STATES and time.time() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+
+        rx_after, tx_after = interface_bytes()
+        self.syncs += 1
+        self.rx_bytes += rx_after-rx_before
+        self.tx_bytes += tx_after-tx_before
+        self.last_sync = time.time()
+
+        if self.router.propagation_transfer_state == LXMF.LXMRouter.PR_COMPLETE:
+            self.last_result = self.router.propagation_transfer_last_result or 0
+            self.messages += self.last_result
+            RNS.log(f"Propagation sync downloaded {self.last_result} messages, {rx_after-rx_before} bytes in", RNS.LOG_DEBUG)
+            return self.last_result
+        else:
+            self.failures += 1
+            self.last_result = None
+            RNS.log(f"Propagation sync failed in state {self.router.propagation_transfer_state}", RNS.LOG_DEBUG)
+            if self.router.propagation_transfer_state not in self.DONE_STATES:
+                self.router.cancel_propagation_node_requests()
+            return None
+
+    def __worker(self):
+        while self.should_run:
+            try:
+                self.sync()
+            except Exception as e:
+                self.failures += 1
+                RNS.log(f"Propagation sync error: {e}", RNS.LOG_ERROR)
+            self.wakeup.wait(self.interval*random.uniform(1-self.JITTER, 1+self.JITTER))
+            self.wakeup.clear()
+
+    def stats(self):
+        return {
+            "syncs": self.syncs,
+            "failures": self.failures,
+            "messages": self.messages,
+            "rx_bytes": self.rx_bytes,
+            "tx_bytes": self.tx_bytes,
+            "last_sync": self.last_sync
+        }
@@ -0,0 +1,60 @@
+import RNS
+import time
+
+from database_utils import db
+from transfer_utils import LEDGER_RECV
+
+SQL_TRANSFER_GET    = """
+    SELECT name, size, chunkSize, bitmap, path FROM transfers
+    WHERE direction = ? AND fileHash = ? AND peerHash = ?
+"""
+SQL_TRANSFER_SAVE   = """
+    INSERT INTO transfers (direction, fileHash, peerHash, name, size, chunkSize, bitmap, path, updatedAt)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (direction, fileHash, peerHash) DO UPDATE SET
+        name = excluded.name, size = excluded.size, chunkSize = excluded.chunkSize,
+        bitmap = excluded.bitmap, path = excluded.path, updatedAt = excluded.updatedAt
+"""
+SQL_TRANSFER_MARK   = """
+    UPDATE transfers SET bitmap = ?, updatedAt = ?
+    WHERE direction = ? AND fileHash = ? AND peerHash = ?
+"""
+SQL_TRANSFER_DROP   = "DELETE FROM transfers WHERE direction = ? AND fileHash = ? AND peerHash = ?"
+SQL_TRANSFER_STALE  = "SELECT direction, path FROM transfers WHERE updatedAt < ?"
+SQL_TRANSFER_EXPIRE = "DELETE FROM transfers WHERE updatedAt < ?"
+
+class TransferLedger():
+    # Chunk bitmaps of file transfers in the transfers table, the same
+    # interface as MemoryLedger. A row is written once per chunk, which
+    # at the chunk sizes used takes seconds to minutes to arrive.
+    def __init__(self, db=db):
+        self.db = db
+
+    def load(self, direction, file_hash, peer_hash):
+        rows = self.db.query(SQL_TRANSFER_GET, (direction, file_hash, peer_hash))
+        if not rows:
+            return None
+        name, size, chunk_size, bitmap, path = rows[0]
+        return {"name": name, "size": size, "chunk_size": chunk_size, "bitmap": bytearray(bitmap), "path": path}
+
+    def save(self, direction, file_hash, peer_hash, name, size, chunk_size, bitmap, path):
+        self.db.execute(SQL_TRANSFER_SAVE, (direction, file_hash, peer_hash, name, size, chunk_size, bytes(bitmap), path, time.time()))
+
+    def mark(self, direction, file_hash, peer_hash, bitmap):
+        self.db.execute(SQL_TRANSFER_MARK, (bytes(bitmap), time.time(), direction, file_hash, peer_hash))
+
+    def drop(self, direction, file_hash, peer_hash):
+        self.db.execute(SQL_TRANSFER_DROP, (direction, file_hash, peer_hash))
+
+    def expire(self, max_age):
+        # Forgets transfers untouched for max_age seconds and returns the
+        # partial files of the received ones for the caller to remove
+        cutoff = time.time()-max_age
+        with self.db.transaction() as conn:
+            stale = conn.execute(SQL_TRANSFER_STALE, (cutoff,)).fetchall()
+            conn.execute(SQL_TRANSFER_EXPIRE, (cutoff,))
+        if stale:
+            RNS.log(f"Expired {len(stale)} unfinished file transfers", RNS.LOG_DEBUG)
+        return [path for direction, path in stale if direction == LEDGER_RECV]
+
+transfer_ledger = TransferLedger()
@@ -1,11 +1,28 @@
+import io
 import os
 import RNS
 import sys
 import LXMF
+import threading
 import json
+import time
+import hashlib
 
 from LXMF import LXMessage as LXM
 from database_utils import *
+from contact_utils import contacts
+from announce_utils import AnnounceIngestor, AnnounceScheduler
+from path_utils import PathResolver, resolver
+from propagation_utils import PropagationSync
+from airtime_utils import *
+from outbox_utils import *
+from codec_utils import *
+from broadcast_utils import *
+from mayday_utils import *
+from envelope_utils import *
+from transfer_utils import *
+from blob_utils import BlobStore, blob_store
+from resume_utils import TransferLedger, transfer_ledger
 from voicemail_utils import *
 from globals import *
 
@@ -38,185 +55,328 @@ def rns_setup(configpath=None):
         "public_channel"
     )
     broadcast_destination.set_packet_callback(bpacket_callback)
+    mayday_receiver.own_hash = my_destination.hash
 
-    announce_handler = LCOMMAnnounceHandler(aspect_filter=None)
+    announce_ingestor.start()
+    announce_handler = LCOMMAnnounceHandler(aspect_filter="lxmf.delivery")
     RNS.Transport.register_announce_handler(announce_handler)
-    my_destination.announce(app_data=DISPLAY_NAME.encode("utf-8"))
+    announcer.register(ANNOUNCE_LXMF, my_destination, ANNOUNCE_INTERVAL, DISPLAY_NAME.encode("utf-8"))
+    announcer.start()
     router.register_delivery_callback(msg_callback)
+    file_receiver.start(identity, APP_NAME)
     
     update_contacts()
+    outbox.start(router, my_destination)
+    if PROPAGATION_NODE:
+        router.set_outbound_propagation_node(bytes.fromhex(PROPAGATION_NODE))
+        outbox.enable_propagation(PROPAGATION_AFTER_ATTEMPTS)
+        propagation_sync.start(router, identity)
     return my_destination, router, reticulum, broadcast_destination
 
-def announce_loop(my_destination):
-    while True:
-        time.sleep(ANNOUNCE_INTERVAL)
-        my_destination.announce()
-        RNS.log("Sent announce from "+RNS.prettyhexrep(my_destination.hash))
+announce_ingestor = AnnounceIngestor(contacts)
+announcer = AnnounceScheduler(density_source=lambda: announce_ingestor.seen, airtime=airtime)
+
+ANNOUNCE_LXMF      = "lxmf"
+ANNOUNCE_TELEPHONY = "telephony"
 
 class LCOMMAnnounceHandler():
-    def __init__(self, aspect_filter=None):
+    # RNS only calls received_announce for destinations matching
+    # aspect_filter, so other apps' announces never reach the ingestor
+    def __init__(self, aspect_filter="lxmf.delivery"):
         self.aspect_filter = aspect_filter
     
     def received_announce(self, destination_hash, announced_identity, app_data):
-        global contacts
-        hex_hash = destination_hash.hex().lower()
-        exs = False
-        try:
-            name = app_data.decode("utf-8")
-        except Exception as e:
-            RNS.log(f"[WARN] Failed to decode announce name: {e}")
-            name = "Unknown"
+        announce_ingestor.ingest(destination_hash, announced_identity, app_data)
 
-        try:
-            identity_hash = announced_identity.hash.hex().lower()
-            add_identity(identity_hash, hex_hash, name, name)
-        except:
-            exs = True
-
-        update_contacts()
-
-def announce_myself(my_destination, router):
-    my_destination.announce(app_data=DISPLAY_NAME.encode("utf-8"))
-    RNS.log("Sent announce from "+RNS.prettyhexrep(my_destination.hash))
-
-def resolve_destination(hex_hash):
-    pri_bytes = bytes.fromhex(hex_hash)
-    if not RNS.Transport.has_path(pri_bytes):
-        RNS.Transport.request_path(pri_bytes)
-        while not RNS.Transport.has_path(pri_bytes):
-            time.sleep(0.2)
-    recipient = RNS.Identity.recall(pri_bytes)
-    
-    return RNS.Destination(recipient, RNS.Destination.OUT, RNS.Destination.SINGLE, "lxmf", "delivery")
+def announce_myself(my_destination, router, timeout=None):
+    # Returns False if the airtime budget did not allow it within timeout
+    return announcer.announce_now(ANNOUNCE_LXMF, timeout=timeout)
+
+SEND_SENT   = "sent"
+SEND_QUEUED = "unreachable, queued"
+SEND_FAILED = "failed"
+
+def resolve_destination(hex_hash, timeout=PathResolver.PATH_TIMEOUT):
+    # Blocks for at most timeout seconds, returns None if unreachable
+    return resolver.resolve(hex_hash, timeout=timeout).result()
+
+def send_status(dest_hash):
+    if RNS.Transport.has_path(bytes.fromhex(dest_hash)):
+        return SEND_SENT
+    else:
+        return SEND_QUEUED
 
 
 def broadcast_msg(broadcast_destination, text):
-    data = text.encode("utf-8")
-    packet = RNS.Packet(broadcast_destination, data)
-    packet.send()
+    # Fragments are paced by the airtime scheduler off the UI thread
+    fragments = fragment_broadcast(text, compress=COMPRESS_BROADCASTS)
+    def send_fragments():
+        for data in fragments:
+            airtime.admit(TRAFFIC_TEXT, len(data))
+            packet = RNS.Packet(broadcast_destination, data)
+            packet.send()
+    threading.Thread(target=send_fragments, daemon=True).start()
     log_msg_send("None", text)
 
+broadcast_reassembler = BroadcastReassembler()
+broadcast_filter = RotatingBloomFilter()
+# Legacy text has no id, so its repeats are only recognised for a few
+# seconds, long enough for copies arriving over other paths
+LEGACY_REPEAT_WINDOW = 5
+legacy_filter = RotatingBloomFilter(window=LEGACY_REPEAT_WINDOW, capacity=256)
+
 def bpacket_callback(data, packet):
-    text = data.decode("utf-8")
-    log_msg_recv("None", text)
+    # Framed and SOS packets start with a NUL byte and carry a random
+    # message id or a sender and repeat counter, so identical bytes are a
+    # repeat arriving over another path. Legacy text has no id: it is keyed
+    # on the packet hash with a short window, so a distress text sent again,
+    # or the same "ok" from two senders a few seconds apart, still shows.
+    if data.startswith(b"\x00"):
+        if broadcast_filter.check_and_add(data):
+            return
+    elif legacy_filter.check_and_add(packet.packet_hash):
+        return
+    if data.startswith(SOS_MAGIC):
+        mayday_receiver.handle(data)
+        return
+    try:
+        text = broadcast_reassembler.feed(data)
+    except Exception as e:
+        RNS.log(f"Could not decode broadcast: {e}", RNS.LOG_WARNING)
+        return
+    if text != None:
+        log_msg_recv("None", text)
+
+def raise_mayday(broadcast_destination, my_destination, status=SOS_GENERAL, position=None):
+    if mayday.active:
+        mayday.update(status, position)
+    else:
+        mayday.start(broadcast_destination, my_destination.hash, status, position)
+
+def status_text():
+    # Bottom line of the menus: airtime, then any transfers in progress
+    parts = [airtime.status_text, file_sender.status_text, file_receiver.status_text]
+    return " | ".join(part for part in parts if part)
+
+def broadcast_stats():
+    stats = broadcast_reassembler.stats()
+    stats["suppressed"] = broadcast_filter.suppressed+legacy_filter.suppressed
+    return stats
 
 def update_contacts():
-    global contacts
-    db_entries = get_all_id()
-    existing_hashes = {c.get("identity_hash") for c in contacts}
-
-    for row in db_entries:
-        rns_hash = row["rnsHash"]
-        if rns_hash not in existing_hashes:
-            contacts.append({
-                "name": row["name"],
-                "identity_hash": row["rnsHash"],
-                "delivery_hash": row["lxmfHash"],
-                "hash": row["lxmfHash"]
-            })
+    contacts.load()
 
 # Receiving
 ######################################################################################
 
+def message_text(message):
+    codec = message.fields.get(FIELD_TEXT_CODEC, TEXT_CODEC_NONE)
+    if codec == TEXT_CODEC_NONE:
+        return str(message.content_as_string())
+    else:
+        return decompress_text(message.content, codec)
+
 def msg_callback(message):
     global router, my_destination
     hex_hash = message.source_hash.hex().lower()
-    text = str(message.content_as_string())
-
-    if message.title_as_string() == "Message":
-        log_msg_recv(hex_hash, text)
-    elif message.title_as_string() == "Voicemail":
-        decoded_path = save_and_decode_audio(message.fields)
-        log_vm_recv(hex_hash, decoded_path)
-    elif message.title_as_string() == "File":
+    caps = message.fields.get(FIELD_CAPS)
+    if caps != None:
+        contacts.set_caps(hex_hash, caps)
+    acknowledge(hex_hash, message)
+    dispatcher.dispatch(hex_hash, message)
+
+def acknowledge(hex_hash, message):
+    # Sends a receipt for a message picked up from a propagation node, the
+    # sender has no other way to learn it arrived
+    if getattr(message, "method", None) != LXMF.LXMessage.PROPAGATED:
+        return
+    if not peer_supports_receipts(contacts.caps_for(hex_hash)) or message_type(message, FIELD_TYPE) == MSG_TYPE_RECEIPT:
+        return
+    outbox.enqueue(hex_hash, KIND_RECEIPT, message.hash.hex(), PRIORITY_TEXT, coalesce=False)
+
+def handle_text(hex_hash, message):
+    try:
+        text = message_text(message)
+    except Exception as e:
+        RNS.log(f"Dropping undecodable text from {hex_hash}: {e}", RNS.LOG_WARNING)
+        return
+    log_msg_recv(hex_hash, text)
+
+def handle_bundle(hex_hash, message):
+    # Each entry keeps the time it was typed, never later than the bundle
+    for entry in message.fields.get(FIELD_BUNDLE) or []:
         try:
-            attachments = message.fields.get(LXMF.FIELD_FILE_ATTACHMENTS)
-            if attachments and isinstance(attachments, list):
-                save_dir = "../str/files/received"
-                os.makedirs(save_dir, exist_ok=True)
-
-                for attachment in attachments:
-                    if len(attachment) == 2:
-                        filename, file_bytes = attachment
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        safe_name = f"{timestamp}_{filename}"
-                        file_path = os.path.join(save_dir, safe_name)
-
-                        with open(file_path, "wb") as f:
-                            f.write(file_bytes)
-
-                        log_file_recv(hex_hash, file_path)
-                    else:
-                        pass
-            else:
-                pass
+            at, codec, payload = entry
+            at = min(at, message.timestamp) if at else message.timestamp
+            log_msg_recv(hex_hash, decompress_text(payload, codec), at=at)
         except Exception as e:
-            print(f"[!] Error saving received file: {e}")
-    else:
-        pass
+            RNS.log(f"Dropping malformed bundle entry from {hex_hash}: {e}", RNS.LOG_WARNING)
+
+def handle_voicemail(hex_hash, message):
+    decoded_path = save_and_decode_audio(message.fields)
+    blob_hash = None
+    if decoded_path:
+        decoded_path, blob_hash = blob_store.put_file(decoded_path, move=True)
+    log_vm_recv(hex_hash, decoded_path, blob_hash)
+
+def handle_receipt(hex_hash, message):
+    msg_hash = message.fields.get(FIELD_RECEIPT)
+    if isinstance(msg_hash, bytes) and outbox.confirm(msg_hash.hex(), hex_hash):
+        RNS.log(f"{hex_hash} picked up {msg_hash.hex()} from the propagation node", RNS.LOG_DEBUG)
+
+def handle_file(hex_hash, message):
+    # Attachments inside an LXMF message, from peers that cannot stream.
+    # Each is decompressed as it is written, like a streamed file, and
+    # checked against the hash in FIELD_FILE_HASH when the sender included
+    # one. The hash is of the file before compression.
+    attachments = message.fields.get(LXMF.FIELD_FILE_ATTACHMENTS)
+    if not isinstance(attachments, list):
+        return
+    hashes = message.fields.get(FIELD_FILE_HASH) or []
+    codecs = message.fields.get(FIELD_FILE_CODEC) or []
+    for i, attachment in enumerate(attachments):
+        try:
+            filename, file_bytes = attachment
+            expected = hashes[i] if i < len(hashes) else None
+            codec = codecs[i] if i < len(codecs) else FILE_CODEC_NONE
+            source = DecompressReader(io.BytesIO(file_bytes), codec, max_size=LEGACY_FILE_MAX)
+            try:
+                file_path, blob_hash = blob_store.put(source, expected, os.path.splitext(filename)[1])
+            finally:
+                source.close()
+            log_file_recv(hex_hash, file_path, blob_hash, os.path.basename(filename))
+        except Exception as e:
+            RNS.log(f"Could not save file from {hex_hash}: {e}", RNS.LOG_ERROR)
+
+dispatcher = MessageDispatcher(FIELD_TYPE)
+dispatcher.register(MSG_TYPE_TEXT, handle_text)
+dispatcher.register(MSG_TYPE_VOICEMAIL, handle_voicemail)
+dispatcher.register(MSG_TYPE_FILE, handle_file)
+dispatcher.register(MSG_TYPE_BUNDLE, handle_bundle)
+dispatcher.register(MSG_TYPE_RECEIPT, handle_receipt)
 
 # Sending
 ######################################################################################
 
-def send_msg(router, destination, source, content):
+def advertise_caps(msg):
+    msg.fields[FIELD_CAPS] = LOCAL_CAPS
+    return msg
+
+def envelope(destination, source, msg_type, content="", legacy_content=""):
+    # Peers that read FIELD_TYPE get no title and only the content they
+    # need. Everyone else still gets the title string they dispatch on.
+    if peer_supports_envelope(contacts.caps_for(destination.hash.hex())):
+        title = ""
+    else:
+        title = LEGACY_TITLES.get(msg_type, "")
+        content = content or legacy_content
     msg = LXM(
         destination,
         source,
         content,
-        "Message", # random title for now
+        title,
         desired_method=LXMF.LXMessage.DIRECT,
         include_ticket=True
     )
+    msg.fields[FIELD_TYPE] = msg_type
+    return advertise_caps(msg)
+
+def build_msg(destination, source, content):
+    # Text is only compressed for peers that told us they can decode it
+    codec, payload = TEXT_CODEC_NONE, content
+    if peer_supports(contacts.caps_for(destination.hash.hex()), TEXT_CODEC_DICT_V1):
+        codec, packed = compress_text(content)
+        if codec != TEXT_CODEC_NONE:
+            payload = packed
+
+    msg = envelope(destination, source, MSG_TYPE_TEXT, payload)
+    if codec != TEXT_CODEC_NONE:
+        msg.fields[FIELD_TEXT_CODEC] = codec
+    return msg
+
+def build_bundle(destination, source, entries):
+    # entries are (enqueued_at, text) in the order they were queued
+    compress = peer_supports(contacts.caps_for(destination.hash.hex()), TEXT_CODEC_DICT_V1)
+    bundle = []
+    for at, text in entries:
+        codec, payload = compress_text(text) if compress else (TEXT_CODEC_NONE, text.encode("utf-8"))
+        bundle.append([at or time.time(), codec, payload])
+    msg = envelope(destination, source, MSG_TYPE_BUNDLE)
+    msg.fields[FIELD_BUNDLE] = bundle
+    return msg
 
-    router.handle_outbound(msg)
+def build_receipt(destination, source, msg_hash):
+    msg = envelope(destination, source, MSG_TYPE_RECEIPT)
+    msg.fields[FIELD_RECEIPT] = bytes.fromhex(msg_hash)
+    return msg
 
-def send_vm(wavpath, my_destination, dest_hash, router):
+def build_vm(destination, source, wavpath):
     global DISPLAY_NAME
-    try:
-        destination = resolve_destination(dest_hash)
-        
-        mode_code, audio_bytes = convert_audio_to_bytes(wavpath) 
-
-        msg = LXM(
-            destination,
-            my_destination,
-            f"Voicemail from {DISPLAY_NAME}", # content
-            "Voicemail", # title
-            desired_method=LXMF.LXMessage.DIRECT,
-            include_ticket=True
-        )
-        msg.fields[7] = [mode_code, audio_bytes]
-        if msg:
-            router.handle_outbound(msg)
-        else:
-            raise Exception("Failed to build LXMF message")
-    except Exception as e:
-        print(f"Error: {e}")
-        pass
+    mode_code, audio_bytes = convert_audio_to_bytes(wavpath) 
+    if audio_bytes == None:
+        raise Exception(f"Could not encode {wavpath}")
+
+    msg = envelope(destination, source, MSG_TYPE_VOICEMAIL, legacy_content=f"Voicemail from {DISPLAY_NAME}")
+    msg.fields[7] = [mode_code, audio_bytes]
+    return msg
 
-def send_file(filepath, my_destination, dest_hash, router):
+# Peers without CAP_FILE_STREAM, and files sent through a propagation node,
+# get the file inside the LXMF message, which is held in memory on both
+# ends. It is compressed when the peer can decode one of our file codecs
+# and the content is worth it. Streamed transfers pick and apply the codec
+# the same way in FileTransfer.
+LEGACY_FILE_MAX = 1024*1024
+
+def build_file(destination, source, payload):
     global DISPLAY_NAME
-    try:
-        destination = resolve_destination(dest_hash)
-        filename = os.path.basename(filepath)
-        
-        with open(filepath, "rb") as f:
-            file_bytes = f.read()
-        
-        msg = LXM(
-            destination,
-            my_destination,
-            f"{DISPLAY_NAME}_{filename}", # content
-            "File", # title
-            desired_method=LXMF.LXMessage.DIRECT,
-            include_ticket=True
-        )
-        msg.fields[LXMF.FIELD_FILE_ATTACHMENTS] = [[filename, file_bytes]] 
-        
-        if msg:
-            router.handle_outbound(msg)
-        else:
-            raise Exception("Failed to build LXMF message")
-    except Exception as e:
-        print(f"Error: {e}")
-        pass
+    filepath, filename = parse_file_payload(payload)
+    if os.path.getsize(filepath) > LEGACY_FILE_MAX:
+        raise Exception(f"{filename} is too large for a peer without streamed transfers")
+
+    with open(filepath, "rb") as f:
+        file_bytes = f.read()
+    codec, payload = compress_file(filename, file_bytes, contacts.caps_for(destination.hash.hex()))
+    
+    msg = envelope(destination, source, MSG_TYPE_FILE, legacy_content=f"{DISPLAY_NAME}_{filename}")
+    msg.fields[LXMF.FIELD_FILE_ATTACHMENTS] = [[filename, payload]] 
+    msg.fields[FIELD_FILE_HASH] = [hashlib.sha256(file_bytes).digest()]
+    if codec != FILE_CODEC_NONE:
+        msg.fields[FIELD_FILE_CODEC] = [codec]
+    return msg
+
+outbox = Outbox(resolver, airtime)
+outbox.register_builder(KIND_MESSAGE, build_msg)
+outbox.register_builder(KIND_VOICEMAIL, build_vm)
+outbox.register_builder(KIND_FILE, build_file)
+outbox.register_builder(KIND_RECEIPT, build_receipt)
+outbox.register_bundler(KIND_MESSAGE, build_bundle, lambda dest_hash: peer_supports_bundles(contacts.caps_for(dest_hash)))
+file_sender = FileSender(APP_NAME, caps_for=contacts.caps_for)
+file_receiver = FileReceiver(on_received=log_file_recv, store=blob_store, ledger=transfer_ledger, find_base=get_file_versions,
+                             is_known=lambda sender_hash: contacts.get(sender_hash) != None)
+
+def stream_file(destination, source, payload, delivered, failed, progress=None):
+    filepath, filename = parse_file_payload(payload)
+    return file_sender.send(destination, source, filepath, delivered, failed, progress, name=filename)
+
+outbox.register_streamer(KIND_FILE, stream_file, lambda dest_hash: peer_supports_file_stream(contacts.caps_for(dest_hash)))
+
+mayday = MaydayBeacon(outbox, airtime)
+propagation_sync = PropagationSync(PROPAGATION_SYNC_INTERVAL)
+mayday_receiver = MaydayReceiver()
+
+def send_msg(router, destination, source, content):
+    router.handle_outbound(build_msg(destination, source, content))
+
+def send_msg_to(dest_hash, content, log_id=None, priority=PRIORITY_TEXT, coalesce=True):
+    outbox.enqueue(dest_hash, KIND_MESSAGE, content, priority, log_id, coalesce)
+    return send_status(dest_hash)
+
+def send_vm(wavpath, dest_hash, log_id=None):
+    outbox.enqueue(dest_hash, KIND_VOICEMAIL, wavpath, PRIORITY_VOICEMAIL, log_id)
+    return send_status(dest_hash)
+
+def send_file(filepath, dest_hash, log_id=None, name=None):
+    # filepath should be the blob store copy, which the user cannot move or
+    # edit under a queued or resuming transfer. name is what the peer sees.
+    outbox.enqueue(dest_hash, KIND_FILE, file_payload(filepath, name), PRIORITY_FILE, log_id)
+    return send_status(dest_hash)
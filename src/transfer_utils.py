@@ -0,0 +1,852 @@
+import RNS
+import io
+import os
+import glob
+import time
+import shutil
+import struct
+import hashlib
+import tempfile
+import threading
+
+from datetime import datetime
+from delta_utils import signature, make_delta, DeltaReader
+from codec_utils import LOCAL_CAPS, FILE_CODEC_NONE, file_codecs, choose_file_codec, read_probe, compress_path, DecompressReader
+
+# Files go to peers over a Link to APP_NAME.file. Before any data moves
+# the sender identifies itself and offers the file's name, size and
+# SHA-256 with a link request. The receiver only accepts resources on
+# links with an accepted offer, and answers OFFER_HAVE to a known contact
+# when it already stores a file with that hash, in which case nothing is
+# sent. Anyone else sends the file in full, so a peer cannot learn what the
+# store holds by offering hashes.
+#
+# The file travels in chunks, each its own RNS Resource headed by the file
+# hash and chunk index. The offer proposes a chunk size that suits the
+# link, the receiver answers with the chunk size and the bitmap of chunks
+# it already holds from an earlier attempt, so after a dropped link or a
+# restart only the missing chunks are sent. The receiver keeps the bitmap
+# in a ledger; the sender keeps nothing, it learns the bitmap from the
+# answer to each offer. Once every chunk is in, a last request has the
+# receiver verify the whole file.
+#
+# When the receiver holds an earlier version of the file, the latest one
+# stored under the same name, it names that version's hash in its answer
+# to a known contact.
+# The sender then fetches the version's signature, and if the delta is
+# enough smaller offers and sends that instead. The receiver rebuilds the
+# file from its copy and the delta.
+#
+# Otherwise, when the peer's caps name a file codec and the content is
+# worth it, the sender offers the file compressed the same way LXMF
+# attachments are, and the receiver unpacks it on completion. A receiver
+# that declines the compressed form gets the file as it is.
+FILE_ASPECT    = "file"
+OFFER_PATH     = "/offer"
+SIGNATURE_PATH = "/signature"
+COMPLETE_PATH  = "/complete"
+CHUNK_SIZE     = 1024*1024
+RECEIVE_DIR    = "../str/files/received"
+PARTIAL_SUFFIX = ".part"
+RESUME_SUFFIX  = ".resume"
+
+# Offer responses. Builds before OFFER_HAVE answered True and False, builds
+# before chunked transfers answer a bare code and take the file whole.
+OFFER_DECLINED = 0x00
+OFFER_ACCEPTED = 0x01
+OFFER_HAVE     = 0x02
+
+# Chunks: hash of the file or delta (32) | chunk index (4) | data
+CHUNK_HEADER   = struct.Struct("!32sI")
+MIN_CHUNK      = 4*1024
+MAX_CHUNK      = 512*1024
+CHUNK_SECONDS  = 60
+DEFAULT_RATE   = 1200
+
+DELTA_MAX      = 4*1024*1024
+DELTA_RATIO    = 0.8
+
+LEDGER_RECV    = "recv"
+
+def file_digest(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+def unique_path(directory, name):
+    base, ext = os.path.splitext(name)
+    path, n = os.path.join(directory, name), 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{base}_{n}{ext}")
+        n += 1
+    return path
+
+def write_temp(source, directory, expected_hash=None, chunk_size=CHUNK_SIZE):
+    # Streams the file object source into a hidden temp file in directory
+    # while hashing it. Returns (temp_path, digest); the temp file is gone
+    # if the digest does not match expected_hash.
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=PARTIAL_SUFFIX)
+    try:
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: source.read(chunk_size), b""):
+                digest.update(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if expected_hash != None and digest.digest() != expected_hash:
+            raise TransferError("hash mismatch")
+    except BaseException:
+        discard(temp_path)
+        raise
+    return temp_path, digest.digest()
+
+def discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def sync_dir(directory):
+    # Makes a rename durable, not supported everywhere
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+def save_atomically(source, save_dir, name, expected_hash=None, chunk_size=CHUNK_SIZE):
+    # The file is only renamed into place, under a name that does not
+    # clobber anything, once its SHA-256 matches
+    temp_path, _ = write_temp(source, save_dir, expected_hash, chunk_size)
+    try:
+        path = unique_path(save_dir, os.path.basename(name) or "file")
+        os.replace(temp_path, path)
+    except BaseException:
+        discard(temp_path)
+        raise
+    sync_dir(save_dir)
+    return path
+
+def remove_partials(save_dir):
+    # Temp files left behind by a crash mid-write. Resumable partials have
+    # their own suffix and are left to the ledger.
+    for path in glob.glob(os.path.join(save_dir, f".*{PARTIAL_SUFFIX}")):
+        discard(path)
+
+def file_destination(identity, app_name, direction=RNS.Destination.OUT):
+    return RNS.Destination(identity, direction, RNS.Destination.SINGLE, app_name, FILE_ASPECT)
+
+def chunk_count(size, chunk_size):
+    return max(1, -(-size//chunk_size))
+
+def chunk_length(size, chunk_size, index):
+    return max(0, min(chunk_size, size-index*chunk_size))
+
+def new_bitmap(chunks):
+    return bytearray(-(-chunks//8))
+
+def bitmap_has(bitmap, index):
+    return bool(bitmap[index//8] & (1 << (index%8)))
+
+def bitmap_set(bitmap, index):
+    bitmap[index//8] |= 1 << (index%8)
+
+def missing_chunks(bitmap, chunks):
+    return [index for index in range(chunks) if not bitmap_has(bitmap, index)]
+
+def link_chunk_size(link):
+    # About CHUNK_SECONDS of transfer at the rate seen on the link, so a
+    # drop costs at most that much. Rates are in bits per second.
+    rate = None
+    for getter in ("get_expected_rate", "get_establishment_rate"):
+        try:
+            rate = getattr(link, getter)()
+        except Exception:
+            rate = None
+        if rate:
+            break
+    size = int((rate or DEFAULT_RATE)/8*CHUNK_SECONDS)
+    return max(MIN_CHUNK, min(MAX_CHUNK, size//1024*1024))
+
+class TransferError(Exception):
+    pass
+
+class MemoryLedger():
+    # Chunk bitmaps for the life of the process. TransferLedger in
+    # resume_utils keeps them in the database across restarts.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def load(self, direction, file_hash, peer_hash):
+        with self.lock:
+            entry = self.entries.get((direction, file_hash, peer_hash))
+            return dict(entry, bitmap=bytearray(entry["bitmap"])) if entry else None
+
+    def save(self, direction, file_hash, peer_hash, name, size, chunk_size, bitmap, path):
+        with self.lock:
+            self.entries[(direction, file_hash, peer_hash)] = {
+                "name": name, "size": size, "chunk_size": chunk_size, "bitmap": bytes(bitmap), "path": path
+            }
+
+    def mark(self, direction, file_hash, peer_hash, bitmap):
+        with self.lock:
+            entry = self.entries.get((direction, file_hash, peer_hash))
+            if entry:
+                entry["bitmap"] = bytes(bitmap)
+
+    def drop(self, direction, file_hash, peer_hash):
+        with self.lock:
+            self.entries.pop((direction, file_hash, peer_hash), None)
+
+    def expire(self, max_age):
+        return []
+
+class FileTransfer():
+    # One outgoing file. delivered() is called once the receiver has
+    # verified the whole file, failed(reason) on any error. Either is
+    # called exactly once, from an RNS or transfer thread. Chunks the
+    # receiver took stay taken, so a failed transfer is simply started
+    # again.
+    STATE_PREPARING = "preparing"
+    STATE_LINKING   = "linking"
+    STATE_OFFERING  = "offering"
+    STATE_SENDING   = "sending"
+    STATE_COMPLETE  = "complete"
+    STATE_FAILED    = "failed"
+
+    PATH_TIMEOUT      = 30
+    LINK_TIMEOUT      = 30
+    OFFER_TIMEOUT     = 30
+    SIGNATURE_TIMEOUT = 120
+    COMPLETE_TIMEOUT  = 120
+    POLL_INTERVAL    = 0.2
+
+    def __init__(self, path, destination, identity, app_name, delivered, failed, progress=None, caps=0, name=None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.destination = destination
+        self.identity = identity
+        self.app_name = app_name
+        self.delivered = delivered
+        self.failed = failed
+        self.on_progress = progress
+        self.caps = caps
+        self.lock = threading.Lock()
+        self.state = self.STATE_PREPARING
+        self.size = None
+        self.hash = None
+        self.progress = 0.0
+        self.started = time.time()
+        self.link = None
+        self.resource = None
+        self.file = None
+        self.payload = path
+        self.payload_size = None
+        self.payload_hash = None
+        self.delta_path = None
+        self.packed_path = None
+        self.chunks = None
+        self.bitmap = None
+        self.resumed = 0
+        self.chunks_sent = 0
+        self.skipped = False
+        self.done = False
+
+    def start(self):
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    def cancel(self, reason="cancelled"):
+        resource = self.resource
+        if resource != None:
+            try:
+                resource.cancel()
+            except Exception as e:
+                RNS.log(f"Could not cancel resource for {self.name}: {e}", RNS.LOG_DEBUG)
+        self.__finish(False, reason)
+
+    def __run(self):
+        try:
+            self.size = os.path.getsize(self.path)
+            self.hash = file_digest(self.path)
+            self.payload_size, self.payload_hash = self.size, self.hash
+
+            destination = file_destination(self.destination.identity, self.app_name)
+            if not RNS.Transport.has_path(destination.hash):
+                RNS.Transport.request_path(destination.hash)
+                deadline = time.time()+self.PATH_TIMEOUT
+                while not RNS.Transport.has_path(destination.hash):
+                    if time.time() > deadline:
+                        raise TransferError("no path to peer")
+                    time.sleep(self.POLL_INTERVAL)
+
+            self.state = self.STATE_LINKING
+            established = threading.Event()
+            self.link = RNS.Link(destination, established_callback=lambda link: established.set(),
+                                 closed_callback=self.__link_closed)
+            if not established.wait(self.LINK_TIMEOUT):
+                raise TransferError("link not established")
+            if self.done:
+                return
+            self.link.identify(self.identity)
+
+            self.state = self.STATE_OFFERING
+            offer = {"name": self.name, "size": self.size, "hash": self.hash, "chunk": link_chunk_size(self.link), "delta": True}
+            status, chunk_size, have, base = self.__offer(offer)
+            fresh = status == OFFER_ACCEPTED and chunk_size != None and not any(have)
+            delta = None
+            if fresh and base and self.size <= DELTA_MAX:
+                delta = self.__delta(base)
+                if delta:
+                    status, chunk_size, have, _ = self.__offer(dict(offer, base=base, **delta))
+            if fresh and not delta:
+                packed = self.__pack()
+                if packed:
+                    answer = self.__offer(dict(offer, **packed))
+                    if answer[0] == OFFER_ACCEPTED:
+                        status, chunk_size, have, _ = answer
+                    else:
+                        self.payload, self.payload_size, self.payload_hash = self.path, self.size, self.hash
+            if status == OFFER_HAVE:
+                self.skipped = True
+                self.__finish(True)
+                return
+            if status != OFFER_ACCEPTED:
+                raise TransferError("offer declined")
+            if self.done:
+                return
+
+            self.state = self.STATE_SENDING
+            if chunk_size == None:
+                # Receivers without chunked transfers take the file whole
+                self.file = open(self.path, "rb")
+                self.resource = RNS.Resource(self.file, self.link, callback=self.__concluded, progress_callback=self.__progress)
+            else:
+                self.__send_chunks(chunk_size, bytearray(have))
+        except Exception as e:
+            self.__finish(False, str(e))
+
+    def __offer(self, offer):
+        # (status, chunk size, bitmap, base hash), the last three None
+        # when the receiver does not know them
+        response = self.__request(OFFER_PATH, offer, self.OFFER_TIMEOUT)
+        if not isinstance(response, (list, tuple)):
+            response = [response]
+        return (list(response)+[None]*4)[:4]
+
+    def __delta(self, base):
+        # Returns the delta's offer fields if it is worth sending instead
+        # of the file
+        sig = self.__request(SIGNATURE_PATH, base, self.SIGNATURE_TIMEOUT)
+        if not sig:
+            return None
+        with open(self.path, "rb") as f:
+            data = f.read()
+        fd, self.delta_path = tempfile.mkstemp(prefix=".lrecomm-", suffix=".delta")
+        with os.fdopen(fd, "wb") as f:
+            delta_size = make_delta(data, sig, base, f)
+        if delta_size >= self.size*DELTA_RATIO:
+            RNS.log(f"Delta for {self.name} saves too little, sending it whole", RNS.LOG_DEBUG)
+            return None
+        self.payload, self.payload_size, self.payload_hash = self.delta_path, delta_size, file_digest(self.delta_path)
+        RNS.log(f"Sending {self.name} as a {delta_size} byte delta against {base.hex()}", RNS.LOG_DEBUG)
+        return {"delta_size": delta_size, "delta_hash": self.payload_hash}
+
+    def __pack(self):
+        # Returns the compressed file's offer fields if the peer can decode
+        # it and it comes out smaller
+        codec = choose_file_codec(self.name, read_probe(self.path), self.caps)
+        if codec == FILE_CODEC_NONE:
+            return None
+        fd, self.packed_path = tempfile.mkstemp(prefix=".lrecomm-", suffix=".packed")
+        with os.fdopen(fd, "wb") as f:
+            packed_size = compress_path(self.path, f, codec)
+        if packed_size >= self.size:
+            return None
+        self.payload, self.payload_size, self.payload_hash = self.packed_path, packed_size, file_digest(self.packed_path)
+        RNS.log(f"Sending {self.name} compressed to {packed_size} of {self.size} bytes", RNS.LOG_DEBUG)
+        return {"codec": codec, "packed_size": packed_size, "packed_hash": self.payload_hash}
+
+    def __request(self, path, data, timeout):
+        answered = threading.Event()
+        result = {}
+        def response(receipt):
+            result["response"] = receipt.response
+            answered.set()
+        def failed(receipt):
+            answered.set()
+        self.link.request(path, data, response_callback=response, failed_callback=failed, timeout=timeout)
+        answered.wait(timeout+1)
+        return result.get("response")
+
+    def __send_chunks(self, chunk_size, have):
+        self.chunks = chunk_count(self.payload_size, chunk_size)
+        if len(have) != len(new_bitmap(self.chunks)):
+            raise TransferError("malformed chunk bitmap")
+        self.bitmap = have
+        missing = missing_chunks(self.bitmap, self.chunks)
+        self.resumed = self.chunks-len(missing)
+        if self.resumed:
+            RNS.log(f"Resuming {self.name}, peer has {self.resumed} of {self.chunks} chunks", RNS.LOG_DEBUG)
+
+        self.file = open(self.payload, "rb")
+        for index in missing:
+            self.file.seek(index*chunk_size)
+            data = CHUNK_HEADER.pack(self.payload_hash, index)+self.file.read(chunk_size)
+            concluded = threading.Event()
+            self.resource = RNS.Resource(data, self.link, callback=lambda resource: concluded.set(),
+                                         progress_callback=self.__progress)
+            while not concluded.wait(self.POLL_INTERVAL):
+                if self.done:
+                    return
+            if self.resource.status != RNS.Resource.COMPLETE:
+                raise TransferError(f"chunk {index} failed")
+            bitmap_set(self.bitmap, index)
+            self.chunks_sent += 1
+            self.__progress()
+
+        verified = self.__request(COMPLETE_PATH, self.payload_hash, self.COMPLETE_TIMEOUT)
+        if verified == None:
+            raise TransferError("no answer to completion")
+        if verified != True:
+            raise TransferError("receiver could not verify the file")
+        self.progress = 1.0
+        self.__finish(True)
+
+    def __progress(self, resource=None):
+        if self.chunks:
+            done = self.chunks-len(missing_chunks(self.bitmap, self.chunks))
+            partial = resource.get_progress() if resource != None else 0
+            self.progress = min(1.0, (done+partial)/self.chunks)
+        elif resource != None:
+            self.progress = resource.get_progress()
+        if self.on_progress:
+            self.on_progress()
+
+    def __concluded(self, resource):
+        if resource.status == RNS.Resource.COMPLETE:
+            self.progress = 1.0
+            self.__finish(True)
+        else:
+            self.__finish(False, "transfer failed")
+
+    def __link_closed(self, link):
+        self.__finish(False, "link closed")
+
+    def __finish(self, ok, reason=None):
+        with self.lock:
+            if self.done:
+                return
+            self.done = True
+            self.state = self.STATE_COMPLETE if ok else self.STATE_FAILED
+        if self.file:
+            self.file.close()
+        if self.delta_path:
+            discard(self.delta_path)
+        if self.packed_path:
+            discard(self.packed_path)
+        if self.link and self.link.status != RNS.Link.CLOSED:
+            self.link.teardown()
+        if ok and self.skipped:
+            RNS.log(f"Peer already has {self.name}, nothing sent", RNS.LOG_DEBUG)
+            self.delivered()
+        elif ok:
+            RNS.log(f"Sent {self.name}, {self.payload_size} of {self.size} bytes in {RNS.prettytime(time.time()-self.started)}", RNS.LOG_DEBUG)
+            self.delivered()
+        else:
+            RNS.log(f"Sending {self.name} failed: {reason}", RNS.LOG_DEBUG)
+            self.failed(reason)
+
+class FileSender():
+    # Starts and tracks outgoing transfers, matching the outbox streamer
+    # signature. caps_for(delivery_hash) gives a peer's capability bits,
+    # which decide whether files go to it compressed.
+    def __init__(self, app_name, caps_for=None):
+        self.app_name = app_name
+        self.caps_for = caps_for
+        self.lock = threading.Lock()
+        self.transfers = []
+
+    def send(self, destination, source, path, delivered, failed, progress=None, name=None):
+        def finished(callback):
+            def wrapper(*args):
+                with self.lock:
+                    if transfer in self.transfers:
+                        self.transfers.remove(transfer)
+                callback(*args)
+            return wrapper
+        caps = self.caps_for(destination.hash.hex()) if self.caps_for else 0
+        transfer = FileTransfer(path, destination, source.identity, self.app_name,
+                                finished(delivered), finished(failed), progress, caps, name)
+        with self.lock:
+            self.transfers.append(transfer)
+        transfer.start()
+        return transfer
+
+    @property
+    def status_text(self):
+        with self.lock:
+            active = list(self.transfers)
+        return " | ".join(f"Sending {t.name} {round(t.progress*100)}%" for t in active)
+
+class FileReceiver():
+    # Accepts offered files on APP_NAME.file and saves them in store, or
+    # under save_dir without one. Chunks are written in place into a
+    # partial file beside them that outlives dropped links and restarts,
+    # and the file is only kept if it matches the offered hash.
+    # on_received(sender_hash, path, file_hash, name) is called once it is
+    # in place, with the sender's LXMF delivery hash. Offers of a file the
+    # store already holds are answered OFFER_HAVE when is_known(sender_hash)
+    # says the sender is a contact, and logged right away against the
+    # stored copy. Anyone else has to send the file.
+    # Partials nobody resumed within RESUME_TTL are removed on start.
+    # find_base(name) lists the hashes of earlier versions of a file, newest
+    # first, for delta transfers. Deltas need a store to rebuild from.
+    MAX_PENDING  = 4
+    FREE_MARGIN  = 64*1024*1024
+    RESUME_TTL   = 60*60*24*7
+
+    def __init__(self, save_dir=RECEIVE_DIR, on_received=None, store=None, ledger=None, find_base=None, is_known=None):
+        self.save_dir = save_dir
+        self.on_received = on_received
+        self.is_known = is_known
+        self.store = store
+        self.ledger = ledger or MemoryLedger()
+        self.find_base = find_base if store else None
+        self.lock = threading.Lock()
+        self.offers = {}
+        self.destination = None
+        self.received = 0
+        self.resumed = 0
+        self.deltas = 0
+        self.unpacked = 0
+        self.deduplicated = 0
+        self.declined = 0
+        self.failed = 0
+
+    @property
+    def partial_dir(self):
+        return self.store.root if self.store else self.save_dir
+
+    def start(self, identity, app_name):
+        if self.store == None:
+            remove_partials(self.save_dir)
+        for path in self.ledger.expire(self.RESUME_TTL):
+            discard(path)
+        self.destination = file_destination(identity, app_name, RNS.Destination.IN)
+        self.destination.set_link_established_callback(self.__link_established)
+        self.destination.register_request_handler(OFFER_PATH, response_generator=self.__offer, allow=RNS.Destination.ALLOW_ALL)
+        self.destination.register_request_handler(SIGNATURE_PATH, response_generator=self.__signature, allow=RNS.Destination.ALLOW_ALL)
+        self.destination.register_request_handler(COMPLETE_PATH, response_generator=self.__complete, allow=RNS.Destination.ALLOW_ALL)
+        return self.destination
+
+    def __link_established(self, link):
+        link.set_resource_strategy(RNS.Link.ACCEPT_APP)
+        link.set_resource_callback(self.__advertised)
+        link.set_resource_started_callback(self.__started)
+        link.set_resource_concluded_callback(self.__concluded)
+        link.set_link_closed_callback(self.__link_closed)
+
+    def __offer(self, path, data, request_id, link_id, remote_identity, requested_at):
+        try:
+            name = os.path.basename(str(data["name"]))
+            size = int(data["size"])
+            digest = bytes(data["hash"])
+            proposed = data.get("chunk")
+            proposed = int(proposed) if proposed != None else None
+            base = data.get("base")
+            if base != None:
+                base, delta_size, delta_hash = bytes(base), int(data["delta_size"]), bytes(data["delta_hash"])
+            codec = data.get("codec")
+            if codec != None:
+                codec, packed_size, packed_hash = int(codec), int(data["packed_size"]), bytes(data["packed_hash"])
+        except Exception:
+            self.declined += 1
+            return OFFER_DECLINED
+        if remote_identity == None or not name or size < 0:
+            self.declined += 1
+            return OFFER_DECLINED
+        sender = RNS.Destination.hash_from_name_and_identity("lxmf.delivery", remote_identity).hex()
+
+        known = self.is_known != None and self.is_known(sender)
+        stored = self.store.find(digest.hex()) if known and self.store else None
+        if stored:
+            self.deduplicated += 1
+            RNS.log(f"Already have {name} offered by {sender}, skipping the transfer", RNS.LOG_DEBUG)
+            if self.on_received:
+                self.on_received(sender, stored, digest.hex(), name)
+            return OFFER_HAVE
+        if base != None:
+            return self.__delta_offer(link_id, name, digest, base, delta_size, delta_hash, sender, proposed)
+        if codec != None:
+            return self.__packed_offer(link_id, name, digest, size, codec, packed_size, packed_hash, sender, proposed)
+
+        os.makedirs(self.partial_dir, exist_ok=True)
+        with self.lock:
+            if len(self.offers) >= self.MAX_PENDING or shutil.disk_usage(self.partial_dir).free < size+self.FREE_MARGIN:
+                self.declined += 1
+                return OFFER_DECLINED
+            offer = {"name": name, "size": size, "hash": digest, "file_hash": digest, "sender": sender, "resource": None, "chunk_size": None}
+            if proposed != None:
+                self.__resume(offer, proposed)
+                # Naming a stored version, and signing it, tells the peer
+                # what the store holds, so only contacts are offered one
+                if known and data.get("delta") and self.find_base and size <= DELTA_MAX and not any(offer["bitmap"]):
+                    offer["base_hash"] = self.__find_base(name, digest)
+            self.offers[link_id] = offer
+        RNS.log(f"Accepted offer of {name}, {size} bytes from {sender}", RNS.LOG_DEBUG)
+        if offer["chunk_size"] == None:
+            return OFFER_ACCEPTED
+        if offer.get("base_hash"):
+            return [OFFER_ACCEPTED, offer["chunk_size"], bytes(offer["bitmap"]), offer["base_hash"]]
+        return [OFFER_ACCEPTED, offer["chunk_size"], bytes(offer["bitmap"])]
+
+    def __find_base(self, name, digest):
+        for version in self.find_base(name):
+            if version != digest.hex() and self.store.find(version):
+                return bytes.fromhex(version)
+        return None
+
+    def __signature(self, path, data, request_id, link_id, remote_identity, requested_at):
+        # Only the version proposed in answer to this link's offer is signed
+        with self.lock:
+            offer = self.offers.get(link_id)
+        if offer == None or offer.get("base_hash") == None or data != offer["base_hash"] or remote_identity == None:
+            return None
+        sender = RNS.Destination.hash_from_name_and_identity("lxmf.delivery", remote_identity).hex()
+        if sender != offer["sender"] or self.is_known == None or not self.is_known(sender):
+            return None
+        base_path = self.store.find(data.hex())
+        return signature(base_path) if base_path else None
+
+    def __delta_offer(self, link_id, name, digest, base, size, delta_hash, sender, proposed):
+        # Replaces the pending whole-file offer on this link, which has not
+        # had a chunk yet, with the delta against the proposed version
+        with self.lock:
+            pending = self.offers.get(link_id)
+            base_path = self.store.find(base.hex()) if self.store else None
+            if pending == None or pending["file_hash"] != digest or pending.get("base_hash") != base or base_path == None or proposed == None:
+                self.declined += 1
+                return OFFER_DECLINED
+            offer = {"name": name, "size": size, "hash": delta_hash, "file_hash": digest, "sender": sender, "resource": None,
+                     "chunk_size": None, "base_hash": base, "base": base_path, "file_size": pending["size"]}
+            self.__replace_offer(link_id, pending, offer, proposed)
+        RNS.log(f"Accepted {name} from {sender} as a {size} byte delta", RNS.LOG_DEBUG)
+        return [OFFER_ACCEPTED, offer["chunk_size"], bytes(offer["bitmap"])]
+
+    def __packed_offer(self, link_id, name, digest, file_size, codec, size, packed_hash, sender, proposed):
+        # Replaces the pending whole-file offer on this link, which has not
+        # had a chunk yet, with the file compressed. Declining leaves the
+        # whole-file offer in place for the sender to fall back on.
+        with self.lock:
+            pending = self.offers.get(link_id)
+            if pending == None or pending["file_hash"] != digest or pending["chunk_size"] == None or any(pending["bitmap"]) \
+                    or codec not in file_codecs(LOCAL_CAPS) or proposed == None:
+                self.declined += 1
+                return OFFER_DECLINED
+            offer = {"name": name, "size": size, "hash": packed_hash, "file_hash": digest, "file_size": file_size, "sender": sender,
+                     "resource": None, "chunk_size": None, "codec": codec}
+            self.__replace_offer(link_id, pending, offer, proposed)
+        RNS.log(f"Accepted {name} from {sender} compressed to {size} bytes", RNS.LOG_DEBUG)
+        return [OFFER_ACCEPTED, offer["chunk_size"], bytes(offer["bitmap"])]
+
+    def __replace_offer(self, link_id, pending, offer, proposed):
+        # Called with the lock held
+        discard(pending["partial"])
+        self.ledger.drop(LEDGER_RECV, pending["hash"].hex(), pending["sender"])
+        self.__resume(offer, proposed)
+        self.offers[link_id] = offer
+
+    def __resume(self, offer, proposed):
+        # Picks up the partial of an earlier attempt at the same file from
+        # the same sender, or starts one at the proposed chunk size
+        key = (LEDGER_RECV, offer["hash"].hex(), offer["sender"])
+        state = self.ledger.load(*key)
+        if state and state["size"] == offer["size"] and os.path.exists(state["path"]):
+            offer.update(chunk_size=state["chunk_size"], bitmap=state["bitmap"], partial=state["path"])
+            if any(state["bitmap"]):
+                self.resumed += 1
+                RNS.log(f"Resuming {offer['name']} from {offer['sender']}", RNS.LOG_DEBUG)
+            return
+        chunk_size = max(MIN_CHUNK, min(MAX_CHUNK, proposed))
+        partial = os.path.join(self.partial_dir, f".{offer['hash'].hex()[:32]}.{offer['sender'][:8]}{RESUME_SUFFIX}")
+        open(partial, "wb").close()
+        bitmap = new_bitmap(chunk_count(offer["size"], chunk_size))
+        offer.update(chunk_size=chunk_size, bitmap=bitmap, partial=partial)
+        self.ledger.save(*key, offer["name"], offer["size"], chunk_size, bitmap, partial)
+
+    def __advertised(self, advertisement):
+        # Every chunk, and every segment of a file sent whole, is
+        # advertised separately
+        with self.lock:
+            return advertisement.link.link_id in self.offers
+
+    def __started(self, resource):
+        with self.lock:
+            offer = self.offers.get(resource.link.link_id)
+            if offer:
+                offer["resource"] = resource
+
+    def __concluded(self, resource):
+        with self.lock:
+            offer = self.offers.get(resource.link.link_id)
+            if offer == None:
+                return
+            if resource.status != RNS.Resource.COMPLETE and offer["chunk_size"] == None:
+                self.offers.pop(resource.link.link_id, None)
+        if resource.status != RNS.Resource.COMPLETE:
+            self.failed += 1
+            RNS.log(f"Receiving {offer['name']} from {offer['sender']} failed", RNS.LOG_DEBUG)
+            return
+
+        if offer["chunk_size"] != None:
+            try:
+                self.__write_chunk(offer, resource.data)
+            except Exception as e:
+                RNS.log(f"Dropped a chunk of {offer['name']} from {offer['sender']}: {e}", RNS.LOG_WARNING)
+            return
+
+        try:
+            path, file_hash = self.__save(offer, resource.data)
+        except Exception as e:
+            self.failed += 1
+            RNS.log(f"Could not save {offer['name']} from {offer['sender']}: {e}", RNS.LOG_ERROR)
+            return
+        finally:
+            with self.lock:
+                self.offers.pop(resource.link.link_id, None)
+        self.received += 1
+        if self.on_received:
+            self.on_received(offer["sender"], path, file_hash, offer["name"])
+
+    def __write_chunk(self, offer, data):
+        if not hasattr(data, "read"):
+            data = io.BytesIO(data)
+        try:
+            data.seek(0)
+            file_hash, index = CHUNK_HEADER.unpack(data.read(CHUNK_HEADER.size))
+            chunk = data.read(offer["chunk_size"]+1)
+        finally:
+            data.close()
+        if file_hash != offer["hash"] or index >= chunk_count(offer["size"], offer["chunk_size"]):
+            raise TransferError(f"chunk {index} is not part of this file")
+        if len(chunk) != chunk_length(offer["size"], offer["chunk_size"], index):
+            raise TransferError(f"chunk {index} has the wrong length")
+
+        with open(offer["partial"], "r+b") as f:
+            f.seek(index*offer["chunk_size"])
+            f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            bitmap_set(offer["bitmap"], index)
+            self.ledger.mark(LEDGER_RECV, offer["hash"].hex(), offer["sender"], offer["bitmap"])
+
+    def __complete(self, path, data, request_id, link_id, remote_identity, requested_at):
+        # Every chunk is in, verify the partial and move it into place. A
+        # partial that does not match is dropped so the next attempt starts
+        # clean.
+        with self.lock:
+            offer = self.offers.get(link_id)
+        if offer == None or offer["chunk_size"] == None or data != offer["hash"]:
+            return False
+        if missing_chunks(offer["bitmap"], chunk_count(offer["size"], offer["chunk_size"])):
+            return False
+
+        key = (LEDGER_RECV, offer["hash"].hex(), offer["sender"])
+        try:
+            if os.path.getsize(offer["partial"]) != offer["size"] or file_digest(offer["partial"]) != offer["hash"]:
+                raise TransferError("hash mismatch")
+            if offer.get("base"):
+                stored, file_hash = self.__rebuild(offer)
+            elif offer.get("codec"):
+                stored, file_hash = self.__unpack(offer)
+            elif self.store:
+                stored, file_hash = self.store.put_file(offer["partial"], move=True, suffix=os.path.splitext(offer["name"])[1])
+            else:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                stored = unique_path(self.save_dir, f"{timestamp}_{offer['name']}")
+                os.replace(offer["partial"], stored)
+                sync_dir(self.save_dir)
+                file_hash = offer["hash"].hex()
+        except Exception as e:
+            self.failed += 1
+            RNS.log(f"Could not save {offer['name']} from {offer['sender']}: {e}", RNS.LOG_ERROR)
+            discard(offer["partial"])
+            return False
+        finally:
+            self.ledger.drop(*key)
+            with self.lock:
+                self.offers.pop(link_id, None)
+        self.received += 1
+        if self.on_received:
+            self.on_received(offer["sender"], stored, file_hash, offer["name"])
+        return True
+
+    def __rebuild(self, offer):
+        source = DeltaReader(offer["base"], open(offer["partial"], "rb"), offer["base_hash"], offer["file_size"])
+        try:
+            stored = self.store.put(source, offer["file_hash"], os.path.splitext(offer["name"])[1])
+        finally:
+            source.close()
+        discard(offer["partial"])
+        self.deltas += 1
+        RNS.log(f"Rebuilt {offer['name']} from a {offer['size']} byte delta", RNS.LOG_DEBUG)
+        return stored
+
+    def __unpack(self, offer):
+        # The offered size bounds the output, so a small compressed file
+        # cannot unpack into a disk-filling one
+        source = DecompressReader(open(offer["partial"], "rb"), offer["codec"], offer["file_size"])
+        try:
+            if self.store:
+                stored = self.store.put(source, offer["file_hash"], os.path.splitext(offer["name"])[1])
+            else:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                path = save_atomically(source, self.save_dir, f"{timestamp}_{offer['name']}", offer["file_hash"])
+                stored = path, offer["file_hash"].hex()
+        finally:
+            source.close()
+        discard(offer["partial"])
+        self.unpacked += 1
+        RNS.log(f"Unpacked {offer['name']} from {offer['size']} compressed bytes", RNS.LOG_DEBUG)
+        return stored
+
+    def __save(self, offer, data):
+        # RNS hands completed resources over as a file in its storage,
+        # small ones may arrive as bytes
+        if not hasattr(data, "read"):
+            data = io.BytesIO(data)
+        try:
+            data.seek(0)
+            if self.store:
+                return self.store.put(data, offer["hash"], os.path.splitext(offer["name"])[1])
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            return save_atomically(data, self.save_dir, f"{timestamp}_{offer['name']}", offer["hash"]), offer["hash"].hex()
+        finally:
+            data.close()
+
+    def __link_closed(self, link):
+        with self.lock:
+            self.offers.pop(link.link_id, None)
+
+    def __offer_progress(self, offer):
+        resource = offer["resource"]
+        partial = resource.get_progress() if resource != None else 0
+        if offer["chunk_size"] == None:
+            return partial
+        chunks = chunk_count(offer["size"], offer["chunk_size"])
+        return min(1.0, (chunks-len(missing_chunks(offer["bitmap"], chunks))+partial)/chunks)
+
+    @property
+    def status_text(self):
+        with self.lock:
+            active = [offer for offer in self.offers.values() if offer["resource"] != None]
+        return " | ".join(f"Receiving {o['name']} {round(self.__offer_progress(o)*100)}%" for o in active)
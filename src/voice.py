@@ -5,6 +5,7 @@ import time
 import logging
 
 from globals import refresh_needed
+from airtime_utils import airtime, TRAFFIC_VOICE
 
 from LXST._version import __version__
 from Telephony import Telephone
@@ -38,7 +39,10 @@ class ReticulumTelephone():
     WAIT_TIME        = 60
     PATH_TIME        = 10
 
-    def __init__(self, identity, owner = None, service = False, speaker=None, microphone=None, ringer=None, auto_answer=False, receive_sink=None):
+    # Share of the airtime budget kept free for call audio while in a call
+    VOICE_RESERVATION = 0.5
+
+    def __init__(self, identity, owner = None, service = False, speaker=None, microphone=None, ringer=None, auto_answer=False, receive_sink=None, auto_announce=True):
         self.identity          = identity
         self.service           = service
         self.owner             = owner
@@ -61,7 +65,7 @@ class ReticulumTelephone():
         self.names             = {}
         self.auto_answer       = auto_answer
         
-        self.telephone  = Telephone(self.identity, ring_time=self.RING_TIME, wait_time=self.WAIT_TIME, auto_answer=self.auto_answer, receive_sink=receive_sink)
+        self.telephone  = Telephone(self.identity, ring_time=self.RING_TIME, wait_time=self.WAIT_TIME, auto_answer=self.auto_answer, receive_sink=receive_sink, auto_announce=auto_announce)
         self.telephone.set_ringing_callback(self.ringing)
         self.telephone.set_established_callback(self.call_established)
         self.telephone.set_ended_callback(self.call_ended)
@@ -92,6 +96,10 @@ class ReticulumTelephone():
     def announce(self, attached_interface=None):
         self.telephone.announce(attached_interface=attached_interface)
 
+    @property
+    def destination(self):
+        return self.telephone.destination
+
     @property
     def is_available(self):
         return self.state == self.STATE_AVAILABLE
@@ -223,6 +231,7 @@ class ReticulumTelephone():
                 logging.info(f"Call to {RNS.prettyhexrep(self.caller.hash)} could not be connected")
             self.direction = None
             self.state = self.STATE_AVAILABLE
+            airtime.release(TRAFFIC_VOICE)
             RNS.log(f"State: is_in_call: {self.is_in_call}, is_ringing: {self.is_ringing}, call_is_connecting: {self.call_is_connecting}, is_available: {self.is_available}", RNS.LOG_DEBUG)
             if refresh_needed: refresh_needed.set()
 
@@ -230,6 +239,7 @@ class ReticulumTelephone():
         global refresh_needed
         if self.call_is_connecting or self.is_ringing:
             self.state = self.STATE_IN_CALL
+            airtime.reserve(TRAFFIC_VOICE, self.VOICE_RESERVATION)
             if refresh_needed: refresh_needed.set()
             RNS.log(f"Call established with {RNS.prettyhexrep(self.caller.hash)}", RNS.LOG_DEBUG)
             logging.info(f"Call established with {RNS.prettyhexrep(self.caller.hash)}")